@@ -0,0 +1,484 @@
+'''
+Asset build
+
+Compiles the models in models/ (egg, and gltf/glb if the loader plugin is
+installed) to bam files next to them, which load much faster as they do not
+have to be parsed. The game loads the bam file of a model before any other
+(see Obj3D.modelTypes), unless it is older than its source.
+
+Also compiles every texture in models/ (such as the maps of the models) to
+txo files in models/txo/<quality>/, one per texture quality: scaled down to
+fit the size of the quality, with their mipmaps already made, and compressed
+the way the graphics card keeps them (DXT). The game swaps the textures of
+the models for the ones of its texture quality (see Obj3D.setTextureQuality).
+
+The cars and passengers also get less detailed versions of their models, in
+models/lod/, which the game shows when they are far from the camera (see
+Obj3D.useLods). They are made by vertex clustering: the vertices of the model
+are snapped to a grid, and the ones in the same cell merged into one, with
+coarser grids for the less detailed versions.
+
+A manifest (models/manifest.json) keeps the hash of every source file and the
+Panda3D version it was compiled with, so that only the files that changed are
+compiled again, for example before packaging the game:
+    python AssetBuilder.py
+    python AssetBuilder.py --force --qualities low high
+'''
+
+from Obj3D import *
+
+import argparse
+import hashlib
+import json
+import sys
+import time
+
+class AssetBuilder(object):
+    # NOTE: Bump the version whenever the way the assets are built changes
+    version = 1
+
+    # Longest side of the compiled textures, by texture quality
+    textureQualities = { "low": 256, "medium": 512, "high": 1024 }
+
+    textureTypes = [ "png", "jpg", "jpeg", "tif", "tiff", "tga", "bmp" ]
+
+    # Models that get less detailed versions, and the number of grid cells
+    # along the longest side of the model for each version
+    lodPrefixes = [ "car_", "passenger_" ]
+    lodGridSizes = [ 32, 16, 8 ]
+
+    def __init__(self, modelDir="models", manifestFile=None):
+        self.modelDir = modelDir
+        self.manifestFile = f"{modelDir}/manifest.json" if manifestFile == None else manifestFile
+
+        # Compiled textures and less detailed models, laid out in the model directory
+        # the same way as the game looks for them in models/ (see Obj3D)
+        self.compiledTextureDir = f"{modelDir}/txo"
+        self.lodDir = f"{modelDir}/lod"
+
+        self.manifest = self.loadManifest()
+
+    # Everything in the manifest is built again if the build or Panda3D changed,
+    # as bam files can only be read by the same (or a newer) version of Panda3D
+    def getBuildKey(self):
+        return f"{AssetBuilder.version} {PandaSystem.getVersionString()}"
+
+    # The saved manifest, or an empty one if there is none yet (or it is from another build)
+    def loadManifest(self):
+        manifest = { "build": self.getBuildKey(), "models": {}, "textures": {}, "lods": {} }
+
+        try:
+            with open(self.manifestFile, "r") as f:
+                savedManifest = json.load(f)
+        except (FileNotFoundError, ValueError):
+            savedManifest = {}
+
+        if savedManifest.get("build") == manifest["build"]:
+            manifest.update(savedManifest)
+
+        return manifest
+
+    def saveManifest(self):
+        # Written under another name first, so that stopping halfway keeps the last manifest
+        tempFile = f"{self.manifestFile}.tmp"
+        with open(tempFile, "w") as f:
+            json.dump(self.manifest, f, indent=2, sort_keys=True)
+
+        os.replace(tempFile, self.manifestFile)
+
+    @staticmethod
+    def hashFile(fileName):
+        sha = hashlib.sha1()
+
+        with open(fileName, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha.update(chunk)
+
+        return sha.hexdigest()
+
+    # Model files that can be compiled, in the model directory
+    def findModelSources(self):
+        sourceTypes = [ modelType for modelType in Obj3D.modelTypes if modelType != "bam" ]
+
+        sources = {}
+        for f in sorted(os.listdir(self.modelDir)):
+            model, ext = os.path.splitext(f)
+            ext = ext[1:]
+
+            # Only one source per model, in the same order as the game picks them
+            if ext in sourceTypes and (model not in sources or
+               sourceTypes.index(ext) < sourceTypes.index(os.path.splitext(sources[model])[1][1:])):
+                sources[model] = f"{self.modelDir}/{f}"
+
+        return sorted(sources.values())
+
+    # Texture files in the model directory (and the folders in it), except the compiled ones
+    def findTextureSources(self):
+        compiledDir = os.path.normpath(self.compiledTextureDir)
+
+        sources = []
+        for path, dirs, files in os.walk(self.modelDir):
+            if os.path.normpath(path) == compiledDir:
+                dirs.clear()
+                continue
+
+            for f in files:
+                if os.path.splitext(f)[1][1:].lower() in AssetBuilder.textureTypes:
+                    sources.append(os.path.join(path, f).replace(os.sep, "/"))
+
+        return sorted(sources)
+
+    # Whether an asset has to be compiled again
+    # kind is "models" or "textures", and name the key of the asset in the manifest
+    def isStale(self, kind, name, sourceHash):
+        entry = self.manifest[kind].get(name)
+
+        return entry == None or entry["hash"] != sourceHash or not os.path.exists(entry["output"])
+
+    @staticmethod
+    def loadModel(sourceFile):
+        # NOTE: Not from the model pool, in case an older version of the model is in there
+        options = LoaderOptions(LoaderOptions.LF_no_cache | LoaderOptions.LF_report_errors)
+        node = Loader.getGlobalPtr().loadSync(Filename.fromOsSpecific(os.path.abspath(sourceFile)), options)
+
+        if node == None:
+            raise Exception(f"Model {sourceFile} cannot be loaded")
+
+        return NodePath(node)
+
+    # Written under another name first, so that the game never loads half a file
+    # NOTE: In the same folder, as the textures are saved relative to the bam file
+    @staticmethod
+    def writeModel(model, outputFile):
+        tempFile = f"{outputFile}.{os.getpid()}.tmp"
+        if not model.writeBamFile(Filename.fromOsSpecific(os.path.abspath(tempFile))):
+            raise Exception(f"Model cannot be written to {outputFile}")
+
+        os.replace(tempFile, outputFile)
+
+    # Compile a model to a bam file next to it
+    # Returns the bam file
+    def buildModel(self, sourceFile):
+        outputFile = os.path.splitext(sourceFile)[0] + ".bam"
+
+        AssetBuilder.writeModel(AssetBuilder.loadModel(sourceFile), outputFile)
+
+        return outputFile
+
+    # Compile the models that changed since the last build (or every model)
+    # Returns the list of models compiled
+    def buildModels(self, force=False):
+        sources = self.findModelSources()
+        built = []
+
+        for sourceFile in sources:
+            sourceHash = AssetBuilder.hashFile(sourceFile)
+
+            if not force and not self.isStale("models", sourceFile, sourceHash):
+                continue
+
+            startTime = time.time()
+
+            try:
+                outputFile = self.buildModel(sourceFile)
+            except Exception as e:
+                print(f"{sourceFile}: {e}", file=sys.stderr)
+                continue
+
+            self.manifest["models"][sourceFile] = { "hash": sourceHash, "output": outputFile }
+            self.saveManifest()
+
+            built.append(sourceFile)
+            print(f"{sourceFile} -> {outputFile} ({time.time() - startTime:.2f}s)")
+
+        # Models whose source is gone are removed too, so that the game does not keep loading them
+        for sourceFile in list(self.manifest["models"].keys()):
+            if sourceFile in sources:
+                continue
+
+            outputFile = self.manifest["models"].pop(sourceFile)["output"]
+            if os.path.exists(outputFile):
+                os.remove(outputFile)
+
+            print(f"{sourceFile} removed, deleted {outputFile}")
+
+        self.saveManifest()
+
+        return built
+
+    # Compiled texture of a source texture (see Obj3D.getCompiledTextureFile)
+    def getCompiledTextureFile(self, sourceFile, quality):
+        sourceFile = os.path.relpath(sourceFile, self.modelDir).replace(os.sep, "/")
+        return f"{self.compiledTextureDir}/{quality}/{sourceFile}.txo"
+
+    # Compile a texture for a texture quality
+    # Returns the txo file
+    def buildTexture(self, sourceFile, quality):
+        outputFile = self.getCompiledTextureFile(sourceFile, quality)
+        maxSize = AssetBuilder.textureQualities[quality]
+
+        image = PNMImage()
+        if not image.read(Filename.fromOsSpecific(sourceFile)):
+            raise Exception(f"Texture {sourceFile} cannot be loaded")
+
+        # Scaled down to fit the size of the quality (keeping its shape)
+        scale = maxSize / max(image.getXSize(), image.getYSize())
+        if scale < 1:
+            scaledImage = PNMImage(
+                max(1, int(image.getXSize() * scale)), max(1, int(image.getYSize() * scale)),
+                image.getNumChannels(), image.getMaxval()
+            )
+            scaledImage.gaussianFilterFrom(1.0, image)
+            image = scaledImage
+
+        texture = Texture(os.path.basename(sourceFile))
+        texture.load(image)
+
+        texture.setMinfilter(SamplerState.FT_linear_mipmap_linear)
+        texture.generateRamMipmapImages()
+
+        # DXT5 keeps the alpha channel, DXT1 does not
+        compression = Texture.CM_dxt5 if image.hasAlpha() else Texture.CM_dxt1
+        if not texture.compressRamImage(compression, Texture.QL_default, None):
+            print(f"{sourceFile}: cannot be compressed, compiled without compression", file=sys.stderr)
+
+        os.makedirs(os.path.dirname(outputFile), exist_ok=True)
+
+        # Written under another name first, so that the game never loads half a file
+        tempFile = f"{outputFile}.{os.getpid()}.tmp.txo"
+        if not texture.write(Filename.fromOsSpecific(tempFile)):
+            raise Exception(f"Texture {sourceFile} cannot be written to {outputFile}")
+
+        os.replace(tempFile, outputFile)
+
+        return outputFile
+
+    # Compile the textures that changed since the last build (or every texture), for every quality given
+    # Returns the list of textures compiled, as (texture, quality)
+    def buildTextures(self, qualities=None, force=False):
+        qualities = list(AssetBuilder.textureQualities.keys()) if qualities == None else qualities
+        sources = self.findTextureSources()
+        built = []
+
+        for sourceFile in sources:
+            sourceHash = AssetBuilder.hashFile(sourceFile)
+
+            for quality in qualities:
+                name = f"{quality}:{sourceFile}"
+
+                if not force and not self.isStale("textures", name, sourceHash):
+                    continue
+
+                startTime = time.time()
+
+                try:
+                    outputFile = self.buildTexture(sourceFile, quality)
+                except Exception as e:
+                    print(f"{sourceFile}: {e}", file=sys.stderr)
+                    continue
+
+                self.manifest["textures"][name] = { "hash": sourceHash, "output": outputFile }
+                built.append((sourceFile, quality))
+                print(f"{sourceFile} -> {outputFile} ({time.time() - startTime:.2f}s)")
+
+            self.saveManifest()
+
+        # Textures whose source is gone are removed too
+        for name in list(self.manifest["textures"].keys()):
+            if name.split(":", 1)[1] in sources:
+                continue
+
+            outputFile = self.manifest["textures"].pop(name)["output"]
+            if os.path.exists(outputFile):
+                os.remove(outputFile)
+
+            print(f"{name.split(':', 1)[1]} removed, deleted {outputFile}")
+
+        self.saveManifest()
+
+        return built
+
+    # Less detailed copy of a model, by vertex clustering on a grid of gridSize cells along its longest side
+    # Every vertex is moved to the mean position of the vertices in its cell (keeping the
+    # other columns, such as the normal and texture coordinates, of the first one),
+    # and the triangles that lose their area are dropped
+    @staticmethod
+    def decimateModel(model, gridSize):
+        model = model.copyTo(NodePath())
+
+        minPoint, maxPoint = model.getTightBounds()
+        cellSize = max(maxPoint - minPoint) / gridSize
+
+        for geomNodePath in model.findAllMatches("**/+GeomNode"):
+            geomNode = geomNodePath.node()
+
+            # Grid cells in the coordinates of the whole model
+            mat = geomNodePath.getMat(model)
+
+            for i in range(geomNode.getNumGeoms() - 1, -1, -1):
+                geom = AssetBuilder.decimateGeom(geomNode.getGeom(i), mat, minPoint, cellSize)
+
+                if geom == None:
+                    geomNode.removeGeom(i)
+                else:
+                    geomNode.setGeom(i, geom)
+
+        return model
+
+    # Returns the decimated geom, or None if nothing is left of it
+    @staticmethod
+    def decimateGeom(geom, mat, minPoint, cellSize):
+        vertexData = geom.getVertexData()
+        reader = GeomVertexReader(vertexData, "vertex")
+
+        # Cell of every vertex, and the vertices kept: one per cell
+        cells = {}
+        vertexCells = []
+        keptRows = []
+        sums = []
+
+        for row in range(vertexData.getNumRows()):
+            point = reader.getData3()
+            x, y, z = (mat.xformPoint(point) - minPoint) / cellSize
+            cell = (math.floor(x), math.floor(y), math.floor(z))
+
+            if cell not in cells:
+                cells[cell] = len(keptRows)
+                keptRows.append(row)
+                sums.append([ LVector3f(0, 0, 0), 0 ])
+
+            index = cells[cell]
+            vertexCells.append(index)
+            sums[index][0] += point
+            sums[index][1] += 1
+
+        triangles = GeomTriangles(Geom.UHStatic)
+        seen = set()
+
+        for primitive in geom.getPrimitives():
+            primitive = primitive.decompose()
+            if not isinstance(primitive, GeomTriangles):
+                continue
+
+            for face in range(primitive.getNumPrimitives()):
+                start = primitive.getPrimitiveStart(face)
+                a, b, c = [ vertexCells[primitive.getVertex(start + k)] for k in range(3) ]
+
+                if a == b or b == c or a == c or tuple(sorted((a, b, c))) in seen:
+                    continue
+
+                seen.add(tuple(sorted((a, b, c))))
+                triangles.addVertices(a, b, c)
+
+        if triangles.getNumPrimitives() == 0:
+            return None
+
+        newVertexData = GeomVertexData(vertexData.getName(), vertexData.getFormat(), Geom.UHStatic)
+        newVertexData.setNumRows(len(keptRows))
+
+        thread = Thread.getCurrentThread()
+        for index, row in enumerate(keptRows):
+            newVertexData.copyRowFrom(index, vertexData, row, thread)
+
+        writer = GeomVertexWriter(newVertexData, "vertex")
+        for total, count in sums:
+            writer.setData3(total / count)
+
+        newGeom = Geom(newVertexData)
+        newGeom.addPrimitive(triangles)
+
+        return newGeom
+
+    @staticmethod
+    def countTriangles(model):
+        count = 0
+        for geomNodePath in model.findAllMatches("**/+GeomNode"):
+            for geom in geomNodePath.node().getGeoms():
+                for primitive in geom.getPrimitives():
+                    primitive = primitive.decompose()
+                    count += primitive.getNumPrimitives() if isinstance(primitive, GeomTriangles) else 0
+
+        return count
+
+    # Make the less detailed versions of a model
+    # Returns the list of files written, from the most to the least detailed
+    def buildLods(self, sourceFile):
+        model = AssetBuilder.loadModel(sourceFile)
+        modelName = os.path.splitext(os.path.basename(sourceFile))[0]
+
+        os.makedirs(self.lodDir, exist_ok=True)
+
+        outputFiles = []
+        counts = [ AssetBuilder.countTriangles(model) ]
+
+        for level, gridSize in enumerate(AssetBuilder.lodGridSizes):
+            lod = AssetBuilder.decimateModel(model, gridSize)
+
+            outputFile = f"{self.lodDir}/{modelName}-{level + 1}.bam"
+            AssetBuilder.writeModel(lod, outputFile)
+
+            outputFiles.append(outputFile)
+            counts.append(AssetBuilder.countTriangles(lod))
+
+        print(f"{sourceFile} -> {len(outputFiles)} versions, triangles: {' -> '.join(str(count) for count in counts)}")
+
+        return outputFiles
+
+    # Make the less detailed versions of the models that changed since the last build (or of every model)
+    # Returns the list of models
+    def buildAllLods(self, force=False):
+        sources = [
+            sourceFile for sourceFile in self.findModelSources()
+            if any(os.path.basename(sourceFile).startswith(prefix) for prefix in AssetBuilder.lodPrefixes)
+        ]
+        built = []
+
+        for sourceFile in sources:
+            sourceHash = AssetBuilder.hashFile(sourceFile)
+            entry = self.manifest["lods"].get(sourceFile)
+
+            if not force and entry != None and entry["hash"] == sourceHash \
+               and all(os.path.exists(f) for f in entry["outputs"]):
+                continue
+
+            try:
+                outputFiles = self.buildLods(sourceFile)
+            except Exception as e:
+                print(f"{sourceFile}: {e}", file=sys.stderr)
+                continue
+
+            self.manifest["lods"][sourceFile] = { "hash": sourceHash, "outputs": outputFiles }
+            self.saveManifest()
+
+            built.append(sourceFile)
+
+        for sourceFile in list(self.manifest["lods"].keys()):
+            if sourceFile in sources:
+                continue
+
+            for outputFile in self.manifest["lods"].pop(sourceFile)["outputs"]:
+                if os.path.exists(outputFile):
+                    os.remove(outputFile)
+
+            print(f"{sourceFile} removed, deleted its less detailed versions")
+
+        self.saveManifest()
+
+        return built
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile the game assets")
+    parser.add_argument("--models", default="models", help="Model directory (the compiled assets are written in it too)")
+    parser.add_argument("--force", action="store_true", help="Compile everything, even what has not changed")
+    parser.add_argument(
+        "--qualities", nargs="+", default=list(AssetBuilder.textureQualities.keys()),
+        choices=list(AssetBuilder.textureQualities.keys()), help="Texture qualities to compile"
+    )
+    args = parser.parse_args()
+
+    builder = AssetBuilder(args.models)
+    builtModels = builder.buildModels(args.force)
+    builtTextures = builder.buildTextures(args.qualities, args.force)
+    builtLods = builder.buildAllLods(args.force)
+
+    print(f"{len(builtModels)} models, {len(builtTextures)} textures and {len(builtLods)} sets of less detailed models compiled")
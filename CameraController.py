@@ -6,8 +6,9 @@ from direct.showbase.ShowBase import ShowBase
 from direct.showbase.DirectObject import DirectObject
 
 class CameraController(DirectObject):
-    def	__init__(self, initZoom=5, camPos=None, anchorPos=None, zoomInLimit=1, zoomOutLimit=1000, moveSpeed=0.5):
+    def	__init__(self, initZoom=5, camPos=None, anchorPos=None, zoomInLimit=1, zoomOutLimit=1000, moveSpeed=0.5, renderParent=None):
         self.enabled = True
+        self.renderParent = render if renderParent == None else renderParent
 
         base.disableMouse()
         
@@ -29,7 +30,7 @@ class CameraController(DirectObject):
         self.move = None
 
     def setupCamera(self):
-        self.camAnchor = render.attachNewNode("CameraAnchor")
+        self.camAnchor = self.renderParent.attachNewNode("CameraAnchor")
         self.camAnchor.setPos(self.anchorPos)
         
         base.camera.reparentTo(self.camAnchor)
@@ -45,9 +46,21 @@ class CameraController(DirectObject):
         self.accept("mouse1-up", self.setOrbit, [False])
 
     def setupTasks(self):
-        taskMgr.add(self.cameraOrbit, "Camera Orbit")
-        taskMgr.add(self.cameraZoom, "Camera Zoom")
-        taskMgr.add(self.cameraMove, "Camera Move")
+        self.tasks = [
+            taskMgr.add(self.cameraOrbit, "Camera Orbit"),
+            taskMgr.add(self.cameraZoom, "Camera Zoom"),
+            taskMgr.add(self.cameraMove, "Camera Move")
+        ]
+
+    # Stop controlling the camera, and leave it where it is (under render)
+    def destroy(self):
+        self.ignoreAll()
+
+        for task in self.tasks:
+            taskMgr.remove(task)
+
+        base.camera.wrtReparentTo(render)
+        self.camAnchor.removeNode()
         
     def setOrbit(self, orbit):
         if not self.enabled: return
@@ -0,0 +1,243 @@
+'''
+Car to car collisions
+
+Broadphase: sweep and prune along the track. Every car covers an interval
+of the distance along the center line of the track (see TrackFloor).
+The cars are kept sorted by the start of their interval from tick to tick,
+and sorted again with an insertion sort, which is O(n) as the order barely
+changes between ticks. Sweeping the sorted list then only pairs up cars
+whose intervals overlap, plus the cars on both sides of the start line.
+
+Narrowphase: the closest points of the two cars' wall collision capsules,
+seen from the top (see WallResolver).
+
+Cars that touch are pushed apart, half each, and if they are moving
+into each other they bump: equal masses, along the line between them,
+and what is left of their velocity along their heading becomes their speed.
+'''
+
+from Obj3D import *
+from WallResolver import *
+
+class CarCollider(object):
+    # How much of the speed towards each other is bounced back (0 to 1)
+    restitution = 0.3
+
+    def __init__(self, racetrack, cars, trackFloor):
+        self.racetrack = racetrack
+        self.cars = list(cars)
+
+        # The segment each car is on, and the distance along the track, come from the floor
+        self.trackFloor = trackFloor
+
+        self.footprints = [ WallResolver.getFootprint(car) for car in self.cars ]
+
+        # How far each car reaches from its center, along the track
+        self.extents = []
+        for pointA, pointB, radius in self.footprints:
+            self.extents.append((pointA - pointB).length() / 2 + radius)
+
+        self.maxExtent = max(self.extents) if len(self.extents) > 0 else 0
+
+        # Indices of the cars, sorted by the start of their intervals
+        self.order = list(range(len(self.cars)))
+
+        # Pairs of cars (by index) touching in the last tick
+        self.contacts = set()
+
+    # World space capsule of every car: (ax, ay, bx, by, radius, bottom, top)
+    def getCapsules(self):
+        capsules = []
+
+        for i, car in enumerate(self.cars):
+            pointA, pointB, radius = self.footprints[i]
+
+            mat = car.model.getMat()
+            ax, ay, az = mat.xformPoint(pointA)
+            bx, by, bz = mat.xformPoint(pointB)
+
+            capsules.append((
+                ax, ay, bx, by, radius,
+                min(az, bz) - radius, max(az, bz) + radius
+            ))
+
+        return capsules
+
+    # Distance along the track of every car
+    def getTrackDistances(self):
+        trackFloor = self.trackFloor
+
+        distances = []
+        for i, car in enumerate(self.cars):
+            x, y, _ = car.model.getPos()
+
+            segment = trackFloor.carSegments[i]
+            if segment == None:
+                _, segment = trackFloor.getHeight(x, y)
+
+            distances.append(trackFloor.getTrackDistance(x, y, segment))
+
+        return distances
+
+    # Pairs of cars (by index, lowest first) whose intervals along the track overlap,
+    # and whose bounding boxes overlap too
+    def sweep(self, capsules):
+        distances = self.getTrackDistances()
+        extents = self.extents
+
+        starts = [ distances[i] - extents[i] for i in range(len(distances)) ]
+        ends = [ distances[i] + extents[i] for i in range(len(distances)) ]
+
+        order = self.order
+
+        # Insertion sort by the start of the intervals
+        for i in range(1, len(order)):
+            index = order[i]
+            start = starts[index]
+
+            j = i - 1
+            while j >= 0 and starts[order[j]] > start:
+                order[j + 1] = order[j]
+                j -= 1
+
+            order[j + 1] = index
+
+        # Bounding boxes: (minX, maxX, minY, maxY)
+        boxes = []
+        for ax, ay, bx, by, radius, _, _ in capsules:
+            boxes.append((min(ax, bx) - radius, max(ax, bx) + radius, min(ay, by) - radius, max(ay, by) + radius))
+
+        def overlap(index, other):
+            minX, maxX, minY, maxY = boxes[index]
+            otherMinX, otherMaxX, otherMinY, otherMaxY = boxes[other]
+
+            return minX <= otherMaxX and otherMinX <= maxX and minY <= otherMaxY and otherMinY <= maxY
+
+        pairs = set()
+        for i in range(len(order)):
+            index = order[i]
+            end = ends[index]
+
+            for j in range(i + 1, len(order)):
+                other = order[j]
+                if starts[other] > end:
+                    break
+
+                if overlap(index, other):
+                    pairs.add((min(index, other), max(index, other)))
+
+        # The track is a loop, so the cars just before the start line
+        # can touch the ones just after it
+        trackLength = self.trackFloor.trackLength
+        reach = 2 * self.maxExtent
+
+        tail = []
+        for index in reversed(order):
+            if starts[index] < trackLength - 2 * reach:
+                break
+            tail.append(index)
+
+        for index in order:
+            if starts[index] > reach:
+                break
+
+            for other in tail:
+                if other == index:
+                    continue
+
+                if distances[index] + trackLength - distances[other] <= extents[index] + extents[other] \
+                   and overlap(index, other):
+                    pairs.add((min(index, other), max(index, other)))
+
+        # Same order on every run, regardless of how the cars were sorted
+        return sorted(pairs)
+
+    # Push the cars that touch apart
+    def resolve(self):
+        capsules = self.getCapsules()
+
+        contacts = set()
+        for i, j in self.sweep(capsules):
+            if self.resolvePair(i, j, capsules):
+                contacts.add((i, j))
+
+        # Only new contacts make a sound, like hitting a wall
+        for i, j in sorted(contacts - self.contacts):
+            self.cars[i].hitCar(self.cars[j])
+            self.cars[j].hitCar(self.cars[i])
+
+        self.contacts = contacts
+
+    # Returns whether cars i and j touch
+    def resolvePair(self, i, j, capsules):
+        ax, ay, bx, by, radius, bottom, top = capsules[i]
+        cx, cy, dx, dy, otherRadius, otherBottom, otherTop = capsules[j]
+
+        # Over (or under) each other
+        if bottom > otherTop or top < otherBottom:
+            return False
+
+        s, t = closestPointsOfSegments((ax, ay), (bx, by), (cx, cy), (dx, dy))
+
+        px = ax + (bx - ax) * s - (cx + (dx - cx) * t)
+        py = ay + (by - ay) * s - (cy + (dy - cy) * t)
+        dist = math.sqrt(px*px + py*py)
+
+        minDist = radius + otherRadius
+        if dist >= minDist:
+            return False
+
+        car = self.cars[i]
+        other = self.cars[j]
+
+        # Normal from the other car to this one
+        if dist > 1e-6:
+            nx, ny = px / dist, py / dist
+        else:
+            # Right on top of each other, push apart sideways from this car
+            dirX, dirY = car.getDirection()
+            nx, ny = dirY, -dirX
+
+        # Half each
+        depth = (minDist - dist) / 2
+
+        x, y, z = car.model.getPos()
+        car.model.setPos(x + nx * depth, y + ny * depth, z)
+
+        x, y, z = other.model.getPos()
+        other.model.setPos(x - nx * depth, y - ny * depth, z)
+
+        # The pushed capsules for the next pairs
+        capsules[i] = (ax + nx * depth, ay + ny * depth, bx + nx * depth, by + ny * depth, radius, bottom, top)
+        capsules[j] = (
+            cx - nx * depth, cy - ny * depth, dx - nx * depth, dy - ny * depth,
+            otherRadius, otherBottom, otherTop
+        )
+
+        self.bump(car, other, nx, ny)
+
+        return True
+
+    # Exchange speed along the normal (from other to car), if they are moving into each other
+    def bump(self, car, other, nx, ny):
+        carDir = car.getDirection()
+        otherDir = other.getDirection()
+
+        vx, vy = carDir[0] * car.speed, carDir[1] * car.speed
+        wx, wy = otherDir[0] * other.speed, otherDir[1] * other.speed
+
+        # Speed towards each other
+        approach = (vx - wx) * nx + (vy - wy) * ny
+        if approach >= 0:
+            return
+
+        impulse = -(1 + CarCollider.restitution) * approach / 2
+
+        vx += impulse * nx
+        vy += impulse * ny
+        wx -= impulse * nx
+        wy -= impulse * ny
+
+        # Cars only move along their heading
+        car.bumpSpeed(vx * carDir[0] + vy * carDir[1])
+        other.bumpSpeed(wx * otherDir[0] + wy * otherDir[1])
@@ -0,0 +1,159 @@
+'''
+Batched car physics
+
+Keeps the movement state (speed, acceleration, heading, position)
+of every car in NumPy arrays (struct of arrays), and applies friction,
+clamping, direction changes and integration to all cars in one step.
+Transforms are then written back to the car models in a single pass.
+
+Cars attached to the engine read and write their speeds and accelerations
+straight from the arrays (see physicsState in Racecar), so the controls
+and the AI work the same way as with Racecar.updateMovement.
+
+NumPy is optional: isAvailable() is False without it, and the cars
+then fall back to updating themselves one by one.
+'''
+
+from Obj3D import *
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+class CarPhysics(object):
+    # Movement state kept per car
+    stateNames = [ "speed", "acceleration", "rotationSpeed", "rotationAcceleration" ]
+
+    @staticmethod
+    def isAvailable():
+        return np != None
+
+    def __init__(self, cars):
+        if not CarPhysics.isAvailable():
+            raise Exception("CarPhysics requires numpy")
+
+        self.cars = list(cars)
+        N = len(self.cars)
+
+        # Movement state
+        self.speed = np.zeros(N)
+        self.acceleration = np.zeros(N)
+        self.rotationSpeed = np.zeros(N)
+        self.rotationAcceleration = np.zeros(N)
+
+        # Transforms
+        self.pos = np.zeros((N, 3))
+        self.hpr = np.zeros((N, 3))
+
+        for i, car in enumerate(self.cars):
+            for name in CarPhysics.stateNames:
+                getattr(self, name)[i] = getattr(car, name)
+
+            car.attachPhysics(self, i)
+
+        self.updateParameters()
+
+    # Constant parameters of the cars
+    # NOTE: Call again if any of them are changed after the cars are attached
+    def updateParameters(self):
+        cars = self.cars
+
+        self.maxSpeed = np.array([ car.maxSpeed for car in cars ], dtype=float)
+        self.maxSpeedBackwards = np.array([ car.maxSpeedBackwards for car in cars ], dtype=float)
+        self.maxRotationSpeed = np.array([ car.maxRotationSpeed for car in cars ], dtype=float)
+        self.friction = np.array([ car.friction for car in cars ], dtype=float)
+
+        # Cars are reset when they fall below this
+        self.groundLevel = np.array([
+            car.gameObj.racetrack.trackBounds["z"][0] - car.dimZ * 2 for car in cars
+        ], dtype=float)
+
+    def detach(self):
+        for car in self.cars:
+            car.detachPhysics()
+
+    # Read the transforms back from the models
+    # (they may have been moved by collisions, or reset)
+    def readTransforms(self):
+        for i, car in enumerate(self.cars):
+            self.pos[i] = car.model.getPos()
+            self.hpr[i] = car.model.getHpr()
+
+    def writeTransforms(self):
+        pos = self.pos.tolist()
+        hpr = self.hpr.tolist()
+
+        for i, car in enumerate(self.cars):
+            x, y, z = pos[i]
+            h, p, r = hpr[i]
+            car.model.setPosHpr(x, y, z, h, p, r)
+
+    # Step every car by one tick
+    # Same as Racecar.updateMovement, for all cars at once
+    def step(self):
+        cars = self.cars
+
+        # Controls and AI still decide for each car
+        for car in cars:
+            car.updateControls()
+
+        self.readTransforms()
+
+        speedPowerup = np.array([ car.activePowerup == "speed" for car in cars ], dtype=bool)
+
+        speed = self.speed
+        acceleration = self.acceleration
+        rotationSpeed = self.rotationSpeed
+        rotationAcceleration = self.rotationAcceleration
+
+        # Friction
+        useSpeedBasedFriction = (speed == 0) | (acceleration > 1.5 * self.friction)
+        friction = np.where(
+            useSpeedBasedFriction,
+            -self.friction * speed,
+            -self.friction * np.sign(speed)
+        )
+        friction[speedPowerup] *= 0.75
+
+        acceleration += friction
+
+        # Update the cars' speed based on their acceleration
+        prevSpeed = speed.copy()
+        prevRotSpeed = rotationSpeed.copy()
+
+        speed += acceleration
+        clampedSpeed = np.minimum(np.maximum(speed, self.maxSpeedBackwards), self.maxSpeed)
+        speed[:] = np.where(speedPowerup, speed, clampedSpeed)
+
+        rotationSpeed += rotationAcceleration
+        np.minimum(rotationSpeed, self.maxRotationSpeed, out=rotationSpeed)
+
+        # Direction changed
+        changed = prevSpeed * speed < 0
+        speed[changed] = 0
+        acceleration[changed] = 0
+
+        changed = prevRotSpeed * rotationSpeed < 0
+        rotationSpeed[changed] = 0
+        acceleration[changed] = 0
+        rotationAcceleration[changed] = 0
+
+        # Move forward in the direction of each car's yaw angle
+        # NOTE: sin and cos are switched because the cars are facing y by default
+        heading = self.hpr[:, 0]
+        dirAngle = heading * -(math.pi/180)
+
+        self.pos[:, 0] += speed * np.sin(dirAngle)
+        self.pos[:, 1] += speed * np.cos(dirAngle)
+
+        # Rotate, keeping the euler angle normalised
+        heading += rotationSpeed
+        heading[heading > 180] -= 360
+        heading[heading < -180] += 360
+
+        self.writeTransforms()
+
+        # Reset
+        for i in np.nonzero(self.pos[:, 2] < self.groundLevel)[0]:
+            cars[i].resetBelowGround()
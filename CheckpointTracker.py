@@ -0,0 +1,112 @@
+'''
+Checkpoint tracking
+
+Instead of testing every car against the checkpoint capsules with the traverser,
+the line each car moved along in a tick is tested against the checkpoint lines
+(see Racetrack.getCheckpointLines) at both ends of the segment it is on.
+Passed checkpoints are reported to the cars directly (see Racecar.passCheckpoint).
+
+Every car's progress around the track is kept as (lap, segment, fraction), where
+segment is the last checkpoint passed in order and fraction is how far along the
+segment (towards the next checkpoint) the car is.
+'''
+
+from Obj3D import *
+
+# Parameters (between 0 and 1) where 2D segments p0-p1 and q0-q1 cross, or None if they do not
+def intersectSegments(p0, p1, q0, q1):
+    d1x, d1y = p1[0] - p0[0], p1[1] - p0[1]
+    d2x, d2y = q1[0] - q0[0], q1[1] - q0[1]
+
+    denom = d1x * d2y - d1y * d2x
+
+    # Parallel
+    if denom == 0:
+        return None
+
+    rx, ry = q0[0] - p0[0], q0[1] - p0[1]
+
+    s = (rx * d2y - ry * d2x) / denom
+    t = (rx * d1y - ry * d1x) / denom
+
+    if s < 0 or s > 1 or t < 0 or t > 1:
+        return None
+
+    return s, t
+
+class CheckpointTracker(object):
+    def __init__(self, racetrack, cars, trackFloor):
+        self.racetrack = racetrack
+        self.cars = list(cars)
+
+        # The segment each car is on is found by the floor
+        self.trackFloor = trackFloor
+
+        self.checkpointLines = racetrack.getCheckpointLines()
+
+        # Moving further than this in a tick is a reset, not driving
+        self.maxStepSquared = racetrack.defaultWallSpacing ** 2
+
+        self.prevPositions = [ car.model.getPos() for car in self.cars ]
+
+        for car in self.cars:
+            car.progress = self.getProgress(car)
+
+    # Report the checkpoints every car drove through in the last tick,
+    # and update how far they got
+    def update(self):
+        for i, car in enumerate(self.cars):
+            pos = car.model.getPos()
+
+            self.updateCar(i, car, self.prevPositions[i], pos)
+            self.prevPositions[i] = pos
+
+            car.progress = self.getProgress(car)
+
+    def updateCar(self, i, car, prevPos, pos):
+        N = len(self.checkpointLines)
+
+        prevX, prevY, _ = prevPos
+        x, y, _ = pos
+
+        dx, dy = x - prevX, y - prevY
+        if (dx == 0 and dy == 0) or dx*dx + dy*dy > self.maxStepSquared:
+            return
+
+        segment = self.trackFloor.carSegments[i]
+        if segment == None:
+            return
+
+        # Checkpoints at the start and end of the segment,
+        # and one more on both sides in case the car is near a corner
+        crossed = []
+        for j in range(segment - 1, segment + 3):
+            checkpointID = j % N
+            startPoint, endPoint = self.checkpointLines[checkpointID]
+
+            params = intersectSegments((prevX, prevY), (x, y), startPoint, endPoint)
+            if params != None:
+                crossed.append((params[0], checkpointID))
+
+        # In the order they were driven through
+        for _, checkpointID in sorted(crossed):
+            car.passCheckpoint(checkpointID)
+
+    # How far the car got: (lap, segment, fraction along the segment)
+    def getProgress(self, car):
+        points = self.racetrack.points
+        N = len(points)
+
+        segment = car.lastCheckpoint
+        x0, y0, _ = points[segment]
+        x1, y1, _ = points[(segment + 1) % N]
+
+        x, y, _ = car.model.getPos()
+
+        dx, dy = x1 - x0, y1 - y0
+        lengthSquared = dx*dx + dy*dy
+
+        fraction = ((x - x0) * dx + (y - y0) * dy) / lengthSquared if lengthSquared > 0 else 0
+        fraction = max(0, min(fraction, 1))
+
+        return car.currLap, segment, fraction
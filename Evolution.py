@@ -0,0 +1,362 @@
+'''
+Evolution of the AI driving parameters
+
+Tunes how an AI car type drives (see Racecar.drivingParameters: top speed,
+friction, acceleration, turning, and for SmartCar the angle of checkStupidity)
+with a genetic algorithm. Every generation, each new set of parameters races
+a few headless races (see HeadlessRace) against copies of itself, on every
+track and for every seed, in parallel over all the CPU cores (see Tournament).
+The score of a set of parameters is its mean lap time, plus a penalty for
+every crash into a wall. The best sets are kept, and the others are replaced
+by mixes of good sets with a bit of random change.
+
+After every generation, the population and every set raced so far are saved
+to the checkpoint file, and running again with the same file carries on from
+there. The difficulty presets are also written after every generation: the
+best set for hard, and sets that are that much slower (with the fewest crashes)
+for medium and easy (see levelPaces). They are loaded in place of the default
+levels by RaceConfig.loadPresets, for example:
+    python Evolution.py --generations 50
+    python Game.py --presets presets.json
+'''
+
+from RaceSimulation import *
+from Tournament import findTracks
+
+import multiprocessing
+import os
+
+class Evolution(object):
+    # Range of every driving parameter
+    parameterRanges = {
+        "maxSpeed": (2, 15),
+        "friction": (0.005, 0.1),
+        "accInc": (0.01, 0.2),
+        "defaultRotationSpeed": (0.5, 5),
+        "maxRotationSpeed": (2, 20),
+        "stupidityAngle": (0.01, 10)
+    }
+
+    # The best sets are kept as they are from one generation to the next
+    eliteCount = 2
+
+    # Parents are the best of this many sets picked at random
+    tournamentSize = 3
+
+    # Every parameter of a child changes with this probability,
+    # by a random amount around mutationScale of its range
+    mutationRate = 0.5
+    mutationScale = 0.1
+
+    # Lap times of the levels, compared to the best lap time (hard)
+    levelPaces = { "easy": 1.5, "medium": 1.2, "hard": 1 }
+
+    # settings: see getDefaultSettings
+    def __init__(self, settings):
+        self.settings = settings
+
+        carClass = HeadlessRace.getCarClass(settings["carType"])
+        if carClass == None or settings["carType"] not in HeadlessRace.aiCarTypes:
+            raise Exception(f"Invalid AI car type {settings['carType']}")
+
+        self.parameters = [ name for name in carClass.drivingParameters if name in Evolution.parameterRanges ]
+
+        self.generation = 0
+        self.population = []
+
+        # Score of every set of parameters raced so far, by getKey
+        self.archive = {}
+
+        self.rng = random.Random(settings["seed"])
+
+    @staticmethod
+    def getDefaultSettings():
+        return {
+            "carType": "SmartCar",
+            "tracks": findTracks(),
+            "seeds": [ 0 ],
+            "populationSize": 16,
+            # Cars (with the same parameters) in every race
+            "fieldSize": 3,
+            "laps": 2,
+            # Cars that do not finish count as taking this long (in seconds)
+            "maxRaceTime": 120,
+            # Seconds added to the lap time for every crash into a wall, per lap
+            "wallPenalty": 0.5,
+            "seed": 0
+        }
+
+    @staticmethod
+    def getKey(driving):
+        return json.dumps(driving, sort_keys=True)
+
+    def getRandomDriving(self):
+        driving = {}
+        for name in self.parameters:
+            low, high = Evolution.parameterRanges[name]
+            driving[name] = self.rng.uniform(low, high)
+
+        return self.repair(driving)
+
+    # Keep the parameters in their range, and the car able to drive
+    def repair(self, driving):
+        for name in self.parameters:
+            low, high = Evolution.parameterRanges[name]
+            driving[name] = min(max(driving[name], low), high)
+
+        # Friction is taken off the acceleration, so the car would never get going
+        if "accInc" in driving and "friction" in driving:
+            driving["accInc"] = max(driving["accInc"], driving["friction"] + 0.001)
+
+        return driving
+
+    # Start from the default parameters and random ones
+    # NOTE: The defaults are set by the constructors of the cars, so they are read
+    #       from a car in a worker (the engine is never started in this process)
+    def initPopulation(self, pool):
+        driving = pool.apply(getDefaultDriving, (self.settings["carType"], self.settings["tracks"][0]))
+        self.population = [ { name: driving[name] for name in self.parameters } ]
+
+        while len(self.population) < self.settings["populationSize"]:
+            self.population.append(self.getRandomDriving())
+
+    # Race every set of parameters of the population that has not raced yet
+    def evaluate(self, pool):
+        settings = self.settings
+
+        newDriving = {}
+        for driving in self.population:
+            key = Evolution.getKey(driving)
+            if key not in self.archive:
+                newDriving[key] = driving
+
+        tasks = [
+            (settings["carType"], driving, track, seed, settings["laps"], settings["fieldSize"], settings["maxRaceTime"])
+            for driving in newDriving.values()
+            for track in settings["tracks"]
+            for seed in settings["seeds"]
+        ]
+
+        # Finishing times (None if not finished) and wall hits of every car, by set of parameters
+        finishTimes = { key: [] for key in newDriving }
+        wallHits = { key: 0 for key in newDriving }
+
+        for summary in pool.imap_unordered(runRace, tasks):
+            key = Evolution.getKey(summary["driving"])
+
+            # None of the cars finish
+            if "error" in summary:
+                print(f"Race on {summary['track']} (seed {summary['seed']}) failed: {summary['error']}", file=sys.stderr)
+                finishTimes[key] += [ None ] * settings["fieldSize"]
+                continue
+
+            finishTimes[key] += summary["finishTimes"]
+            wallHits[key] += summary["wallHits"]
+
+        for key, driving in newDriving.items():
+            self.archive[key] = self.score(driving, finishTimes[key], wallHits[key])
+
+    def score(self, driving, finishTimes, wallHits):
+        laps = self.settings["laps"]
+        maxRaceTime = self.settings["maxRaceTime"]
+
+        nCars = len(finishTimes)
+        totalTime = sum(maxRaceTime if finishTime == None else finishTime for finishTime in finishTimes)
+
+        lapTime = totalTime / (nCars * laps)
+        wallHitsPerLap = wallHits / (nCars * laps)
+
+        return {
+            "driving": driving,
+            "lapTime": lapTime,
+            "wallHitsPerLap": wallHitsPerLap,
+            "finishRate": sum(1 for finishTime in finishTimes if finishTime != None) / nCars,
+            "score": lapTime + self.settings["wallPenalty"] * wallHitsPerLap
+        }
+
+    def getScore(self, driving):
+        return self.archive[Evolution.getKey(driving)]["score"]
+
+    # Next generation: the best sets, and children of the others
+    def breed(self):
+        ranked = sorted(self.population, key=self.getScore)
+
+        population = ranked[:Evolution.eliteCount]
+        while len(population) < self.settings["populationSize"]:
+            child = self.crossover(self.select(ranked), self.select(ranked))
+            population.append(self.mutate(child))
+
+        self.population = population
+        self.generation += 1
+
+    # Best of a few sets picked at random
+    def select(self, ranked):
+        return min(self.rng.sample(ranked, Evolution.tournamentSize), key=self.getScore)
+
+    # Every parameter somewhere between (or a bit beyond) the ones of the parents
+    def crossover(self, parent, other):
+        child = {}
+        for name in self.parameters:
+            t = self.rng.uniform(-0.25, 1.25)
+            child[name] = parent[name] + (other[name] - parent[name]) * t
+
+        return child
+
+    def mutate(self, driving):
+        for name in self.parameters:
+            if self.rng.random() < Evolution.mutationRate:
+                low, high = Evolution.parameterRanges[name]
+                driving[name] += self.rng.gauss(0, Evolution.mutationScale * (high - low))
+
+        return self.repair(driving)
+
+    # Best set of parameters so far
+    def getBest(self):
+        return min(self.archive.values(), key=lambda entry: entry["score"])
+
+    # Levels (see RaceConfig.loadPresets), from the sets that always finished
+    def getPresets(self):
+        finished = [ entry for entry in self.archive.values() if entry["finishRate"] == 1 ]
+        if len(finished) == 0:
+            return {}
+
+        bestLapTime = min(finished, key=lambda entry: entry["score"])["lapTime"]
+        wallPenalty = self.settings["wallPenalty"]
+
+        presets = {}
+        for level, pace in Evolution.levelPaces.items():
+            # As close as possible to the pace of the level, with the fewest crashes
+            entry = min(finished, key=lambda entry:
+                abs(entry["lapTime"] - pace * bestLapTime) + wallPenalty * entry["wallHitsPerLap"]
+            )
+
+            presets[level] = {
+                "aiTypes": { self.settings["carType"]: 1 },
+                "driving": entry["driving"],
+                "lapTime": entry["lapTime"],
+                "wallHitsPerLap": entry["wallHitsPerLap"]
+            }
+
+        return presets
+
+    def save(self, fileName):
+        state = {
+            "settings": self.settings,
+            "generation": self.generation,
+            "population": self.population,
+            "archive": list(self.archive.values()),
+            "rngState": self.rng.getstate()
+        }
+
+        # Written under another name first, so that stopping halfway keeps the last checkpoint
+        tempFile = f"{fileName}.tmp"
+        with open(tempFile, "w") as f:
+            json.dump(state, f)
+
+        os.replace(tempFile, fileName)
+
+    @staticmethod
+    def load(fileName):
+        with open(fileName, "r") as f:
+            state = json.load(f)
+
+        evolution = Evolution(state["settings"])
+        evolution.generation = state["generation"]
+        evolution.population = state["population"]
+
+        for entry in state["archive"]:
+            evolution.archive[Evolution.getKey(entry["driving"])] = entry
+
+        # Json turns the tuples into lists
+        version, internalState, gaussNext = state["rngState"]
+        evolution.rng.setstate((version, tuple(internalState), gaussNext))
+
+        return evolution
+
+# Runs in the worker processes
+# task: (carType, driving, track, seed, laps, fieldSize, maxRaceTime)
+def runRace(task):
+    carType, driving, track, seed, laps, fieldSize, maxRaceTime = task
+
+    try:
+        race = HeadlessRace(
+            track, [ carType ] * fieldSize, laps, maxRaceTime=maxRaceTime, seed=seed, driving=[ driving ]
+        )
+        results = race.run()
+        race.destroy()
+    except Exception as e:
+        return { "driving": driving, "track": track, "seed": seed, "error": f"{type(e).__name__}: {e}" }
+
+    return {
+        "driving": driving,
+        "finishTimes": [ car["finishTime"] for car in results["cars"] ],
+        "wallHits": sum(car["wallHits"] for car in results["cars"])
+    }
+
+# Driving parameters of a car of the type, as they are by default (runs in a worker process)
+def getDefaultDriving(carType, track):
+    race = HeadlessRace(track, [ carType ], 1)
+    driving = race.cars[0].getDrivingParameters()
+    race.destroy()
+
+    return driving
+
+if __name__ == "__main__":
+    defaults = Evolution.getDefaultSettings()
+
+    parser = argparse.ArgumentParser(description="Evolve the driving parameters of an AI car type")
+    parser.add_argument("--generations", type=int, default=20, help="Run until this many generations")
+    parser.add_argument("--checkpoint", default="evolution.json", help="Carries on from this file, if it exists")
+    parser.add_argument("--output", default=RaceConfig.presetsFile, help="Difficulty presets (see RaceConfig.loadPresets)")
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+
+    # Only used when starting from scratch (the checkpoint keeps them)
+    parser.add_argument("--car", default=defaults["carType"], choices=list(HeadlessRace.aiCarTypes.keys()))
+    parser.add_argument("--tracks", nargs="+", default=defaults["tracks"])
+    parser.add_argument("--seeds", type=int, default=len(defaults["seeds"]), help="Races on every track")
+    parser.add_argument("--population", type=int, default=defaults["populationSize"])
+    parser.add_argument("--fieldSize", type=int, default=defaults["fieldSize"])
+    parser.add_argument("--laps", type=int, default=defaults["laps"])
+    parser.add_argument("--maxTime", type=float, default=defaults["maxRaceTime"], help="Max race time in seconds")
+    parser.add_argument("--wallPenalty", type=float, default=defaults["wallPenalty"])
+    parser.add_argument("--seed", type=int, default=defaults["seed"])
+    args = parser.parse_args()
+
+    if os.path.exists(args.checkpoint):
+        evolution = Evolution.load(args.checkpoint)
+        print(f"Carrying on from generation {evolution.generation} of {args.checkpoint}")
+    else:
+        settings = {
+            "carType": args.car,
+            "tracks": args.tracks,
+            "seeds": list(range(args.seeds)),
+            "populationSize": args.population,
+            "fieldSize": args.fieldSize,
+            "laps": args.laps,
+            "maxRaceTime": args.maxTime,
+            "wallPenalty": args.wallPenalty,
+            "seed": args.seed
+        }
+
+        evolution = Evolution(settings)
+
+    with multiprocessing.Pool(args.processes) as pool:
+        if len(evolution.population) == 0:
+            evolution.initPopulation(pool)
+
+        while evolution.generation < args.generations:
+            startTime = time.time()
+
+            evolution.evaluate(pool)
+
+            best = evolution.getBest()
+            print(
+                f"Generation {evolution.generation}: best lap time {best['lapTime']:.2f}s, "
+                f"{best['wallHitsPerLap']:.2f} wall hits per lap ({time.time() - startTime:.0f}s)"
+            )
+
+            evolution.breed()
+            evolution.save(args.checkpoint)
+
+            with open(args.output, "w") as f:
+                json.dump(evolution.getPresets(), f, indent=2)
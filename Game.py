@@ -6,6 +6,7 @@ import sys
 import math
 import os
 import random
+import argparse
 
 # Basic intervals
 from direct.interval.IntervalGlobal import *
@@ -13,6 +14,7 @@ from direct.interval.LerpInterval import *
 
 # Task managers
 from direct.task.Task import Task
+from direct.showbase.DirectObject import DirectObject
 import time
 
 # Audio managers
@@ -31,6 +33,11 @@ from Racetrack import *
 from Terrain import *
 from Powerup import *
 from Minimap import *
+from RaceSimulation import *
+from RaceConfig import *
+from Replay import *
+from Preloader import *
+from AssetBuilder import *
 
 from RacetrackGenerator import *
 
@@ -53,6 +60,20 @@ class Game(ShowBase):
     selectedPassenger = "penguin"
     level = "medium"
 
+    # Number of AI cars racing the player (see RaceConfig)
+    nOpponents = 2
+
+    # Compiled textures to use, if they have been built (see AssetBuilder), or None for the source textures
+    textureQuality = "high"
+
+    # Paging of the racetrack sections around the camera and the cars (see Racetrack)
+    trackPaging = None
+    pagingDistance = Racetrack.pagingDistance
+
+    # Replay to play back in the next race (instead of playing)
+    replay = None
+    replaySpeed = 1
+
     currentState = None
 
     instructionsText = """\
@@ -72,57 +93,128 @@ Collect the powerups, and beat all the other cars to win!
 [R] Restart Game
 """
 
-    def __init__(self):
+    # The engine (window, graphics context, audio and task manager) is only started once,
+    # and every screen is a Scene on top of it (see nextState)
+    def __init__(self, state="start"):
         ShowBase.__init__(self)
+
+        # NOTE: Before any model is loaded
+        Obj3D.setTextureQuality(Game.textureQuality)
         
         Game.fonts["AmericanCaptain"] = loader.loadFont('AmericanCaptain.ttf')
 
-        self.helpDialog = HelpDialog()
+        # The screens move the camera themselves
+        self.disableMouse()
 
-        self.nextState("start")
+        # NOTE: Collisions are traversed on every tick by the race simulation, not every frame
+        self.taskMgr.remove("collisionLoop")
 
+        # Cars attach their sounds to this, in every race
+        Obj3D.audio3d = Audio3DManager.Audio3DManager(
+            self.sfxManagerList[0], self.camera
+        )
+
+        # Loads the assets of the next race while the player is in the menus
+        self.preloader = Preloader(self.loader)
+
+        # Screen being shown
+        self.scene = None
+
+        self.nextState(state)
+
+    # Swap the current screen for the one of the given state
     def nextState(self, state):
-        self.destroyInstance()
+        if self.scene != None:
+            self.scene.destroy()
+            self.scene = None
 
         state = state.lower().replace(" ", "")
 
         Game.currentState = state
 
         if state in [ "startscreen", "start" ]:
-            StartScreen()
+            self.scene = StartScreen(self)
         elif state in [ "game", "racing", "racinggame", "main" ]:
-            RacingGame()
+            self.scene = RacingGame(self)
         elif state in [ "racetrackselection", "racetrack", "track" ]:
-            RacetrackSelection()
+            self.scene = RacetrackSelection(self)
         elif state in ["racecarselection", "racecar", "car" ]:
-            RacecarSelection()
+            self.scene = RacecarSelection(self)
         elif state in [ "instructions", "help" ]:
-            InstructionsScreen()
+            self.scene = InstructionsScreen(self)
         else:
             print(f"ERROR: State {state} not found")
             sys.exit()
 
-    def destroyInstance(self):
-        self.destroy()
+# A screen of the game, shown on the engine of the Game
+# Everything the screen adds to the engine is kept here, so that it can all be
+# taken off again when going to the next screen (see destroy), like HeadlessRace:
+# its own node trees (in place of render, render2d and aspect2d), tasks and event hooks
+class Scene(DirectObject):
+    def __init__(self, game):
+        self.game = game
+
+        name = type(self).__name__
+        self.render = game.render.attachNewNode(name)
+        self.render2d = game.render2d.attachNewNode(name)
+        self.aspect2d = game.aspect2d.attachNewNode(name)
+
+        self.camera = game.camera
+
+        self.tasks = []
+
+        # DirectGui widgets (and anything else with a destroy function) to destroy with the scene,
+        # as they also listen to events
+        self.widgets = []
+
+    def addTask(self, function, name, sort=None):
+        task = self.game.taskMgr.add(function, f"{type(self).__name__}-{name}", sort=sort)
+        self.tasks.append(task)
+
+        return task
+
+    def addWidget(self, widget):
+        self.widgets.append(widget)
+        return widget
+
+    def nextState(self, state):
+        self.game.nextState(state)
+
+    def destroy(self):
+        self.ignoreAll()
+
+        for task in self.tasks:
+            self.game.taskMgr.remove(task)
+
+        for widget in self.widgets:
+            widget.destroy()
+
+        self.render.removeNode()
+        self.render2d.removeNode()
+        self.aspect2d.removeNode()
+
+        # Back to where a new engine would have it (there is none without a window)
+        if self.camera != None:
+            self.camera.reparentTo(self.game.render)
+            self.camera.setPosHpr(0, 0, 0, 0, 0, 0)
 
 class HelpDialog():
-    def __init__(self):
+    def __init__(self, parent=None):
         self.components = []
         self.hidden = False
         
         try:
             self.bg = OnscreenImage(
                 image="img/startscreen.png",
-                scale=(1.5, 1.5, 1)
+                scale=(1.5, 1.5, 1), parent=parent
             )
+            self.components.append(self.bg)
         except:
             print("img/startscreen.png not found. Get it from Github.")
             self.bg = None
-            
-        self.components.append(self.bg)
 
         # Construct our TabbedFrame
-        self.frame = TabbedFrame(tab_frameSize=(0, 7, 0, 2),
+        self.frame = TabbedFrame(parent=parent, tab_frameSize=(0, 7, 0, 2),
                                  tab_text_align=TextNode.ALeft,
                                  tab_text_pos=(0.2, 0.6))
 
@@ -219,7 +311,7 @@ Panda 3D forums
             scale=0.10, command=self.hide,
             pad=(0.3, 0.3),
             pos=(0, 0, -0.75),
-            text_mayChange=True
+            text_mayChange=True, parent=parent
         )
         self.components.append(self.nextButton)
 
@@ -227,7 +319,7 @@ Panda 3D forums
             text='[P]', pos=(0, -0.87), scale=0.07,
             font=Game.fonts["AmericanCaptain"],
             align=TextNode.ACenter, mayChange=True,
-            bg=(182, 182, 182, 0.5),
+            bg=(182, 182, 182, 0.5), parent=parent
         )
         self.components.append(self.buttonHelperText)
 
@@ -252,14 +344,14 @@ Panda 3D forums
         for component in self.components:
             component.destroy()
 
-class StartScreen(Game):
-    def __init__(self):
-        ShowBase.__init__(self)
+class StartScreen(Scene):
+    def __init__(self, game):
+        super().__init__(game)
 
         try:
             concreteBg = OnscreenImage(
                 image="img/startscreen.png",
-                scale=(1.5, 1.5, 1)
+                scale=(1.5, 1.5, 1), parent=self.aspect2d
             )
         except:
             print("img/startscreen.png not found. Get it from Github.")
@@ -268,16 +360,16 @@ class StartScreen(Game):
         title = OnscreenText(
             text=gameTitle, pos=(0, 0.3), scale=0.32,
             font=Game.fonts["AmericanCaptain"],
-            align=TextNode.ACenter, mayChange=False
+            align=TextNode.ACenter, mayChange=False, parent=self.aspect2d
         )
 
         text = OnscreenText(
             text='Difficulty:', pos=(-0.1, 0), scale=0.1,
             font=Game.fonts["AmericanCaptain"], bg=(255, 255, 255, 0.1),
-            align=TextNode.ARight, mayChange=False
+            align=TextNode.ARight, mayChange=False, parent=self.aspect2d
         )
 
-        menu = DirectOptionMenu(
+        menu = self.addWidget(DirectOptionMenu(
             scale=0.12,
             items=[ "Easy", "Medium", "Hard" ], initialitem=1,
             highlightColor=(10, 10, 10, 1),
@@ -285,21 +377,21 @@ class StartScreen(Game):
             pos=(0, 0, 0),
             popupMenu_pos=(-0.5, 0, 0),
             command=self.changeLevel,
-            text_scale=0.8
-        )
+            text_scale=0.8, parent=self.aspect2d
+        ))
 
-        startGameButton = DirectButton(
+        startGameButton = self.addWidget(DirectButton(
             text="Start  Game", text_font=Game.fonts["AmericanCaptain"],
             scale=0.15, command=self.startGame,
             pad=(0.3, 0.3),
-            pos=(0, 0, -0.32)
-        )
+            pos=(0, 0, -0.32), parent=self.aspect2d
+        ))
 
         spaceShortcut = OnscreenText(
             text='[Space]', pos=(0, -0.49), scale=0.08,
             font=Game.fonts["AmericanCaptain"],
             align=TextNode.ACenter, mayChange=False,
-            bg=(182, 182, 182, 0.5)
+            bg=(182, 182, 182, 0.5), parent=self.aspect2d
         )
 
         '''
@@ -321,7 +413,7 @@ Hold V to look around | R to Restart
             text=helpText, pos=(0, -0.7), scale=0.1,
             bg=(255,255,255,0.7), wordwrap=20,
             font=Game.fonts["AmericanCaptain"],
-            align=TextNode.ACenter, mayChange=False
+            align=TextNode.ACenter, mayChange=False, parent=self.aspect2d
         )
 
         # Next frame without clicking
@@ -333,9 +425,9 @@ Hold V to look around | R to Restart
     def changeLevel(self, level):
         Game.level = level.lower()
 
-class RacetrackSelection(Game):
-    def __init__(self):
-        ShowBase.__init__(self)
+class RacetrackSelection(Scene):
+    def __init__(self, game):
+        super().__init__(game)
 
         '''
         concreteBg = OnscreenImage(
@@ -347,21 +439,21 @@ class RacetrackSelection(Game):
         title = OnscreenText(
             text='Select your Racetrack!', pos=(0, 0.65), scale=0.18,
             font=Game.fonts["AmericanCaptain"], bg=(255, 255, 255, 1),
-            align=TextNode.ACenter, mayChange=False
+            align=TextNode.ACenter, mayChange=False, parent=self.aspect2d
         )
 
-        nextButton = DirectButton(
+        nextButton = self.addWidget(DirectButton(
             text="Next", text_font=Game.fonts["AmericanCaptain"],
             scale=0.10, command=self.selectCar,
             pad=(0.3, 0.3),
-            pos=(0, 0, -0.8)
-        )
+            pos=(0, 0, -0.8), parent=self.aspect2d
+        ))
 
         spaceShortcut = OnscreenText(
             text='[Space]', pos=(0, -0.93), scale=0.07,
             font=Game.fonts["AmericanCaptain"],
             align=TextNode.ACenter, mayChange=False,
-            bg=(182, 182, 182, 0.5),
+            bg=(182, 182, 182, 0.5), parent=self.aspect2d
         )
 
         # Get List of tracks
@@ -373,37 +465,40 @@ class RacetrackSelection(Game):
         points = Racetrack.parseTrackFile(Game.selectedTrack)
         self.minimap = Minimap(points, renderer=self.render)
 
+        # Orbits around the selected track
+        self.camControl = None
+
         self.selectTrack(self.tracks[initialItem])
 
-        self.menu = DirectOptionMenu(
+        self.menu = self.addWidget(DirectOptionMenu(
             scale=0.15,
             items=self.tracks, initialitem=initialItem,
             highlightColor=(10, 10, 10, 1), 
             pad=(10, 10),
             pos=(-0.5, 0, 0.35),
             popupMenu_pos=(-0.5, 0, 0.2),
-            command=self.selectTrack
-        )
+            command=self.selectTrack, parent=self.aspect2d
+        ))
 
         helperText = OnscreenText(
             text='Click and drag anywhere to view the 3D track!', pos=(0, -0.6), scale=0.08,
             font=Game.fonts["AmericanCaptain"],
             align=TextNode.ACenter, mayChange=False,
-            bg=(182, 182, 182, 0.5),
+            bg=(182, 182, 182, 0.5), parent=self.aspect2d
         )
 
-        randomiseButton = DirectButton(
+        randomiseButton = self.addWidget(DirectButton(
             text="New Random Track", text_font=Game.fonts["AmericanCaptain"],
             scale=0.10, command=self.randomiseTrack,
             pad=(0.3, 0.3),
-            pos=(-0.9, 0, 0.35)
-        )
+            pos=(-0.9, 0, 0.35), parent=self.aspect2d
+        ))
 
         self.randomText = OnscreenText(
             text='', pos=(-0.9, 0.20), scale=0.07,
             font=Game.fonts["AmericanCaptain"],
             align=TextNode.ACenter, mayChange=True,
-            bg=(182, 182, 182, 0.5),
+            bg=(182, 182, 182, 0.5), parent=self.aspect2d
         )
 
         # Next frame without clicking
@@ -442,19 +537,29 @@ class RacetrackSelection(Game):
 
         self.minimap.reloadAndDraw(points)
 
+        self.game.preloader.preloadRace(track, Game.selectedCar, Game.selectedPassenger)
+
         # Camera Control
         baseVec = LVector3f(0, 20, -3)
         # base.trackball.node().setPos(baseVec + self.minimap.midPoint)
 
+        if self.camControl != None:
+            self.camControl.destroy()
+
         self.camControl = CameraController(
             camPos=baseVec - self.minimap.midPoint,
-            anchorPos= self.minimap.midPoint
+            anchorPos= self.minimap.midPoint,
+            renderParent=self.render
         )
 
     def selectCar(self):
         self.camControl.enabled = False
         self.nextState("racecar")
 
+    def destroy(self):
+        self.camControl.destroy()
+        super().destroy()
+
     def findTracks(self, path):
         if os.path.isfile(path):
             if path.endswith(".track"):
@@ -471,28 +576,28 @@ class RacetrackSelection(Game):
         else:
             return []
 
-class RacecarSelection(Game):
-    def __init__(self):
-        ShowBase.__init__(self)
+class RacecarSelection(Scene):
+    def __init__(self, game):
+        super().__init__(game)
 
         title = OnscreenText(
             text='Select your Racecar and Passenger!', pos=(0, 0.7), scale=0.18,
             font=Game.fonts["AmericanCaptain"], bg=(255, 255, 255, 1),
-            align=TextNode.ACenter, mayChange=False
+            align=TextNode.ACenter, mayChange=False, parent=self.aspect2d
         )
 
-        nextButton = DirectButton(
+        nextButton = self.addWidget(DirectButton(
             text="Next", text_font=Game.fonts["AmericanCaptain"],
             scale=0.10, command=self.startGame,
             pad=(0.3, 0.3),
-            pos=(0, 0, -0.8)
-        )
+            pos=(0, 0, -0.8), parent=self.aspect2d
+        ))
 
         spaceShortcut = OnscreenText(
             text='[Space]', pos=(0, -0.93), scale=0.07,
             font=Game.fonts["AmericanCaptain"],
             align=TextNode.ACenter, mayChange=False,
-            bg=(182, 182, 182, 0.5),
+            bg=(182, 182, 182, 0.5), parent=self.aspect2d
         )
 
         # Get List of cars
@@ -503,17 +608,17 @@ class RacecarSelection(Game):
         text = OnscreenText(
             text='Racecar:', pos=(-0.55, 0.4), scale=0.1,
             font=Game.fonts["AmericanCaptain"], bg=(255, 255, 255, 1),
-            align=TextNode.ARight, mayChange=False
+            align=TextNode.ARight, mayChange=False, parent=self.aspect2d
         )
 
-        menu = DirectOptionMenu(
+        menu = self.addWidget(DirectOptionMenu(
             scale=0.15,
             items=self.cars, initialitem=initialCar,
             highlightColor=(10, 10, 10, 1),
             pad=(10, 10),
             pos=(-0.5, 0, 0.4),
-            command=self.selectCar
-        )
+            command=self.selectCar, parent=self.aspect2d
+        ))
 
         # Get List of passengers
         self.passengers = self.findCarsOrPassengers("models", "passenger_")
@@ -523,17 +628,17 @@ class RacecarSelection(Game):
         text = OnscreenText(
             text='Passenger:', pos=(-0.55, 0.2), scale=0.1,
             font=Game.fonts["AmericanCaptain"], bg=(255, 255, 255, 1),
-            align=TextNode.ARight, mayChange=False
+            align=TextNode.ARight, mayChange=False, parent=self.aspect2d
         )
 
-        menu = DirectOptionMenu(
+        menu = self.addWidget(DirectOptionMenu(
             scale=0.15,
             items=self.passengers, initialitem=initialPassenger,
             highlightColor=(10, 10, 10, 1),
             pad=(10, 10),
             pos=(-0.5, 0, 0.2),
-            command=self.selectPassenger
-        )
+            command=self.selectPassenger, parent=self.aspect2d
+        ))
 
         # If drawing is needed, passenger needs to be selected first
         self.displayedCar = None
@@ -545,7 +650,7 @@ class RacecarSelection(Game):
         self.accept("space-up", self.startGame)
 
         # Add task to spin camera
-        self.taskMgr.add(self.carShowcase, "CarShowcase")
+        self.addTask(self.carShowcase, "CarShowcase")
 
     # Define a procedure to move the camera.
     def carShowcase(self, task):
@@ -575,6 +680,8 @@ class RacecarSelection(Game):
         self.camera.setPos(10, 10, 10)
         self.camera.lookAt(pos)
 
+        self.game.preloader.preloadRace(Game.selectedTrack, Game.selectedCar, Game.selectedPassenger)
+
     def selectPassenger(self, passenger):
         Game.selectedPassenger = passenger
 
@@ -583,35 +690,40 @@ class RacecarSelection(Game):
     def findCarsOrPassengers(self, path, prefix=""):
         items = []
 
-        for f in os.listdir(path):
-            if f.startswith(prefix):
-                f = f.replace(prefix, "", 1)
-                for ext in Obj3D.modelTypes:
-                    f = f.replace(f".{ext}", "", 1)
-                items.append(f)
+        for f in sorted(os.listdir(path)):
+            name, ext = os.path.splitext(f)
+
+            # A model can have a compiled bam next to its source (see AssetBuilder)
+            if name.startswith(prefix) and ext[1:] in Obj3D.modelTypes:
+                item = name.replace(prefix, "", 1)
+                if item not in items:
+                    items.append(item)
 
         return items
 
     def startGame(self):
         self.nextState("instructions")
 
-class InstructionsScreen(Game):
-    def __init__(self):
-        ShowBase.__init__(self)
+class InstructionsScreen(Scene):
+    def __init__(self, game):
+        super().__init__(game)
 
-        self.helpDialog = HelpDialog()
+        self.helpDialog = self.addWidget(HelpDialog(self.aspect2d))
         self.helpDialog.nextButton["command"] = self.startGame
         self.helpDialog.buttonHelperText.setText("[Space]")
 
+        # Nothing new if the selection screens have already started these loads
+        self.game.preloader.preloadRace(Game.selectedTrack, Game.selectedCar, Game.selectedPassenger)
+
         # Next frame without clicking
         self.accept("space-up", self.startGame)
 
     def startGame(self):
         self.nextState("game")
 
-class RacingGame(Game):
-    def __init__(self):
-        ShowBase.__init__(self)
+class RacingGame(Scene):
+    def __init__(self, game):
+        super().__init__(game)
 
         # Get other stuff ready
         self.paused = False
@@ -621,12 +733,28 @@ class RacingGame(Game):
         self.gameOverTime = 0 # for camera rotation
         self.printStatements = False
 
-        self.helpDialog = HelpDialog()
+        # Time since the race started (in seconds of simulated time), used for lap times
+        self.raceTime = 0
+
+        # Ticks (physics, AI and collisions) per second of the simulation
+        self.tickRate = 60
+
+        self.helpDialog = self.addWidget(HelpDialog(self.aspect2d))
         self.helpDialog.hide()
         self.helpDialog.nextButton["command"] = self.togglePause
 
         self.totalLaps = 3
 
+        # The AI and powerups use the random module, so the seed (and the inputs)
+        # are all that is needed to replay the race
+        self.replay = Game.replay
+        if self.replay != None:
+            self.seed = self.replay.seed
+            self.tickRate = self.replay.tickRate
+            self.totalLaps = self.replay.totalLaps
+        else:
+            self.seed = random.randrange(2**32)
+
         Obj3D.worldRenderer = self.render
 
         # Generate texts
@@ -635,9 +763,20 @@ class RacingGame(Game):
         self.texts["lap"] = OnscreenText(
             text=f'Lap 1/{self.totalLaps}', pos=(-1.25, 0.8), scale=0.15,
             bg=(255, 255, 255, 0.7), font=Game.fonts["AmericanCaptain"],
-            align=TextNode.ALeft, mayChange=True
+            align=TextNode.ALeft, mayChange=True, parent=self.aspect2d
         )
 
+        # Race position of the player, set once the cars are loaded
+        self.texts["position"] = OnscreenText(
+            text='', pos=(-1.25, 0.65), scale=0.1,
+            bg=(255, 255, 255, 0.7), font=Game.fonts["AmericanCaptain"],
+            align=TextNode.ALeft, mayChange=True, parent=self.aspect2d
+        )
+        self.playerPosition = None
+
+        # Only attach what was loaded in the menus from here on (see Preloader)
+        self.game.preloader.finish()
+
         # Load collision handlers
         self.collisionSetup(showCollisions=False)
 
@@ -646,9 +785,29 @@ class RacingGame(Game):
         self.loadAudio()
 
         # Load the various models
+        random.seed(self.seed)
         self.loadModels()
         self.loadMinimap()
 
+        # The track is also paged around the camera (which can be far from the cars, see CameraController)
+        self.racetrack.pagingCamera = self.camera
+
+        # Race logic runs at a fixed timestep, independent of the frame rate
+        # NOTE: Collisions are traversed on every tick by the simulation, not every frame
+        self.simulation = RaceSimulation(self, self.racetrack, self.cars, self.tickRate)
+
+        # Either play back the replay, or record this race
+        if self.replay != None:
+            self.replayPlayer = ReplayPlayer(self.replay, self.simulation)
+            self.replayRecorder = None
+
+            self.setReplaySpeed(Game.replaySpeed)
+        else:
+            self.replayPlayer = None
+            self.replayRecorder = ReplayRecorder(
+                self.simulation, Game.selectedTrack, self.seed, self.totalLaps
+            )
+
         # Load lights and the fancy background
         # NOTE: Racetrack needs to be generated first to properly generate the terrain
         self.loadBackground()
@@ -659,16 +818,17 @@ class RacingGame(Game):
         self.createKeyControls()
 
         # Init camera
+        # NOTE: After the game timer, so that the camera follows the interpolated player
         self.camConfigDefault = "perspective"
         self.camConfig = self.camConfigDefault
-        self.taskMgr.add(self.setCameraToPlayer, "SetCameraToPlayer")
+        self.addTask(self.setCameraToPlayer, "SetCameraToPlayer", sort=2)
 
         # Check for key presses 
         # And do corresponding action
-        self.taskMgr.add(self.keyPressHandler, "KeyPressHandler")
+        self.addTask(self.keyPressHandler, "KeyPressHandler", sort=0)
 
         # Start a game timer
-        self.taskMgr.add(self.gameTimer, "GameTimer")
+        self.addTask(self.gameTimer, "GameTimer", sort=1)
 
     def setCameraToPlayer(self, task):
         # Focus on winning car when gameover
@@ -765,6 +925,8 @@ class RacingGame(Game):
     def gameOver(self, car):
         self.isGameOver = True
         self.winningCar = car
+
+        self.simulation.recordFinish(car)
         
         if car.id == 0: # player
             winMsg = f"Yay! You have won the game, beating {Racecar.nRacecars-1} other cars!"
@@ -772,54 +934,77 @@ class RacingGame(Game):
             winMsg = f"Oh no! You have been beaten by car {car.id+1}!"
 
         self.texts["lap"].destroy()
+        self.texts["position"].destroy()
 
         self.texts["gameOver"] = OnscreenText(
             text=winMsg, pos=(0, 0.8), scale=0.15,
             bg=(255, 255, 255, 0.7), wordwrap=20, 
             font=Game.fonts["AmericanCaptain"],
-            align=TextNode.ACenter, mayChange=False
+            align=TextNode.ACenter, mayChange=False, parent=self.aspect2d
         )
 
-        startGameButton = DirectButton(
+        startGameButton = self.addWidget(DirectButton(
             text="Restart Game", text_font=Game.fonts["AmericanCaptain"],
             scale=0.15, command=self.restartGame,
             pad=(0.3, 0.3),
-            pos=(0, 0, -0.75)
-        )
+            pos=(0, 0, -0.75), parent=self.aspect2d
+        ))
 
         # Make camera move and have the audio stop after
         self.setCameraView("perspective_rotate_win")
         return
 
+    # Called by a car when it starts a new lap
+    def onNewLap(self, car):
+        # Player, so update on screen text
+        if car.id == 0:
+            self.texts["lap"].setText(
+                f'Lap {car.currLap+1}/{self.totalLaps}')
+
+    # Show the player's race position (only when it changes)
+    def updatePositionText(self):
+        position = self.player.racePosition
+        if position == self.playerPosition:
+            return
+
+        self.playerPosition = position
+        self.texts["position"].setText(f'Position {position}/{len(self.cars)}')
+
     # Game Timer
     def gameTimer(self, task):
         if self.paused or self.isGameOver:
             return Task.cont
 
+        # Stop at the end of the replay
+        maxTicks = None
+        if self.replayPlayer != None:
+            maxTicks = self.replay.nTicks - self.simulation.nTicks
+
+            if maxTicks <= 0:
+                return Task.cont
+
+        self.simulation.advance(globalClock.getDt(), maxTicks)
+
+        if self.isGameOver:
+            self.saveReplay()
+        else:
+            self.updatePositionText()
+
         for car in self.cars:
-            car.updatePowerup(task.time)
-            car.updateMovement()
             car.updateMinimap(self.minimapPoints[car.id])
 
-        for powerup in self.racetrack.powerups:
-            if powerup != None:
-                powerup.spin()
-
         return Task.cont
 
     # Load Audio
     def loadAudio(self):
-        audio3d = Audio3DManager.Audio3DManager(
-            base.sfxManagerList[0], base.camera
-        )
-        Obj3D.audio3d = audio3d
-
         self.audio = {}
 
         # Bg audio
-        bgAudio = base.loader.loadSfx("audio/purple_passion.mp3")
+        # NOTE: The same sound as in the last race, which may have been paused
+        bgAudio = self.game.preloader.getSound("audio/purple_passion.mp3")
         bgAudio.setLoop(True)
         bgAudio.setVolume(0.05)
+        bgAudio.setPlayRate(1)
 
         bgAudio.play()
         
@@ -830,39 +1015,39 @@ class RacingGame(Game):
         #add one light per face, so each face is nicely illuminated
         plight1 = PointLight('plight')
         plight1.setColor(VBase4(1, 1, 1, 1))
-        plight1NodePath = render.attachNewNode(plight1)
+        plight1NodePath = self.render.attachNewNode(plight1)
         plight1NodePath.setPos(0, 0, 500)
-        render.setLight(plight1NodePath)
+        self.render.setLight(plight1NodePath)
 
         plight2 = PointLight('plight')
         plight2.setColor(VBase4(1, 1, 1, 1))
-        plight2NodePath = render.attachNewNode(plight2)
+        plight2NodePath = self.render.attachNewNode(plight2)
         plight2NodePath.setPos(0, 0, -500)
-        render.setLight(plight2NodePath)
+        self.render.setLight(plight2NodePath)
 
         plight3 = PointLight('plight')
         plight3.setColor(VBase4(1, 1, 1, 1))
-        plight3NodePath = render.attachNewNode(plight3)
+        plight3NodePath = self.render.attachNewNode(plight3)
         plight3NodePath.setPos(0, -500, 0)
-        render.setLight(plight3NodePath)
+        self.render.setLight(plight3NodePath)
 
         plight4 = PointLight('plight')
         plight4.setColor(VBase4(1, 1, 1, 1))
-        plight4NodePath = render.attachNewNode(plight4)
+        plight4NodePath = self.render.attachNewNode(plight4)
         plight4NodePath.setPos(0, 500, 0)
-        render.setLight(plight4NodePath)
+        self.render.setLight(plight4NodePath)
 
         plight5 = PointLight('plight')
         plight5.setColor(VBase4(1, 1, 1, 1))
-        plight5NodePath = render.attachNewNode(plight5)
+        plight5NodePath = self.render.attachNewNode(plight5)
         plight5NodePath.setPos(500, 0, 0)
-        render.setLight(plight5NodePath)
+        self.render.setLight(plight5NodePath)
 
         plight6 = PointLight('plight')
         plight6.setColor(VBase4(1, 1, 1, 1))
-        plight6NodePath = render.attachNewNode(plight6)
+        plight6NodePath = self.render.attachNewNode(plight6)
         plight6NodePath.setPos(-500, 0, 0)
-        render.setLight(plight6NodePath)
+        self.render.setLight(plight6NodePath)
 
     def loadBackground(self):
         self.terrain = Terrain(self)
@@ -872,27 +1057,43 @@ class RacingGame(Game):
         Racecar.nRacecars = 0
         Powerup.nPowerups = 0
 
-        self.racetrack = Racetrack(self, Game.selectedTrack)
+        if self.replay != None:
+            self.racetrack = Racetrack(
+                self, self.replay.getTrackName(), paging=Game.trackPaging, pagingDistance=Game.pagingDistance
+            )
+
+            # Same cars as in the recording (the player is the first car)
+            for i, (carType, model, passenger) in enumerate(self.replay.cars):
+                carClass = HeadlessRace.getCarClass(carType)
+                car = carClass(self, model, passenger, self.render)
+
+                if self.replay.driving[i] != None:
+                    car.setDrivingParameters(self.replay.driving[i])
+
+                self.cars.append(car)
+
+            self.player = self.cars[0]
+            return
+
+        self.racetrack = Racetrack(
+            self, Game.selectedTrack, paging=Game.trackPaging, pagingDistance=Game.pagingDistance
+        )
 
         # Only the positions are updated here because we want to space them out
         # But car facing and checkpoint handling are handled inside the init function
         self.player = Racecar(self, Game.selectedCar, Game.selectedPassenger, self.render)
         self.cars.append(self.player)
 
-        # Basic levels
-        # TODO: Maybe more cars (easy to add)?
-        if Game.level == "easy":
-            car1 = NotSoStupidCar(self, "racecar", 'bunny', self.render)
-            car2 = NotSoStupidCar(self, "jeep", "chicken", self.render)
-        elif Game.level == "hard":
-            car1 = SmartGreedyCar(self, "groundroamer", "bunny", self.render)
-            car2 = SmartGreedyCar(self, "jeep", "chicken", self.render)
-        else: # normal level
-            car1 = SmartCar(self, "groundroamer", 'bunny', self.render)
-            car2 = SmartGreedyCar(self, "jeep", "chicken", self.render)
-
-        self.cars.append(car1)
-        self.cars.append(car2)
+        # Opponents from the mix of AI types of the level
+        # NOTE: Picked with their own generator, so that the random module is
+        # in the same state as when a replay of the race creates the same cars
+        config = RaceConfig.fromLevel(Game.level, Game.nOpponents)
+        for carType, model, passenger in config.pickOpponents(random.Random(self.seed)):
+            carClass = HeadlessRace.getCarClass(carType)
+            car = carClass(self, model, passenger, self.render)
+
+            config.setupOpponent(car)
+            self.cars.append(car)
 
         if self.printStatements: print(f"Opponent cars generated with difficulty {Game.level}")
 
@@ -912,14 +1113,14 @@ class RacingGame(Game):
         minimapCard.setFrame(-0.95, -0.35, -0.95, -0.35) # left right bottom top
         minimapCard.setColor(90/255, 90/255, 90/255, 0.8)
 
-        render2d.attachNewNode(minimapCard.generate())
-        render2d.setTransparency(True)
+        self.render2d.attachNewNode(minimapCard.generate())
+        self.render2d.setTransparency(True)
 
         # Draw the actual minimap (tracks)
         # Note that x=0, z=0 is at the center of the screen
         # Everything is normalised to 1
 
-        self.minimap = Minimap(points, renderer=render2d, scaleFactor=scaleFactor, color=(1,1,1,0.5))
+        self.minimap = Minimap(points, renderer=self.render2d, scaleFactor=scaleFactor, color=(1,1,1,0.5))
         renderNode = self.minimap.renderNode
         renderNode.setPos(-0.9, 0, -0.9)
         renderNode.setHpr(0, 90, 0)
@@ -967,11 +1168,13 @@ class RacingGame(Game):
             (self.setCameraView, ["2"], ["birdsEye"]),
             (self.setCameraView, ["3"], ["firstPerson"]),
             (self.restartGame, ["r"], None),
-            (self.oobe, ["="], None),
+            (self.game.oobe, ["="], None),
             (self.togglePause, ["backspace"], [False]),
             (self.togglePause, ["p", "escape"], None),
             (self.togglePrintStatements, ["\\"], None),
-            (self.toggleMute, ["m"], None)
+            (self.toggleMute, ["m"], None),
+            (self.changeReplaySpeed, ["]"], [2]),
+            (self.changeReplaySpeed, ["["], [0.5])
         ]
 
         for fn, keys, args in keyReleaseMap:
@@ -1012,22 +1215,11 @@ class RacingGame(Game):
 
         player = self.player
 
-        if self.isKeyDown["drifting"] > 0:
-            player.drifting = True
-        else:
-            player.drifting = False
-
-        if self.isKeyDown["forward"] > 0:
-            player.doDrive("forward")
-            
-        if self.isKeyDown["backward"] > 0:
-            player.doDrive("backward")
-
-        if self.isKeyDown["turnLeft"] > 0:
-            player.doTurn("left")
-
-        if self.isKeyDown["turnRight"] > 0:
-            player.doTurn("right")
+        # Controls are applied by the simulation on every tick
+        # (unless they are played back from a replay)
+        if self.replayPlayer == None:
+            for control in player.controls:
+                player.controls[control] = self.isKeyDown[control] > 0
 
         if self.isKeyDown["camConfigRotate"] > 0:
             self.camConfig += "_rotate"
@@ -1044,10 +1236,13 @@ class RacingGame(Game):
     # https://hub.packtpub.com/collision-detection-and-physics-panda3d-game-development/
     # Collision Events
     def collisionSetup(self, showCollisions=False):
-        base.cTrav = CollisionTraverser()
+        self.game.cTrav = CollisionTraverser()
+
+        # NOTE: Cars keep their own traversers for walls, checkpoints and powerups,
+        #       and take their height from the track (see RaceSimulation)
 
         if showCollisions:
-            base.cTrav.showCollisions(render)
+            self.game.cTrav.showCollisions(self.render)
 
         # Set bitmasks
         # Reference: https://www.panda3d.org/manual/?title=Bitmask_Example
@@ -1086,8 +1281,78 @@ class RacingGame(Game):
             playRate = 0 if self.paused or self.isGameOver or self.muted else 1
             sound.setPlayRate(playRate)
 
+    # Save the recording of the race so far
+    def saveReplay(self):
+        if self.replayRecorder == None:
+            return
+
+        fileName = self.replayRecorder.save()
+        if fileName != None and self.printStatements:
+            print(f"Replay saved to {fileName}")
+
+    # Fast forward (or slow down) the replay
+    def setReplaySpeed(self, speed):
+        clock = self.simulation.clock
+
+        clock.timeScale = speed
+
+        # Allow enough ticks per frame to keep up
+        clock.maxSubSteps = max(8, math.ceil(8 * speed))
+
+        if self.printStatements: print(f"Replay speed set to {speed}x")
+
+    def changeReplaySpeed(self, factor):
+        if self.replayPlayer == None:
+            return
+
+        speed = self.simulation.clock.timeScale * factor
+        self.setReplaySpeed(min(max(speed, 0.125), 32))
+
     def restartGame(self):
+        # Keep what was played, even if the race is not over
+        self.saveReplay()
+        Game.replay = None
+
         self.nextState("start")
 
-game = Game()
-game.run()
+    def destroy(self):
+        for sound in self.audio.values():
+            sound.stop()
+
+        for car in self.cars:
+            car.deactivatePowerup()
+
+        super().destroy()
+
+        self.game.cTrav = None
+        Obj3D.worldRenderer = None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=gameTitle)
+    parser.add_argument("--opponents", type=int, default=Game.nOpponents, help="Number of AI cars racing the player")
+    parser.add_argument(
+        "--presets", default=RaceConfig.presetsFile,
+        help="Difficulty levels to use instead of the default ones, if the file exists (see Evolution)"
+    )
+    parser.add_argument(
+        "--textureQuality", default=Game.textureQuality,
+        choices=list(AssetBuilder.textureQualities.keys()) + [ "source" ],
+        help="Size of the textures (compiled by AssetBuilder.py), or source for the original textures"
+    )
+    parser.add_argument(
+        "--paging", default="none", choices=[ "none", "detach", "unload" ],
+        help="Take the sections of the racetrack far from the camera and every car out of the scene"
+    )
+    parser.add_argument("--pagingDistance", type=float, default=Game.pagingDistance)
+    args = parser.parse_args()
+
+    Game.nOpponents = args.opponents
+    Game.textureQuality = None if args.textureQuality == "source" else args.textureQuality
+    Game.trackPaging = None if args.paging == "none" else args.paging
+    Game.pagingDistance = args.pagingDistance
+
+    if RaceConfig.loadPresets(args.presets):
+        print(f"Difficulty levels loaded from {args.presets}")
+
+    game = Game()
+    game.run()
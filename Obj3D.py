@@ -94,6 +94,145 @@ def normaliseEuler(n):
 
     return n
 
+'''
+Model prototype shared by every Obj3D of the same model
+
+Loads the model file once and measures its tight bounds once.
+Objects then get their own node with the prototype's geometry
+instanced (or copied) underneath, so that placing thousands of 
+walls does not re-scan thousands of vertices.
+'''
+class ModelPrototype(object):
+    # The model is loaded from its file, unless it has been loaded already (see Preloader)
+    def __init__(self, modelName, model=None):
+        self.modelName = modelName
+        self.modelFile = ModelPrototype.findModelFile(modelName)
+
+        if model != None:
+            self.model = model
+        else:
+            try:
+                self.model = loader.loadModel(self.modelFile)
+            except:
+                raise Exception(f"Model {modelName} cannot be loaded")
+
+        Obj3D.useCompiledTextures(self.model)
+
+        # NOTE: Measured at the identity transform, in the model's own coordinates
+        self.minPoint, self.maxPoint = self.model.getTightBounds()
+
+        self.dim = tuple(self.maxPoint - self.minPoint)
+        self.offset = tuple((self.maxPoint + self.minPoint) / 2)
+
+        # Less detailed versions of the model, only loaded when asked for (see getLods)
+        self.lods = None
+
+        # The model flattened into as few nodes as possible, only made when asked for (see getFlattened)
+        self.flattened = None
+
+    # Find model file, checking if we can load this model type
+    @staticmethod
+    def findModelFile(model):
+        modelFile = f"models/{model}"
+
+        modelFiles = [
+            f"{modelFile}.{modelType}" for modelType in Obj3D.modelTypes
+            if os.path.exists(f"{modelFile}.{modelType}")
+        ]
+
+        if len(modelFiles) == 0:
+            return modelFile
+
+        # Compiled models (see AssetBuilder) are skipped if their source has changed since
+        if modelFiles[0].endswith(".bam") and len(modelFiles) > 1 \
+           and os.path.getmtime(modelFiles[0]) < os.path.getmtime(modelFiles[1]):
+            return modelFiles[1]
+
+        return modelFiles[0]
+
+    # Less detailed versions of a model (see AssetBuilder), from the most to the least detailed
+    # The ones older than the model file are skipped, as they were made from an older model
+    @staticmethod
+    def findLodFiles(model):
+        modelFile = ModelPrototype.findModelFile(model)
+        modelTime = os.path.getmtime(modelFile) if os.path.exists(modelFile) else 0
+
+        lodFiles = []
+        while True:
+            lodFile = f"{Obj3D.lodDir}/{model}-{len(lodFiles) + 1}.bam"
+
+            if not os.path.exists(lodFile) or os.path.getmtime(lodFile) < modelTime:
+                return lodFiles
+
+            lodFiles.append(lodFile)
+
+    def getLods(self):
+        if self.lods == None:
+            self.lods = []
+
+            for lodFile in ModelPrototype.findLodFiles(self.modelName):
+                try:
+                    lod = loader.loadModel(lodFile)
+                except:
+                    print(f"Model {lodFile} cannot be loaded")
+                    break
+
+                Obj3D.useCompiledTextures(lod)
+                self.lods.append(lod)
+
+        return self.lods
+
+    # Copies are merged with each other (see Racetrack.batchWalls), and merging
+    # a few big geoms is much faster than merging many small ones,
+    # so the copies are made from a copy of the model with all its geoms merged
+    def getFlattened(self):
+        if self.flattened == None:
+            self.flattened = self.model.copyTo(NodePath())
+            self.flattened.clearModelNodes()
+            self.flattened.flattenStrong()
+
+        return self.flattened
+
+    # Create a new node for an object
+    # Instancing shares the geometry nodes with the prototype (cheapest),
+    # copying duplicates the nodes (but not the vertex data) of the flattened model
+    # so that they can be modified without affecting other objects
+    def spawn(self, instance=True):
+        model = NodePath(ModelRoot(self.modelName))
+
+        if instance:
+            self.model.instanceTo(model)
+        else:
+            self.getFlattened().copyTo(model)
+
+        return model
+
+    # Dimensions of the model given a uniform scale
+    def getDimensions(self, scale=1):
+        return multiplyVectorByScalar(self.dim, scale)
+
+    # Bounds of the model under a transform (such as the model's transform relative to its parent)
+    # The 8 corners of the measured box are transformed, which is exact 
+    # unless the transform rotates the model by a non-right angle
+    def getBounds(self, transform):
+        mat = transform.getMat()
+
+        x1, y1, z1 = self.minPoint
+        x2, y2, z2 = self.maxPoint
+
+        points = [
+            mat.xformPoint(LPoint3f(x, y, z))
+            for x in (x1, x2) for y in (y1, y2) for z in (z1, z2)
+        ]
+
+        minPoint = LPoint3f(points[0])
+        maxPoint = LPoint3f(points[0])
+        for point in points[1:]:
+            minPoint = minPoint.fmin(point)
+            maxPoint = maxPoint.fmax(point)
+
+        return minPoint, maxPoint
+
 class Obj3D(object):
     # Set worldRenderer in app loadModels
     worldRenderer = None
@@ -101,24 +240,25 @@ class Obj3D(object):
 
     modelTypes = ["bam", "egg", "gltf", "glb"]  # in order of priority
 
-    def __init__(self, model, renderParent=None, pos=None, hpr=None):
-        # Set model
-        # Also check if we can load this model type
-        self.modelName = model
-        modelTypes = Obj3D.modelTypes
-        modelFile = f"models/{model}"
+    # Shared prototypes, keyed by model name (see ModelPrototype)
+    prototypes = {}
 
-        for modelType in modelTypes:
-            tempModelFile = modelFile + "." + modelType
+    # Compiled textures (see AssetBuilder) to use in place of the source textures,
+    # by quality ("low", "medium" or "high"), or None for the source textures
+    # Set with setTextureQuality
+    textureQuality = None
+    compiledTextureDir = "models/txo"
 
-            if os.path.exists(tempModelFile):
-                modelFile = tempModelFile
-                break
-        
-        try:
-            self.model = loader.loadModel(modelFile)
-        except:
-            raise Exception(f"Model {model} cannot be loaded")
+    # Less detailed versions of the models (see AssetBuilder and useLods)
+    lodDir = "models/lod"
+
+    def __init__(self, model, renderParent=None, pos=None, hpr=None, instance=True):
+        # Set model
+        # The model file is only loaded and measured once per model name,
+        # every object after that gets an instance (or a copy) of the prototype
+        self.modelName = model
+        self.prototype = Obj3D.getPrototype(model)
+        self.model = self.prototype.spawn(instance)
 
         # Set rendering parent
         self.renderParent = renderParent \
@@ -153,6 +293,127 @@ class Obj3D(object):
         # 3D Audio
         self.audio = { }
 
+    # Get (or load and measure) the shared prototype of a model
+    @staticmethod
+    def getPrototype(model):
+        prototype = Obj3D.prototypes.get(model)
+
+        if prototype == None:
+            prototype = ModelPrototype(model)
+            Obj3D.prototypes[model] = prototype
+
+        return prototype
+
+    # Use the compiled textures of a quality, if they have been built
+    # NOTE: The source textures are then only read from disk when they are rendered,
+    # so that the ones that are replaced are never read (see useCompiledTextures)
+    @staticmethod
+    def setTextureQuality(quality):
+        if quality != None and not os.path.isdir(f"{Obj3D.compiledTextureDir}/{quality}"):
+            print(f"No {quality} quality textures, run AssetBuilder.py to build them")
+            quality = None
+
+        Obj3D.textureQuality = quality
+        ConfigVariableBool("preload-textures").setValue(quality == None)
+
+    # Compiled texture of a source texture (such as models/maps/chicken.tif)
+    @staticmethod
+    def getCompiledTextureFile(sourceFile, quality):
+        sourceFile = os.path.relpath(sourceFile, "models")
+        return f"{Obj3D.compiledTextureDir}/{quality}/{sourceFile}.txo"
+
+    # Source texture of a texture file, which can be a compiled texture of any quality
+    @staticmethod
+    def getSourceTextureFile(textureFile):
+        textureFile = os.path.relpath(textureFile).replace(os.sep, "/")
+
+        if textureFile.startswith(Obj3D.compiledTextureDir + "/") and textureFile.endswith(".txo"):
+            textureFile = textureFile[len(Obj3D.compiledTextureDir) + 1:-len(".txo")]
+            # Without the quality
+            textureFile = "models/" + textureFile.split("/", 1)[1]
+
+        return textureFile
+
+    # Texture file to load for a source texture: its compiled texture if there is
+    # one (as new as the source) of the texture quality, or else the source itself
+    @staticmethod
+    def findTextureFile(sourceFile):
+        if Obj3D.textureQuality == None:
+            return sourceFile
+
+        textureFile = Obj3D.getCompiledTextureFile(sourceFile, Obj3D.textureQuality)
+
+        if os.path.exists(textureFile) and \
+           (not os.path.exists(sourceFile) or os.path.getmtime(textureFile) >= os.path.getmtime(sourceFile)):
+            return textureFile
+
+        return sourceFile
+
+    # Swap the textures of a model (or a whole scene) for the ones of the texture quality
+    # Textures are shared through the texture pool, so every texture file is only loaded once
+    @staticmethod
+    def useCompiledTextures(model):
+        for texture in model.findAllTextures():
+            if texture.getFullpath().empty():
+                continue
+
+            currentFile = texture.getFullpath().toOsSpecific()
+            sourceFile = Obj3D.getSourceTextureFile(currentFile)
+            textureFile = Obj3D.findTextureFile(sourceFile)
+
+            if os.path.abspath(textureFile) == os.path.abspath(currentFile):
+                continue
+
+            try:
+                newTexture = loader.loadTexture(textureFile)
+            except:
+                print(f"Texture {textureFile} cannot be loaded")
+                continue
+
+            # Same wrapping and filtering as in the model, with the mipmaps of the compiled texture
+            sampler = SamplerState(texture.getDefaultSampler())
+            if newTexture.getNumRamMipmapImages() > 1:
+                sampler.setMinfilter(SamplerState.FT_linear_mipmap_linear)
+            newTexture.setDefaultSampler(sampler)
+
+            model.replaceTexture(texture, newTexture)
+
+    # Show less detailed versions of the model further away from the camera,
+    # if it has any (see ModelPrototype.getLods)
+    # distances: how far away (in world units) the model, then every less detailed
+    # version in turn, stops being shown; the last version shown is kept beyond that
+    # NOTE: Only for instanced models, and after the model has been scaled
+    def useLods(self, distances):
+        lods = self.prototype.getLods()
+        if len(lods) == 0:
+            return
+
+        instances = [
+            child for child in self.model.getChildren() 
+            if child.node() == self.prototype.model.node()
+        ]
+        if len(instances) == 0:
+            return
+
+        # The switch distances are in the coordinates of the model, which may be scaled
+        scale = max(self.model.getNetTransform().getScale())
+
+        versions = ([ self.prototype.model ] + lods)[:len(distances) + 1]
+
+        lodNode = LODNode(f"{self.modelName}-lod")
+        lodRoot = self.model.attachNewNode(lodNode)
+
+        near = 0
+        for i, version in enumerate(versions):
+            far = distances[i] / scale if i < len(versions) - 1 else 1e9
+            lodNode.addSwitch(far, near)
+            version.instanceTo(lodRoot)
+
+            near = far
+
+        for instance in instances:
+            instance.removeNode()
+
     # Collision Handling
     # Initialise a an object surrounding the whole player
     def initSurroundingCollisionObj(self, name=None, shape="box", show=False, args=None):
@@ -260,7 +521,7 @@ class Obj3D(object):
 
     # Set texture
     def initTexture(self, textureName, override=1):
-        texture = loader.loadTexture(f"models/tex/{textureName}.png")
+        texture = loader.loadTexture(Obj3D.findTextureFile(f"models/tex/{textureName}.png"))
         
         '''
         self.model.setTexGen(
@@ -379,10 +640,11 @@ class Obj3D(object):
 
     # Get dimensions
     # NOTE: These dimensions are absolute to the rendering parent
-    # NOTE: Slow
+    # NOTE: No longer walks the geometry; the prototype's bounds
+    #       (measured once) are transformed by the model's transform instead
     # https://discourse.panda3d.org/t/how-to-get-width-and-height-of-an-object/1490
     def calculateDimensionsAndOffset(self):
-        pt1, pt2 = self.model.getTightBounds()
+        pt1, pt2 = self.prototype.getBounds(self.model.getTransform())
 
         x1, y1, z1 = pt1.getX(), pt1.getY(), pt1.getZ()
         x2, y2, z2 = pt2.getX(), pt2.getY(), pt2.getZ()
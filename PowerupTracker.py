@@ -0,0 +1,79 @@
+'''
+Powerup pickup
+
+Instead of testing every car's sphere against the powerup spheres with the traverser,
+the powerups are kept in a spatial hash (they do not move), and every car only
+tests the spheres of the powerups in the cells around it.
+
+Like the "out" events of the collision handler this replaces, a powerup is
+collected when the car leaves it (see Racecar.collectPowerup).
+'''
+
+from Obj3D import *
+from SpatialHash import *
+
+class PowerupTracker(object):
+    def __init__(self, racetrack, cars):
+        self.racetrack = racetrack
+        self.cars = list(cars)
+
+        self.powerups = [ powerup for powerup in racetrack.powerups if powerup != None ]
+
+        # Order of every powerup along the racetrack
+        self.order = { powerup: k for k, powerup in enumerate(self.powerups) }
+
+        # Center and radius of every powerup's sphere
+        self.spheres = {}
+
+        self.powerupHash = SpatialHash(racetrack.trackBounds, racetrack.defaultWallSpacing)
+        for powerup in self.powerups:
+            center, radius = PowerupTracker.getSphere(powerup.getCollisionNode("powerup"))
+            center = Obj3D.worldRenderer.getRelativePoint(powerup.model, center)
+
+            self.spheres[powerup] = (center, radius)
+            self.powerupHash.insert(powerup, center[0], center[1], radius)
+
+        # Center (relative to the car) and radius of every car's sphere
+        self.carSpheres = [
+            PowerupTracker.getSphere(car.colPowerupNode)
+            for car in self.cars
+        ]
+
+        # Powerups each car was touching in the last tick
+        self.contacts = [ set() for car in self.cars ]
+
+    # Center (relative to the model it is attached to) and radius of the collision sphere of a node
+    @staticmethod
+    def getSphere(colNode):
+        sphere = colNode.node().getSolid(0)
+        parent = colNode.getParent()
+
+        center = colNode.getMat(parent).xformPoint(sphere.getCenter())
+        radius = sphere.getRadius() * colNode.getSx(Obj3D.worldRenderer)
+
+        return center, radius
+
+    # Collect the powerups that cars drove through
+    def update(self):
+        for i, car in enumerate(self.cars):
+            localCenter, radius = self.carSpheres[i]
+            x, y, z = car.model.getMat().xformPoint(localCenter)
+
+            contacts = set()
+            for powerup in self.powerupHash.queryRadius(x, y, radius):
+                (px, py, pz), powerupRadius = self.spheres[powerup]
+                dist = radius + powerupRadius
+
+                if (px - x)**2 + (py - y)**2 + (pz - z)**2 <= dist * dist:
+                    contacts.add(powerup)
+
+            # Powerups the car left, in the order of the racetrack
+            for powerup in sorted(self.contacts[i] - contacts, key=self.order.get):
+                car.collectPowerup(powerup.powerupType)
+
+            self.contacts[i] = contacts
+
+    # Closest powerup to (x, y), within maxDist
+    # Only powerups for which condition(powerup) is True count, if given
+    def getNearestPowerup(self, x, y, maxDist=math.inf, condition=None):
+        return self.powerupHash.nearest(x, y, maxDist, condition)
@@ -0,0 +1,167 @@
+'''
+Background loading of the assets of the next race
+
+While the player is still picking the racetrack and the car (and reading the
+instructions), the models, the cached static scene of the racetrack and the
+music of the race are loaded on Panda's loader thread. Once loaded they are
+put where the race looks for them first: the models become the shared
+prototypes (see Obj3D.getPrototype), the static scene is left for the next
+Racetrack built from it (see Racetrack.loadFromCache) and the music is kept
+here (see getSound). Entering the race then only has to attach them.
+
+For example:
+    preloader = Preloader(base.loader)
+    preloader.preloadRace("test.track", "groundroamer", "penguin")
+    ...
+    preloader.finish()  # just before the race is built
+
+Anything that was not preloaded is still loaded the usual way, when it is needed.
+'''
+
+from Obj3D import *
+from Racetrack import *
+from Powerup import *
+from RaceConfig import *
+
+class Preloader(object):
+    # Music of the race
+    # NOTE: Not the sound effects of the cars, as every car loads its own (positional) copy (see Obj3D.attachAudio)
+    sounds = [ "audio/purple_passion.mp3" ]
+
+    def __init__(self, loader):
+        self.loader = loader
+
+        # Loads still running, by (kind, name)
+        # kind is "model" (by model name), "track" (by cache file) or "sound" (by sound file)
+        self.requests = {}
+
+        # Cache file of the racetrack being preloaded
+        self.trackCacheFile = None
+
+        self.loadedSounds = {}
+
+    # Everything a race on this track could need, with the player in this car
+    # Already loaded (or loading) assets are skipped, so this can be called as often as the selection changes
+    def preloadRace(self, trackName, car=None, passenger=None):
+        self.preloadTrack(trackName)
+
+        # The models of the player, then of the opponents (any car and passenger)
+        models = []
+        if car != None:
+            models.append("car_" + car)
+        if passenger != None:
+            models.append("passenger_" + passenger)
+
+        models += [ "car_" + model for model in RaceConfig.carModels ]
+        models += [ "passenger_" + passenger for passenger in RaceConfig.passengers ]
+
+        # The models of the track itself are also needed when the track is not cached yet
+        models += [ Racetrack.wallType, Racetrack.groundType, Racetrack.startLineType ]
+        models += list(Powerup.types.values())
+        models.append("minimap_dot")
+
+        for model in models:
+            self.preloadModel(model)
+
+        for soundFile in Preloader.sounds:
+            self.preloadSound(soundFile)
+
+    def preloadModel(self, model):
+        key = ("model", model)
+        if model in Obj3D.prototypes or key in self.requests:
+            return
+
+        modelFile = ModelPrototype.findModelFile(model)
+        if not os.path.exists(modelFile):
+            return
+
+        self.requests[key] = self.loader.loadModel(
+            modelFile, callback=self.onLoaded, extraArgs=[ "model", model ]
+        )
+
+    # The static scene of the track, if the track has been cached (see Racetrack.saveToCache)
+    # Only one track is preloaded at a time, so the load of the previously selected one is dropped
+    def preloadTrack(self, trackName):
+        try:
+            cacheFile = Racetrack.getCacheFile(trackName)
+        except:
+            cacheFile = None
+
+        if cacheFile != self.trackCacheFile and self.trackCacheFile != None:
+            self.cancel(("track", self.trackCacheFile))
+            Racetrack.preloaded.pop(self.trackCacheFile, None)
+
+        self.trackCacheFile = cacheFile
+
+        key = ("track", cacheFile)
+        if cacheFile == None or cacheFile in Racetrack.preloaded or key in self.requests \
+           or not os.path.exists(cacheFile):
+            return
+
+        self.requests[key] = self.loader.loadModel(
+            cacheFile, noCache=True, callback=self.onLoaded, extraArgs=[ "track", cacheFile ]
+        )
+
+    def preloadSound(self, soundFile):
+        key = ("sound", soundFile)
+        if soundFile in self.loadedSounds or key in self.requests:
+            return
+
+        self.requests[key] = self.loader.loadSfx(
+            soundFile, callback=self.onLoaded, extraArgs=[ "sound", soundFile ]
+        )
+
+    # Called by the loader (from the event loop) once a load is done
+    def onLoaded(self, result, kind, name):
+        self.requests.pop((kind, name), None)
+
+        if result == None:
+            print(f"Could not preload {kind} {name}")
+            return
+
+        if kind == "model":
+            if name not in Obj3D.prototypes:
+                Obj3D.prototypes[name] = ModelPrototype(name, result)
+
+                # The less detailed versions are small, so they are loaded right away
+                Obj3D.prototypes[name].getLods()
+        elif kind == "track":
+            if name == self.trackCacheFile:
+                Racetrack.preloaded[name] = result
+        elif kind == "sound":
+            self.loadedSounds[name] = result
+
+    def cancel(self, key):
+        request = self.requests.pop(key, None)
+        if request != None:
+            request.cancel()
+
+    # Wait for the loads still running, so that the race does not load anything twice
+    def finish(self):
+        for key in list(self.requests.keys()):
+            self.finishRequest(key)
+
+    # NOTE: The callbacks are only called from the event loop, so the result
+    # is taken from the request itself, and the callback cancelled
+    def finishRequest(self, key):
+        request = self.requests.get(key)
+        if request == None:
+            return
+
+        # One file per request
+        loadRequest = request.requestList[0]
+        loadRequest.wait()
+        result = loadRequest.result()
+
+        request.cancel()
+        self.onLoaded(NodePath(result) if isinstance(result, PandaNode) else result, *key)
+
+    # A sound of the race, loaded now if it was not preloaded
+    # NOTE: The same sound object is returned every time
+    def getSound(self, soundFile):
+        self.finishRequest(("sound", soundFile))
+
+        if soundFile not in self.loadedSounds:
+            self.loadedSounds[soundFile] = self.loader.loadSfx(soundFile)
+
+        return self.loadedSounds[soundFile]
@@ -0,0 +1,114 @@
+'''
+Race configuration
+
+How many opponents race against the player, and what they are:
+every opponent gets an AI type, a car model and a passenger,
+each picked at random from a weighted mix.
+
+The AI mix depends on the level, for example:
+    config = RaceConfig.fromLevel("hard", nOpponents=20)
+    opponents = config.pickOpponents()
+
+The picks use the random module (or the given random generator), so a race
+started with the same seed gets the same opponents.
+
+The levels can be replaced by presets, such as the ones evolved by Evolution,
+which also set how the opponents drive (see Racecar.drivingParameters):
+    RaceConfig.loadPresets("presets.json")
+'''
+
+import json
+import os
+import random
+
+class RaceConfig(object):
+    # AI types (see HeadlessRace.aiCarTypes) and how often they are picked, by level
+    levels = {
+        "easy": { "NotSoStupidCar": 1 },
+        "medium": { "SmartCar": 1, "SmartGreedyCar": 1 },
+        "hard": { "SmartGreedyCar": 1 }
+    }
+    defaultLevel = "medium"
+
+    # Driving parameters of the opponents, by level (the defaults of the cars for the levels missing here)
+    driving = {}
+
+    # Loaded at startup, if it exists
+    presetsFile = "presets.json"
+
+    # Car models and passengers, and how often they are picked
+    carModels = { "groundroamer": 1, "racecar": 1 }
+    passengers = { "penguin": 1, "bunny": 1, "chicken": 1 }
+
+    def __init__(self, nOpponents=2, aiTypes=None, carModels=None, passengers=None, driving=None):
+        if nOpponents < 0:
+            raise Exception(f"Invalid number of opponents {nOpponents}")
+
+        self.nOpponents = nOpponents
+
+        self.aiTypes = RaceConfig.levels[RaceConfig.defaultLevel] if aiTypes == None else aiTypes
+        self.carModels = RaceConfig.carModels if carModels == None else carModels
+        self.passengers = RaceConfig.passengers if passengers == None else passengers
+        self.driving = driving
+
+        for name, weights in [ ("AI types", self.aiTypes), ("car models", self.carModels), ("passengers", self.passengers) ]:
+            if len(weights) == 0 or min(weights.values()) < 0 or sum(weights.values()) <= 0:
+                raise Exception(f"Invalid weights for {name}: {weights}")
+
+    # Mix of AI types of a level (the default level if there is no such level)
+    @staticmethod
+    def fromLevel(level, nOpponents=2, carModels=None, passengers=None):
+        if level not in RaceConfig.levels:
+            level = RaceConfig.defaultLevel
+
+        return RaceConfig(nOpponents, RaceConfig.levels[level], carModels, passengers, RaceConfig.driving.get(level))
+
+    # Replace the levels by the ones in a presets file (json), such as:
+    #   { "hard": { "aiTypes": { "SmartCar": 1 }, "driving": { "maxSpeed": 8.2, ... } }, ... }
+    # Levels that are not in the file are kept
+    # Returns whether the file was loaded
+    @staticmethod
+    def loadPresets(fileName=None):
+        fileName = RaceConfig.presetsFile if fileName == None else fileName
+
+        if not os.path.exists(fileName):
+            return False
+
+        with open(fileName, "r") as f:
+            presets = json.load(f)
+
+        for level, preset in presets.items():
+            aiTypes = preset.get("aiTypes", RaceConfig.levels.get(level, RaceConfig.levels[RaceConfig.defaultLevel]))
+
+            # Checks the weights
+            RaceConfig(0, aiTypes)
+
+            RaceConfig.levels[level] = aiTypes
+            if preset.get("driving") != None:
+                RaceConfig.driving[level] = preset["driving"]
+            else:
+                RaceConfig.driving.pop(level, None)
+
+        return True
+
+    # Set the driving parameters of the level on an opponent
+    def setupOpponent(self, car):
+        if self.driving != None:
+            car.setDrivingParameters(self.driving)
+
+    # Returns a list of (carType, model, passenger), one for each opponent
+    def pickOpponents(self, rng=random):
+        opponents = []
+        for i in range(self.nOpponents):
+            carType = RaceConfig.pick(self.aiTypes, rng)
+            model = RaceConfig.pick(self.carModels, rng)
+            passenger = RaceConfig.pick(self.passengers, rng)
+
+            opponents.append((carType, model, passenger))
+
+        return opponents
+
+    # Weighted random choice of a key of the weights
+    @staticmethod
+    def pick(weights, rng=random):
+        return rng.choices(list(weights.keys()), list(weights.values()))[0]
@@ -0,0 +1,68 @@
+'''
+Race positions
+
+Every car gets a progress key on every tick: finished cars come first,
+by finishing time, then the others by how far around the track they got
+(laps, then the checkpoint segment they are on, then how far along it,
+see CheckpointTracker.getProgress).
+
+The order of the cars is kept from tick to tick and sorted again with an
+insertion sort. Cars rarely overtake each other, so the order is nearly
+sorted already, and sorting it takes O(n) instead of O(n log n).
+Ties keep their previous order, so positions do not flicker.
+
+Positions (starting at 1) are kept in car.racePosition, for the HUD and the AI.
+'''
+
+from Obj3D import *
+
+class RaceRanking(object):
+    def __init__(self, racetrack, cars, finishTimes):
+        self.racetrack = racetrack
+        self.cars = list(cars)
+
+        self.nSegments = len(racetrack.points)
+
+        # Finishing times by car id (kept by the RaceSimulation)
+        self.finishTimes = finishTimes
+
+        # Cars from first to last
+        self.order = list(self.cars)
+
+        self.update()
+
+    # Key to sort the cars by, the furthest car has the largest key
+    def getProgressKey(self, car):
+        finishTime = self.finishTimes.get(car.id)
+        if finishTime != None:
+            return (1, -finishTime)
+
+        lap, segment, fraction = car.progress
+
+        return (0, lap * self.nSegments + segment + fraction)
+
+    # Sort the cars again, after a tick
+    def update(self):
+        keys = {}
+        for car in self.cars:
+            keys[car.id] = self.getProgressKey(car)
+
+        order = self.order
+
+        # Insertion sort (stable), furthest first
+        for i in range(1, len(order)):
+            car = order[i]
+            key = keys[car.id]
+
+            j = i - 1
+            while j >= 0 and keys[order[j].id] < key:
+                order[j + 1] = order[j]
+                j -= 1
+
+            order[j + 1] = car
+
+        for i, car in enumerate(order):
+            car.racePosition = i + 1
+
+    def getLeader(self):
+        return self.order[0]
@@ -0,0 +1,496 @@
+'''
+Headless race simulation
+
+Builds a racetrack, spawns any mix of AI cars and steps
+the race logic (car movement, powerups and collisions)
+as fast as the CPU allows, without a window, sound or GUI.
+
+Meant for balancing and regression testing, for example:
+    python RaceSimulation.py --track test.track --cars SmartCar SmartGreedyCar NotSoStupidCar
+'''
+
+# Panda 3D imports
+from panda3d.core import *
+from direct.showbase.ShowBase import ShowBase
+from direct.showbase.DirectObject import DirectObject
+
+# Audio managers
+from direct.showbase import Audio3DManager
+
+# Import External Classes
+from Obj3D import *
+from Racecar import *
+from Racetrack import *
+from CarPhysics import *
+from WallResolver import *
+from TrackFloor import *
+from CheckpointTracker import *
+from RaceRanking import *
+from PowerupTracker import *
+from CarCollisions import *
+from RaceConfig import *
+
+import argparse
+import json
+import sys
+import time
+
+# Fixed timestep clock
+# Accumulates the (real) frame time and tells how many ticks are due,
+# so that the simulation runs at the same rate regardless of the frame rate
+class SimulationClock(object):
+    def __init__(self, tickRate=60, maxSubSteps=8):
+        self.tickRate = tickRate
+        self.dt = 1 / tickRate
+
+        # Max ticks in a single frame, to avoid spiralling 
+        # when the machine cannot keep up (the race slows down instead)
+        self.maxSubSteps = maxSubSteps
+
+        # Speed up or slow down the simulation relative to real time
+        self.timeScale = 1
+
+        self.accumulator = 0
+
+    # Returns the number of ticks to run for this frame
+    def advance(self, frameTime):
+        self.accumulator += frameTime * self.timeScale
+
+        # NOTE: Small epsilon so that rounding errors in the frame times do not lose a tick
+        nTicks = int(self.accumulator / self.dt + 1e-6)
+
+        if nTicks > self.maxSubSteps:
+            nTicks = self.maxSubSteps
+            self.accumulator = nTicks * self.dt
+
+        self.accumulator = max(self.accumulator - nTicks * self.dt, 0)
+
+        return nTicks
+
+    # Fraction of the way to the next tick, for interpolation
+    def getAlpha(self):
+        return min(self.accumulator / self.dt, 1)
+
+# Race logic that is stepped one tick at a time
+# Independent of how (or if) the race is rendered
+# NOTE: All car physics constants are per tick, tuned at 60 ticks per second
+class RaceSimulation(object):
+    def __init__(self, gameObj, racetrack, cars, tickRate=60, maxSubSteps=8, batchedPhysics=True):
+        self.gameObj = gameObj
+        self.racetrack = racetrack
+        self.cars = cars
+
+        # Physics of all cars in one batched step (if numpy is available),
+        # otherwise every car updates itself
+        self.physics = None
+        if batchedPhysics and CarPhysics.isAvailable():
+            self.physics = CarPhysics(cars)
+
+        self.tickRate = tickRate
+        self.dt = 1 / tickRate
+        self.nTicks = 0
+
+        # Cars take their height from the track points, instead of casting rays at the ground
+        self.trackFloor = TrackFloor(racetrack, cars, tickRate)
+
+        # Walls without collision geometry are resolved analytically, around the segment each car is on
+        self.wallResolver = None
+        if racetrack.wallCollisions == "analytic":
+            self.wallResolver = WallResolver(racetrack, cars, self.trackFloor)
+
+        # Otherwise the cars are pushed out of the walls by their own pushers,
+        # all in a single pass over the racetrack (the only thing they collide with)
+        # NOTE: The colliders are handled in the order they were added, so in the order of the cars
+        self.wallTraverser = None
+        if racetrack.wallCollisions != "analytic":
+            self.wallTraverser = CollisionTraverser("walls")
+
+            for car in cars:
+                self.wallTraverser.addCollider(car.getCollisionNode(car.getColNodeName("wall")), car.colPusher)
+
+        # Cars bump into each other, paired up along the track
+        self.carCollider = CarCollider(racetrack, cars, self.trackFloor)
+
+        # Checkpoints are passed by driving through them, tested on the track segment each car is on
+        self.checkpointTracker = CheckpointTracker(racetrack, cars, self.trackFloor)
+
+        # Powerups are collected by driving through them, looked up in a spatial hash
+        self.powerupTracker = PowerupTracker(racetrack, cars)
+
+        self.clock = SimulationClock(tickRate, maxSubSteps)
+
+        # Records or plays back the controls of the player cars on every tick (see Replay)
+        self.replay = None
+
+        self.gameObj.raceTime = 0
+
+        # Finishing times by car id, in order of finishing
+        self.finishTimes = {}
+
+        # Laps, lap times and hits of the finished cars when they finished, by car id
+        self.finishStats = {}
+        self.winningCar = None
+
+        # Race positions of the cars, updated after every tick
+        self.ranking = RaceRanking(racetrack, cars, self.finishTimes)
+
+    # Step the race by one tick
+    def tick(self):
+        gameObj = self.gameObj
+
+        if self.replay != None:
+            self.replay.beforeTick(self.nTicks)
+
+        # Only the sections of the track around the cars are in the scene, if the track is paged
+        # NOTE: Well before the cars get to them, so that the walls are always there to collide with
+        if self.nTicks % Racetrack.pagingInterval == 0:
+            self.racetrack.updatePaging([ car.model.getPos() for car in self.cars ])
+
+        for car in self.cars:
+            car.updatePowerup(gameObj.raceTime)
+
+            if self.physics == None:
+                car.updateMovement()
+
+        if self.physics != None:
+            self.physics.step()
+
+        # Collisions, and the events they throw
+        # NOTE: So that races play out the same every time (see Replay), the cars are pushed
+        #       away from each other first, then out of the walls (in the order of the cars),
+        #       and only then put on the floor
+        self.carCollider.resolve()
+
+        if self.wallTraverser != None:
+            self.wallTraverser.traverse(self.racetrack.trackRoot)
+
+        if self.wallResolver != None:
+            self.wallResolver.resolve()
+
+        self.trackFloor.update()
+        self.checkpointTracker.update()
+        self.powerupTracker.update()
+        base.eventMgr.doEvents()
+
+        self.ranking.update()
+
+        for powerup in self.racetrack.powerups:
+            if powerup != None:
+                powerup.spin()
+
+        self.nTicks += 1
+        gameObj.raceTime = self.nTicks * self.dt
+
+        if self.replay != None:
+            self.replay.afterTick(self.nTicks)
+
+    # Advance the simulation by a rendered frame (of frameTime seconds)
+    # Runs the ticks that are due, then interpolates the cars between 
+    # the last two ticks so that movement is smooth at any frame rate
+    # Runs at most maxTicks ticks, if given
+    # Returns the number of ticks run
+    def advance(self, frameTime, maxTicks=None):
+        nTicks = self.clock.advance(frameTime)
+
+        if maxTicks != None:
+            nTicks = min(nTicks, maxTicks)
+
+        for car in self.cars:
+            car.restoreTickTransform()
+
+        for i in range(nTicks):
+            for car in self.cars:
+                car.beginTick()
+
+            self.tick()
+
+        alpha = self.clock.getAlpha()
+        for car in self.cars:
+            car.endTicks()
+            car.interpolateTransform(alpha)
+
+        return nTicks
+
+    # Laps, checkpoints, progress, hits and resets of a car right now
+    @staticmethod
+    def getCarStats(car):
+        return {
+            "laps": car.currLap,
+            "lapTimes": list(car.lapTimes),
+            "checkpoints": list(car.passedCheckpoints),
+            "progress": list(car.progress),
+            "wallHits": car.wallHits,
+            "carHits": car.carHits,
+            "groundResets": car.groundResets
+        }
+
+    # Record a car finishing the race (only the first time)
+    # Its stats are kept as they were then, as the car keeps driving after the finish
+    def recordFinish(self, car):
+        if car.id in self.finishTimes:
+            return
+
+        self.finishTimes[car.id] = self.gameObj.raceTime
+        self.finishStats[car.id] = RaceSimulation.getCarStats(car)
+
+        if self.winningCar == None:
+            self.winningCar = car
+
+    def allCarsFinished(self):
+        return len(self.finishTimes) == len(self.cars)
+
+    # Structured record of the race so far
+    def getResults(self):
+        cars = []
+        for car in self.cars:
+            stats = self.finishStats.get(car.id)
+            if stats == None:
+                stats = RaceSimulation.getCarStats(car)
+
+            cars.append({
+                "id": car.id,
+                "type": type(car).__name__,
+                "model": car.modelName.replace("car_", "", 1),
+                "passenger": car.personName,
+                "laps": stats["laps"],
+                "lapTimes": list(stats["lapTimes"]),
+                "checkpoints": list(stats["checkpoints"]),
+                "progress": list(stats["progress"]),
+                "position": car.racePosition,
+                "wallHits": stats["wallHits"],
+                "carHits": stats["carHits"],
+                "groundResets": stats["groundResets"],
+                "finishTime": self.finishTimes.get(car.id)
+            })
+
+        # Finished cars by finishing time, then the others by how far they got (see RaceRanking)
+        finishingOrder = self.ranking.order
+
+        return {
+            "track": self.racetrack.trackName,
+            "totalLaps": self.gameObj.totalLaps,
+            "raceTime": self.gameObj.raceTime,
+            "ticks": self.nTicks,
+            "winner": self.winningCar.id if self.winningCar != None else None,
+            "finishingOrder": [ car.id for car in finishingOrder ],
+            "cars": cars
+        }
+
+# Game object used by the cars when there is no RacingGame
+class HeadlessRace(DirectObject):
+    # Only one engine (ShowBase without a window) is needed per process
+    engine = None
+
+    aiCarTypes = {
+        "StupidCar": StupidCar,
+        "NotSoStupidCar": NotSoStupidCar,
+        "SmartCar": SmartCar,
+        "SmartGreedyCar": SmartGreedyCar
+    }
+    # Cars driven by their controls (the player, when playing back a replay)
+    playerCarTypes = {
+        "Racecar": Racecar
+    }
+    carModels = [ "groundroamer", "racecar" ]
+    passengers = [ "penguin", "bunny", "chicken" ]
+
+    # maxTimeBehind: end the race this long (in seconds) after the winner finished,
+    #                even if the others have not (None to wait for every car)
+    # driving: driving parameters of the cars (see Racecar.setDrivingParameters), dicts or None
+    #          for the defaults, used in turn like carModels and passengers
+    def __init__(self, trackName="test.track", carTypes=None, totalLaps=3, tickRate=60, maxRaceTime=600, seed=None, carModels=None, passengers=None, wallCollisions="strip", maxTimeBehind=None, driving=None, paging=None, pagingDistance=None):
+        HeadlessRace.initEngine()
+
+        carTypes = [ "SmartCar", "SmartGreedyCar" ] if carTypes == None else carTypes
+        carModels = HeadlessRace.carModels if carModels == None else carModels
+        passengers = HeadlessRace.passengers if passengers == None else passengers
+        driving = [ None ] if driving == None else driving
+
+        # Same attributes that the cars expect from RacingGame
+        self.printStatements = False
+        self.sfxMuted = True
+        self.isGameOver = False
+        self.totalLaps = totalLaps
+        self.raceTime = 0
+
+        self.maxRaceTime = maxRaceTime
+        self.maxTimeBehind = maxTimeBehind
+
+        self.seed = seed
+        if seed != None:
+            random.seed(seed)
+
+        self.worldRenderer = render.attachNewNode("headlessRace")
+        Obj3D.worldRenderer = self.worldRenderer
+
+        self.collisionSetup()
+
+        # Load the various models
+        Racecar.nRacecars = 0
+        self.racetrack = Racetrack(
+            self, trackName, wallCollisions=wallCollisions, paging=paging, pagingDistance=pagingDistance
+        )
+
+        self.cars = []
+        for i, carType in enumerate(carTypes):
+            carClass = HeadlessRace.getCarClass(carType)
+
+            if carClass == None:
+                raise Exception(f"Invalid car type {carType}")
+
+            car = carClass(
+                self,
+                carModels[i % len(carModels)],
+                passengers[i % len(passengers)],
+                self.worldRenderer
+            )
+
+            if driving[i % len(driving)] != None:
+                car.setDrivingParameters(driving[i % len(driving)])
+
+            self.cars.append(car)
+
+        self.simulation = RaceSimulation(self, self.racetrack, self.cars, tickRate)
+
+    @staticmethod
+    def getCarClass(carType):
+        carClass = HeadlessRace.aiCarTypes.get(carType)
+
+        if carClass == None:
+            carClass = HeadlessRace.playerCarTypes.get(carType)
+
+        return carClass
+
+    # Create the engine without a window or sound
+    @staticmethod
+    def initEngine():
+        if HeadlessRace.engine != None:
+            return
+
+        loadPrcFileData("", "audio-library-name null")
+        HeadlessRace.engine = ShowBase(windowType="none")
+
+        # Cars attach 3D audio, which does nothing with the null audio library
+        Obj3D.audio3d = Audio3DManager.Audio3DManager(
+            base.sfxManagerList[0], base.camera
+        )
+
+    def collisionSetup(self):
+        base.cTrav = CollisionTraverser()
+
+        # Same bitmasks as RacingGame
+        self.colBitMask = {
+            "off": BitMask32.allOff(),
+            "wall": BitMask32.bit(0),
+            "floor": BitMask32.bit(1),
+            "checkpoint": BitMask32.bit(2),
+            "powerup": BitMask32.bit(3),
+            "offworld": BitMask32.bit(4)
+        }
+
+    # Run until every car has finished (or the time limit is reached)
+    # Returns the results of the race
+    def run(self):
+        simulation = self.simulation
+        maxTicks = int(self.maxRaceTime * simulation.tickRate)
+
+        while simulation.nTicks < maxTicks and not simulation.allCarsFinished():
+            simulation.tick()
+
+            if self.maxTimeBehind != None and simulation.winningCar != None:
+                winningTime = simulation.finishTimes[simulation.winningCar.id]
+                maxTicks = min(maxTicks, int((winningTime + self.maxTimeBehind) * simulation.tickRate))
+
+        return self.getResults()
+
+    def getResults(self):
+        results = self.simulation.getResults()
+        results["seed"] = self.seed
+
+        return results
+
+    # Called by the cars
+    def onNewLap(self, car):
+        if self.printStatements:
+            print(f"Car {car.id}: Lap {car.currLap} in {car.lapTimes[-1]:.2f}s")
+
+    # Unlike RacingGame, the race goes on until every car has finished
+    def gameOver(self, car):
+        self.isGameOver = True
+        self.simulation.recordFinish(car)
+
+    # Remove everything so that another race can be run with the same engine
+    def destroy(self):
+        self.ignoreAll()
+
+        for car in self.cars:
+            car.deactivatePowerup()
+
+        self.worldRenderer.removeNode()
+        base.cTrav = None
+
+        Obj3D.worldRenderer = None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run races without a window")
+    parser.add_argument("--track", default="test.track")
+    parser.add_argument(
+        "--cars", nargs="+", default=[ "SmartCar", "SmartGreedyCar", "NotSoStupidCar" ],
+        choices=list(HeadlessRace.aiCarTypes.keys())
+    )
+    parser.add_argument(
+        "--opponents", type=int, default=None,
+        help="Race this many cars from the AI mix of the level instead (see RaceConfig)"
+    )
+    parser.add_argument("--level", default=RaceConfig.defaultLevel)
+    parser.add_argument("--presets", default=None, help="Levels to use instead of the default ones (see Evolution)")
+    parser.add_argument("--laps", type=int, default=3)
+    parser.add_argument("--races", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--maxTime", type=float, default=600, help="Max race time in seconds")
+    parser.add_argument("--wallCollisions", default="strip", choices=Racetrack.wallCollisionModes)
+    parser.add_argument(
+        "--paging", default="none", choices=[ "none", "detach", "unload" ],
+        help="Take the sections of the track far from every car out of the scene (see Racetrack)"
+    )
+    parser.add_argument("--pagingDistance", type=float, default=Racetrack.pagingDistance)
+    args = parser.parse_args()
+
+    if args.presets != None and not RaceConfig.loadPresets(args.presets):
+        raise Exception(f"Presets {args.presets} not found")
+
+    if args.level not in RaceConfig.levels:
+        raise Exception(f"Invalid level {args.level}, expected one of {list(RaceConfig.levels.keys())}")
+
+    allResults = []
+    for i in range(args.races):
+        seed = args.seed + i if args.seed != None else None
+
+        startTime = time.time()
+
+        carTypes, carModels, passengers, driving = args.cars, None, None, None
+
+        # Same opponents for the same seed
+        if args.opponents != None:
+            config = RaceConfig.fromLevel(args.level, args.opponents)
+            opponents = config.pickOpponents(random.Random(seed))
+
+            carTypes = [ carType for carType, _, _ in opponents ]
+            carModels = [ model for _, model, _ in opponents ]
+            passengers = [ passenger for _, _, passenger in opponents ]
+            driving = [ config.driving ]
+
+        race = HeadlessRace(
+            args.track, carTypes, args.laps, maxRaceTime=args.maxTime, seed=seed,
+            carModels=carModels, passengers=passengers, wallCollisions=args.wallCollisions,
+            driving=driving, paging=None if args.paging == "none" else args.paging,
+            pagingDistance=args.pagingDistance
+        )
+        results = race.run()
+        race.destroy()
+
+        results["wallTime"] = time.time() - startTime
+        allResults.append(results)
+
+    json.dump(allResults, sys.stdout, indent=2)
+    print()
@@ -1,8 +1,42 @@
 from Obj3D import *
 from Powerup import *
+
+# Movement state that is kept by the car itself,
+# or in the arrays of the (batched) CarPhysics engine the car is attached to
+def physicsState(name):
+    def getState(self):
+        if self.physics == None:
+            return self.__dict__[name]
+
+        return float(getattr(self.physics, name)[self.physicsIndex])
+
+    def setState(self, value):
+        if self.physics == None:
+            self.__dict__[name] = value
+        else:
+            getattr(self.physics, name)[self.physicsIndex] = value
+
+    return property(getState, setState)
+
 class Racecar(Obj3D):
     nRacecars = 0 # this will serve as the unique ID for collision node
 
+    # How far from the camera the car and passenger models, then each of
+    # their less detailed versions, are shown (see Obj3D.useLods)
+    lodDistances = [ 60, 150, 300 ]
+
+    # Constants of how the car drives, which can be tuned (see Evolution and RaceConfig)
+    drivingParameters = [ "maxSpeed", "friction", "accInc", "defaultRotationSpeed", "maxRotationSpeed" ]
+
+    # See CarPhysics
+    physics = None
+    physicsIndex = None
+
+    speed = physicsState("speed")
+    acceleration = physicsState("acceleration")
+    rotationSpeed = physicsState("rotationSpeed")
+    rotationAcceleration = physicsState("rotationAcceleration")
+
     def __init__(self, gameObj, model, passenger=None, renderParent=None, pos=None, hpr=None):
         super().__init__("car_" + model, renderParent, pos, hpr)
         self.gameObj = gameObj
@@ -30,11 +64,46 @@ class Racecar(Obj3D):
         self.drifting = False
         self.allowStaticTurning = False
 
+        # Controls held down, applied once every tick (see updateControls)
+        self.controls = {
+            "forward": False,
+            "backward": False,
+            "turnLeft": False,
+            "turnRight": False,
+            "drifting": False
+        }
+
+        # Transforms of the previous and current ticks, for interpolation when rendering
+        self.prevTickTransform = None
+        self.tickTransform = None
+
         self.isCollidingWall = False
 
+        # Wall nodes the car is touching
+        # NOTE: Entering one wall and leaving another in the same tick
+        #       can come in either order, so the walls are counted
+        self.collidingWalls = set()
+
+        # Number of times the car crashed into a wall (scraping along it counts once)
+        # and bumped into another car, and was put back after falling below the ground
+        self.wallHits = 0
+        self.carHits = 0
+        self.groundResets = 0
+
         self.currLap = 0
         self.passedCheckpoints = []
 
+        # Last checkpoint passed in order, and how far the car got (see CheckpointTracker)
+        self.lastCheckpoint = 0
+        self.progress = (0, 0, 0)
+
+        # Position in the race, starting at 1 (see RaceRanking)
+        self.racePosition = None
+
+        # Lap times (in seconds of race time)
+        self.lapTimes = []
+        self.lapStartTime = 0
+
         # Powerups
         self.activePowerup = None
         self.powerupSprite = None
@@ -76,6 +145,10 @@ class Racecar(Obj3D):
                             dz=self.relOffsetZ
                             )
 
+        # Less detail further away, so that large fields of cars stay cheap to draw
+        self.useLods(Racecar.lodDistances)
+        self.passenger.useLods(Racecar.lodDistances)
+
     # Init 3D audio
     def initAudio(self):
         self.attachAudio("collision", loop=False,
@@ -85,11 +158,16 @@ class Racecar(Obj3D):
         return f"car_{self.id}_{extras}"
 
     def initCollisions(self):
+        # NOTE: The walls are traversed for all the cars at once (see RaceSimulation)
+
         # Initialise bounding box for wall
         self.initSurroundingCollisionObj(self.getColNodeName("wall"), "capsule")
 
         colNode = self.getCollisionNode(self.getColNodeName("wall"))
         colNode.node().setFromCollideMask(self.gameObj.colBitMask["wall"])
+
+        # Cars do not collide with each other through the traverser (see CarCollider)
+        colNode.node().setIntoCollideMask(self.gameObj.colBitMask["off"])
         
         '''
         Wall Handling
@@ -113,8 +191,6 @@ class Racecar(Obj3D):
         # Problem is the racecar will attempt to scale the wall
         self.colPusher.setHorizontal(True)
 
-        base.cTrav.addCollider(colNode, self.colPusher)
-
         # Collision Events
         # Make this dependent on the player ID to allow for individual event triggering
         colNodeName = self.getColNodeName("wall")
@@ -124,84 +200,36 @@ class Racecar(Obj3D):
         self.gameObj.accept(f"{colNodeName}-out-wall", self.onExitWall)
 
         '''
-        Floor Handling
-        '''
-        self.colLifter = CollisionHandlerFloor()
-        self.colLifter.setMaxVelocity(10)
-
-        # Create the ray pointing from the bottom
-        floorRayNode = self.addCollisionNode("floorRay")
-        floorRayNode.node().addSolid(CollisionRay(
-            self.offsetX, self.offsetY, self.passenger.offsetZ + self.passenger.dimZ, 
-            0, 0, -1
-        ))
-        floorRayNode.node().setFromCollideMask(self.gameObj.colBitMask["floor"])
-        floorRayNode.node().setIntoCollideMask(0)
-
-        self.colLifter.addCollider(floorRayNode, self.model)
-
-        base.cTrav.addCollider(floorRayNode, self.colLifter)
-
-        '''
-        Checkpoint Handling
+        Powerup Handling
         '''
-        # Init Event
-        self.colCheckpointEvent = CollisionHandlerEvent()
-
-        self.colCheckpointEvent.addInPattern('%fn-in-%in')
-        self.colCheckpointEvent.addAgainPattern('%fn-again-%in')
-        self.colCheckpointEvent.addOutPattern('%fn-out-%in')
-
-        # Initialise simple sphere just to check for checkpoint and powerup passing
-        fromBitmask = self.gameObj.colBitMask["checkpoint"] | self.gameObj.colBitMask["powerup"]
-
+        # NOTE: Checkpoints are passed by driving through the lines across the track (see CheckpointTracker),
+        #       and powerups are collected by driving through them (see PowerupTracker),
+        #       the sphere is only its shape and is not traversed
         colSphere = CollisionSphere(self.relOffsetX, self.relOffsetY, self.relOffsetZ, self.dimZ/2)
 
-        self.colCheckpointNode = Obj3D.createIsolatedCollisionObj(
-            self.getColNodeName("checkpoint"), colSphere, parentNode=self.model,
-            fromBitmask=fromBitmask, intoBitmask=self.gameObj.colBitMask["off"],
+        self.colPowerupNode = Obj3D.createIsolatedCollisionObj(
+            self.getColNodeName("powerup"), colSphere, parentNode=self.model,
+            fromBitmask=self.gameObj.colBitMask["off"], intoBitmask=self.gameObj.colBitMask["off"],
             show=False
         )
-        
-        '''
-        self.colCheckpointNode = self.initSurroundingCollisionObj(self.getColNodeName("checkpoint"), "capsule", show=True)
-        self.colCheckpointNode.node().setFromCollideMask(fromBitmask)
-        self.colCheckpointNode.node().setIntoCollideMask(self.gameObj.colBitMask["off"])
-        '''
-
-        # Collision Events
-        # Make this dependent on the player ID to allow for individual event triggering
-        colNodeName = self.getColNodeName("checkpoint")
-
-        base.cTrav.addCollider(self.colCheckpointNode, self.colCheckpointEvent)
-
-        self.gameObj.accept(f"{colNodeName}-in-checkpoint", self.onPassCheckpoint)
-        self.gameObj.accept(f"{colNodeName}-out-powerup", self.onCollectPowerup)
     
     def initOnRacetrack(self, order=None):
         if order == None: 
             order = self.id
 
         # Assumes that racetrack has already been generated
-        trackPoints = self.gameObj.racetrack.points
-
-        startPos = LVector3f(trackPoints[0])
-        dirVec = LVector3f(trackPoints[1]) - startPos
-        dirVec.normalize()
-
-        dist = (self.dimY + 2) * order
-
-        pos = startPos + dirVec * dist 
-
-        trackPoints = self.gameObj.racetrack.leftTrackPoints
-        yawFacing = trackPoints[0][1][0]
+        racetrack = self.gameObj.racetrack
+        pos, yawFacing, segment = racetrack.getGridPosition(order)
 
         # Position setting
         x, y, z = pos
         self.setPos(x, y, z)
 
-        # Rotate to face the closest checkpoint
-        self.rotate(dh=yawFacing)
+        # Face along the track
+        _, p, r = self.getHpr()
+        self.setHpr(yawFacing, p, r)
+
+        trackPoints = racetrack.points
 
         # Init Passed Checkpoints array
         self.currLap = 0
@@ -209,12 +237,17 @@ class Racecar(Obj3D):
         self.passedCheckpoints = [0 for i in range(len(trackPoints))]
         self.passedCheckpoints[0] = 1 # the first checkpoint is always passed
 
+        self.lastCheckpoint = 0
+        self.progress = (0, 0, 0)
+
+        # Segment of the track the car starts on (behind the start line, on a long grid)
+        self.startSegment = segment
+
         return
 
     # POWERUPS
-    def onCollectPowerup(self, entry):
-        powerupType = entry.getIntoNodePath().getPythonTag("powerupType")
-
+    # Called when the car drives through a powerup (by the PowerupTracker)
+    def collectPowerup(self, powerupType):
         if self.gameObj.printStatements: print(f"Car {self.id} has collected a {powerupType} powerup!")
 
         # Deactivate first (removes away the sprites)
@@ -261,27 +294,29 @@ class Racecar(Obj3D):
             #self.powerupSprite = None
 
     # CHECKPOINTS
-    def onPassCheckpoint(self, entry):
-        # Get passed checkpoint ID
-        checkpointID = entry.getIntoNodePath().getPythonTag("checkpointID")
-
+    # Called when the car drives through a checkpoint (by the CheckpointTracker)
+    def passCheckpoint(self, checkpointID):
         # Make sure that previous checkpoint was passed before update
         if self.passedCheckpoints[checkpointID-1] > self.passedCheckpoints[checkpointID]:
             if self.gameObj.printStatements:
                 print(f"Car {self.id}: Passed checkpoint {checkpointID}")
             self.passedCheckpoints[checkpointID] += 1
+            self.lastCheckpoint = checkpointID
         # New lap
         elif checkpointID == 0 and self.passedCheckpoints[0] == self.passedCheckpoints[-1]:
             self.currLap += 1
             self.passedCheckpoints[0] += 1 
+            self.lastCheckpoint = 0
+
+            raceTime = self.gameObj.raceTime
+            self.lapTimes.append(raceTime - self.lapStartTime)
+            self.lapStartTime = raceTime
 
             # Check win condition
             totalLaps = self.gameObj.totalLaps
 
-            # Player, so update on screen text
-            if self.id == 0:
-                self.gameObj.texts["lap"].setText(
-                    f'Lap {self.currLap+1}/{totalLaps}')
+            # Let the game update its on screen text etc
+            self.gameObj.onNewLap(self)
 
             if self.currLap >= totalLaps:
                 self.gameObj.gameOver(self)
@@ -292,10 +327,22 @@ class Racecar(Obj3D):
             if self.gameObj.printStatements: print(f"Car {self.id}: Need to pass checkpoint {(checkpointID+N-1)%N} first")
 
     def onCollideWall(self, entry):
+        self.hitWall(entry.getIntoNodePath().getKey())
+
+    def onExitWall(self, entry):
+        self.leaveWall(entry.getIntoNodePath().getKey())
+
+    # Called when the car hits a wall
+    # (from the wall collision events, or by the WallResolver)
+    def hitWall(self, wall):
         # Shield powerup negates all effects
         if self.activePowerup == "shield":
             return
 
+        if not self.isCollidingWall:
+            self.wallHits += 1
+
+        self.collidingWalls.add(wall)
         self.isCollidingWall = True
         self.setSpeed(0, 0)
         self.setAcceleration(0, 0)
@@ -304,10 +351,56 @@ class Racecar(Obj3D):
         if not self.gameObj.sfxMuted:
             self.audio["collision"].play()
         
-    def onExitWall(self, entry):
-        self.isCollidingWall = False
+    def leaveWall(self, wall):
+        self.collidingWalls.discard(wall)
+        self.isCollidingWall = len(self.collidingWalls) > 0
         return
+
+    # Called when the car runs into another car (by the CarCollider)
+    def hitCar(self, otherCar):
+        self.carHits += 1
+
+        if not self.gameObj.sfxMuted:
+            self.audio["collision"].play()
+
+    # Called with the speed left after bumping into another car (by the CarCollider)
+    def bumpSpeed(self, speed):
+        # Shield powerup negates all effects
+        if self.activePowerup == "shield":
+            return
+
+        self.setSpeed(speed)
         
+    # Driving parameters (tuned by Evolution, see RaceConfig)
+    # All of them, by name
+    def getDrivingParameters(self):
+        return { name: getattr(self, name) for name in type(self).drivingParameters }
+
+    # Set the given driving parameters (the ones the car does not have are ignored)
+    # NOTE: Only before the car is attached to CarPhysics, which keeps its own copy
+    def setDrivingParameters(self, parameters):
+        for name, value in parameters.items():
+            if name in type(self).drivingParameters:
+                setattr(self, name, value)
+
+    # Batched physics
+    def attachPhysics(self, physics, index):
+        self.physics = physics
+        self.physicsIndex = index
+
+    def detachPhysics(self):
+        if self.physics == None:
+            return
+
+        # Keep the current state in the car
+        state = { name: getattr(self, name) for name in self.physics.stateNames }
+
+        self.physics = None
+        self.physicsIndex = None
+
+        for name in state:
+            setattr(self, name, state[name])
+
     # Speeds and Acceleration handling
     # Note that speed/accel is singluar direction (where the car is facing)
     # There is also angular velocity
@@ -348,6 +441,13 @@ class Racecar(Obj3D):
     def incAcceleration(self, da=0, dalpha=0):
         self.setAcceleration(self.acceleration + da, self.rotationAcceleration + dalpha)
 
+    # Unit vector (x, y) in the direction the car is facing
+    def getDirection(self):
+        dirAngle = self.getHpr()[0] * -(math.pi/180)
+
+        # Note that sin and cos are switched because car is facing y by default
+        return math.sin(dirAngle), math.cos(dirAngle)
+
     # Calculations relative to points
     # NOTE: Euler system used
     def angleToPoint(self, point):
@@ -371,8 +471,57 @@ class Racecar(Obj3D):
 
         return math.sqrt(squared)
 
-    # Update movement
+    # Apply the controls (player) or decide what to do (AI, which overrides this)
+    def updateControls(self):
+        controls = self.controls
+
+        self.drifting = controls["drifting"]
+
+        if controls["forward"]:
+            self.doDrive("forward")
+
+        if controls["backward"]:
+            self.doDrive("backward")
+
+        if controls["turnLeft"]:
+            self.doTurn("left")
+
+        if controls["turnRight"]:
+            self.doTurn("right")
+
+    # Fixed timestep interpolation
+    # During ticks the model holds the simulated transform;
+    # between ticks it is interpolated from the previous to the current tick for rendering
+    def beginTick(self):
+        self.prevTickTransform = self.model.getTransform()
+
+    def endTicks(self):
+        self.tickTransform = self.model.getTransform()
+
+    # Put the model back to the simulated transform before the next ticks
+    def restoreTickTransform(self):
+        if self.tickTransform != None:
+            self.model.setTransform(self.tickTransform)
+
+    def interpolateTransform(self, alpha):
+        if self.prevTickTransform == None or self.tickTransform == None:
+            return
+
+        prevTransform = self.prevTickTransform
+        currTransform = self.tickTransform
+
+        pos = prevTransform.getPos() + (currTransform.getPos() - prevTransform.getPos()) * alpha
+
+        h0, p0, r0 = prevTransform.getHpr()
+        h1, p1, r1 = currTransform.getHpr()
+        h = h0 + normaliseEuler(h1 - h0) * alpha
+
+        self.model.setPosHpr(pos, LVecBase3f(h, p1, r1))
+
+    # Update movement (once per tick)
     def updateMovement(self):
+        self.updateControls()
+
         # Friction
         useSpeedBasedFriction = (self.speed == 0) or (self.acceleration > 1.5 * self.friction)
         if useSpeedBasedFriction:
@@ -417,8 +566,7 @@ class Racecar(Obj3D):
 
         # Reset
         if self.checkBelowGround():
-            print(f"Oops, car {self.id} fell below ground")
-            self.initOnRacetrack(0)
+            self.resetBelowGround()
             return
 
     def updateMinimap(self, minimapPoint):
@@ -432,6 +580,13 @@ class Racecar(Obj3D):
 
         return z < groundLevel
 
+    # Put the car back on the start line
+    def resetBelowGround(self):
+        self.groundResets += 1
+        if self.gameObj.printStatements: print(f"Oops, car {self.id} fell below ground")
+
+        self.initOnRacetrack(0)
+
     # External Controls
     def doDrive(self, direction="forwards"):
         accInc = self.accInc
@@ -501,9 +656,8 @@ class StupidCar(Racecar):
 
         return
 
-    def updateMovement(self):
+    def updateControls(self):
         self.artificialStupidity()
-        super().updateMovement()
 
 class NotSoStupidCar(StupidCar):
     def __init__(self, gameObj, model, passenger=None, renderParent=None, pos=None, hpr=None):
@@ -523,44 +677,122 @@ class NotSoStupidCar(StupidCar):
         return
 
 class SmartCar(Racecar):
+    # Steer towards the point on the racing line this far ahead (plus the distance driven in lookAheadTicks)
+    lookAhead = 20
+    lookAheadTicks = 2
+
+    # How much the car slows down in a tick when braking (roughly, as braking builds up over a few ticks)
+    braking = 0.2
+
+    # How much faster than the curvature of the racing line allows the corners are taken,
+    # as there is room to run wide of the line
+    cornering = 2
+
+    # Against a wall and heading (almost) straight for the point it drives to, see checkStupidity
+    stupidityAngle = 0.1
+
+    drivingParameters = Racecar.drivingParameters + [ "stupidityAngle" ]
+
+    # Backs up for reverseTicks when slower than stuckSpeed for more than stuckTicks (against a wall)
+    stuckSpeed = 0.1
+    stuckTicks = 30
+    reverseTicks = 20
+
     def __init__(self, gameObj, model, passenger=None, renderParent=None, pos=None, hpr=None):
         super().__init__(gameObj, model, passenger, renderParent, pos, hpr)
 
-        self.currentCheckpoint = 0
         self.allowStaticTurning = True
 
+        # Lines across the track at the checkpoints (from the racetrack, once it is needed)
+        self.checkpointLines = None
+
         self.maxSpeed *= 1.5
         self.defaultRotationSpeed *= 1.8
         self.maxRotationSpeed = 10
 
         self.isBeingStupid = False
 
-    def onPassCheckpoint(self, entry):
-        super().onPassCheckpoint(entry)
+    def initOnRacetrack(self, order=None):
+        super().initOnRacetrack(order)
+
+        # Drive towards the end of the segment the car starts on
+        self.currentCheckpoint = self.startSegment
+
+        # Sample of the racing line the car is at (found again from scratch after a reset)
+        self.lineIndex = None
+
+        self.ticksStuck = 0
+        self.ticksReversing = 0
 
-        # Update current checkpoint
-        currCheckpoint = entry.getIntoNodePath().getPythonTag("checkpointID")
+    def passCheckpoint(self, checkpointID):
+        super().passCheckpoint(checkpointID)
 
         # Went back the wrong way, reset to old checkpoint
-        self.currentCheckpoint = currCheckpoint
+        self.currentCheckpoint = checkpointID
         self.isBeingStupid = False
 
         return
 
-    # Basically, the idea is to keep adjusting itself to the next checkpoint
-    # This is done through the knowledge of the track's center point
+    # Next checkpoint to drive towards
+    # Checkpoints only count once they are driven through, so the car
+    # already turns towards the one after when it gets close to the line
+    def getNextCheckpoint(self):
+        racetrack = self.gameObj.racetrack
+        N = len(racetrack.points)
+        i = (self.currentCheckpoint+1) % N
+
+        if self.checkpointLines == None:
+            self.checkpointLines = racetrack.getCheckpointLines()
+
+        (x0, y0, _), (x1, y1, _) = self.checkpointLines[i]
+        x, y, _ = self.getPos()
+
+        dx, dy = x1 - x0, y1 - y0
+        t = ((x - x0) * dx + (y - y0) * dy) / (dx*dx + dy*dy)
+        t = max(0, min(t, 1))
+
+        if math.hypot(x - (x0 + dx * t), y - (y0 + dy * t)) < racetrack.wallDim[1]:
+            i = (i+1) % N
+
+        return i
+
+    # Follow the racing line of the track
     def artificialStupidity(self):
-        # Get midpoint of next checkpoint
-        trackPoints = self.gameObj.racetrack.points
-        i = (self.currentCheckpoint+1) % len(trackPoints)
-        gotoPoint = trackPoints[i]
+        self.followRacingLine()
+
+    # Steer towards the racing line a bit further along it (see RacingLine.getHeading),
+    # and slow down to its target speed before the corners
+    def followRacingLine(self):
+        racingLine = self.gameObj.racetrack.racingLine
 
-        self.moveTowardsPoint(gotoPoint)
+        # Stuck, back up for a bit before trying again
+        if self.ticksReversing > 0:
+            self.ticksReversing -= 1
+            self.doDrive("backwards")
+            return
+
+        self.ticksStuck = self.ticksStuck + 1 if abs(self.speed) < SmartCar.stuckSpeed else 0
+        if self.ticksStuck > SmartCar.stuckTicks:
+            self.ticksStuck = 0
+            self.ticksReversing = SmartCar.reverseTicks
+
+        x, y, _ = self.getPos()
+        i = racingLine.getClosestIndex(x, y, self.lineIndex)
+        self.lineIndex = i
+
+        speed = max(self.speed, 0)
+        heading = racingLine.getHeading(i, x, y, SmartCar.lookAhead + speed * SmartCar.lookAheadTicks)
+
+        turnRate = (self.defaultRotationSpeed + self.defaultRotationAcceleration) * SmartCar.cornering
+        targetSpeeds = racingLine.getTargetSpeeds(self.maxSpeed, turnRate, SmartCar.braking)
+        targetSpeed = targetSpeeds[racingLine.getIndexAhead(i, speed)]
+
+        self.moveTowardsHeading(heading, targetSpeed)
 
     # Is it trying to go forwards towards the checkpoint but constantly banging into a wall?
     # If so, readjust
     def checkStupidity(self, delta):
-        if abs(delta) < 0.1 and self.isCollidingWall:
+        if abs(delta) < self.stupidityAngle and self.isCollidingWall:
             self.doDrive("backwards")
             # Do not want to keep going back checkpoints
             if not self.isBeingStupid: 
@@ -568,16 +800,34 @@ class SmartCar(Racecar):
             self.isBeingStupid = True
         return
 
-    def moveTowardsPoint(self, point):
-        angle = self.angleToPoint(point)
+    # Speed the car slows down to if it only drives forward from now on
+    # NOTE: The acceleration builds up, so after braking it still slows down
+    # for a while, until driving forward brings the acceleration back up to 0
+    def getSettledSpeed(self):
+        if self.acceleration >= 0:
+            return self.speed
 
+        recovery = self.accInc - self.friction
+        if recovery <= 0:
+            return 0
+
+        return self.speed - self.acceleration ** 2 / (2 * recovery)
+
+    def moveTowardsPoint(self, point, targetSpeed=None):
+        self.moveTowardsHeading(self.angleToPoint(point), targetSpeed)
+
+    # Brakes instead of driving forward when the car would still be faster than the target speed, if given
+    def moveTowardsHeading(self, angle, targetSpeed=None):
         yawFacing, _, _ = self.getHpr()
  
         # NOTE: Yaw facing should already be normalised in setHpr function
         delta = yawFacing - angle
         delta = normaliseEuler(delta)
 
-        self.doDrive("forward")
+        if targetSpeed != None and self.getSettledSpeed() > targetSpeed:
+            self.doDrive("backwards")
+        else:
+            self.doDrive("forward")
 
         if abs(delta) < 0.01:
             self.doDrive("forward")
@@ -588,30 +838,38 @@ class SmartCar(Racecar):
 
         self.checkStupidity(delta)
         
-    def updateMovement(self):
+    def updateControls(self):
         self.artificialStupidity()
-        super().updateMovement()
 
 # The smarter car will go for powerups
 class SmartGreedyCar(SmartCar):
+    # Follows the racing line, unless there is a powerup to go for
     def artificialStupidity(self):
-        # Get midpoint of next checkpoint
-        trackPoints = self.gameObj.racetrack.points
-        i = (self.currentCheckpoint+1) % len(trackPoints)
+        powerup = None
+        if not self.isBeingStupid and self.activePowerup == None:
+            powerup = self.findPowerup(self.getNextCheckpoint())
 
-        powerup = self.gameObj.racetrack.powerups[i-1]
-        trackPoint = trackPoints[i]
-        
-        if self.isBeingStupid or powerup == None or self.activePowerup != None:
-            gotoPoint = trackPoint
+        if powerup == None:
+            self.followRacingLine()
         else:
-            powerupPoint = powerup.getPos()
+            self.moveTowardsPoint(powerup.getPos())
+
+    # Closest powerup in front of the car, on the segment towards checkpoint i
+    # and no further away than the checkpoint itself
+    def findPowerup(self, i):
+        racetrack = self.gameObj.racetrack
+        segment = (i-1) % len(racetrack.points)
+
+        x, y, _ = self.getPos()
+        maxDist = self.distanceToPoint(racetrack.points[i], xyOnly=True)
+        yawFacing = self.getHpr()[0]
+
+        def isTarget(powerup):
+            if powerup.segment != segment:
+                return False
 
-            angle = self.angleToPoint(powerupPoint) - self.getHpr()[0]
             # Now check if the powerup point is behind or in front of the car
-            if abs(angle) < 90:
-                gotoPoint = powerupPoint
-            else: 
-                gotoPoint = trackPoint
+            angle = normaliseEuler(self.angleToPoint(powerup.getPos()) - yawFacing)
+            return abs(angle) < 90
 
-        self.moveTowardsPoint(gotoPoint)
+        return self.gameObj.simulation.powerupTracker.getNearestPowerup(x, y, maxDist, isTarget)
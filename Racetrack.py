@@ -2,22 +2,29 @@ from Obj3D import *
 from Racecar import *
 from Terrain import *
 from Powerup import *
+from RacingLine import *
 
 import copy
+import hashlib
+import json
 
 class Wall(Obj3D):
-    def __init__(self, gameObj, model, renderParent=None, pos=None, hpr=None):
-        super().__init__(model, renderParent, pos, hpr)
+    def __init__(self, gameObj, model, renderParent=None, pos=None, hpr=None, instance=True, collisions=True):
+        super().__init__(model, renderParent, pos, hpr, instance)
         self.gameObj = gameObj
 
         if "crate" in model: 
-            self.scaleAll(0.01)
+            self.scaleAll(Wall.getScale(model))
 
         #self.initTexture("concrete")
 
         self.repositionToCenter()
         self.move(dz=self.dimZ/2)
 
+        # The racetrack can generate the collision solids of all walls at once instead
+        if not collisions:
+            return
+
         args = {
             "padding": (0, 0, 0)
         }
@@ -27,9 +34,25 @@ class Wall(Obj3D):
         colNode = self.getCollisionNode("wall")
         colNode.node().setIntoCollideMask(self.gameObj.colBitMask["wall"])
 
+    # Scale applied to the wall model
+    @staticmethod
+    def getScale(model):
+        return 0.01 if "crate" in model else 1
+
+    # Dimensions of a wall of this model, without having to create one
+    @staticmethod
+    def getWallDimensions(model):
+        return Obj3D.getPrototype(model).getDimensions(Wall.getScale(model))
+
+    # Offset of the center of a wall of this model from its origin
+    @staticmethod
+    def getWallOffset(model):
+        offset = Obj3D.getPrototype(model).offset
+        return multiplyVectorByScalar(offset, Wall.getScale(model))
+
 # Creates a bunch of walls stacked on top of each other
 class HighWall():
-    def __init__(self, racetrack, nWalls=1, wallType=None, pos=(0,0,0), angles=(0,0)):
+    def __init__(self, racetrack, nWalls=1, wallType=None, pos=(0,0,0), angles=(0,0), renderParent=None):
         self.racetrack = racetrack
         self.wallType = self.racetrack.wallType if wallType == None else wallType
 
@@ -38,36 +61,129 @@ class HighWall():
 
         theta, phi = angles
 
+        # Walls that are going to be batched are copied and not instanced,
+        # as their vertices will be transformed when they are merged
+        instance = self.racetrack.wallBatching == None
+        collisions = self.racetrack.wallCollisions == "crate"
+
         for i in range(self.nWalls):
-            wall = Wall(self.racetrack.gameObj, self.wallType, pos=pos)
+            wall = Wall(
+                self.racetrack.gameObj, self.wallType, 
+                renderParent=renderParent, pos=pos, 
+                instance=instance, collisions=collisions
+            )
             dz = wall.dimZ * i
 
             wall.move(dz=dz)
             wall.rotate(dh=theta, dp=phi)
 
+            self.walls.append(wall)
+
 '''
 Class holds all walls and floors
 '''
 class Racetrack(Obj3D):
-    def __init__(self, gameObj, trackName="test.track"):
+    # Track build modes for the walls
+    #   None: every crate is its own node (with its own draw call)
+    #   "segment": crates of each segment are merged into a few GeomNodes
+    #   "track": crates of the whole track are merged into a few GeomNodes
+    wallBatchingModes = [ None, "segment", "track" ]
+
+    # Collision geometry of the walls
+    #   "crate": a collision box per crate
+    #   "strip": continuous collision polygon strips along the track edges,
+    #            grouped per segment and split into chunks of wallCollisionChunk crates
+    #   "analytic": no collision geometry, the cars are kept off the walls 
+    #               by a WallResolver instead (see WallResolver)
+    wallCollisionModes = [ "crate", "strip", "analytic" ]
+    wallCollisionChunk = 8
+
+    # Compiled track cache
+    # NOTE: Bump the version whenever the way the static scene is built changes
+    cacheDir = "cache/tracks"
+    cacheVersion = 5
+
+    # Static scenes loaded from the cache ahead of the race (see Preloader), by cache file
+    # Each one is only used once, by the next racetrack built from that file
+    preloaded = {}
+
+    # Models the track is built from
+    wallType = "concrete_crate"
+    groundType = "ground"
+    startLineType = "cornfield"
+
+    # The ground texture repeats every groundTextureSize units, along the track and around it
+    # The ground around the track reaches groundMargin units beyond it, just below the road
+    groundTextureSize = 75
+    groundMargin = 160
+    groundDepth = 0.05
+
+    # Starting grid: rows of gridColumns cars across the track,
+    # lined up behind the start line (see getGridPosition)
+    gridColumns = 3
+
+    # The segments are grouped into sections of sectionSize segments (by segment index),
+    # which can be paged in and out of the scene as the race goes on
+    #   None: every section is in the scene for the whole race
+    #   "detach": sections further than pagingDistance from the camera and every car
+    #             are taken out of the scene (but kept in memory)
+    #   "unload": such sections are removed, and are only built when they come in range
+    #             (the track is then never built, or cached, as a whole)
+    #             They are built a segment per update, so that no frame of the race takes long
+    # Sections are only taken out pagingMargin units further away than they are put back,
+    # so that a section at the edge is not paged in and out every time
+    # NOTE: The walls of the whole track batched together cannot be paged
+    pagingModes = [ None, "detach", "unload" ]
+    sectionSize = 4
+    pagingDistance = 500
+    pagingMargin = 100
+
+    # Sections are paged every pagingInterval ticks of the race (see RaceSimulation)
+    pagingInterval = 10
+
+    def __init__(self, gameObj, trackName="test.track", wallBatching="segment", wallCollisions="strip", useCache=True, paging=None, pagingDistance=None):
         self.gameObj = gameObj
-        self.wallType = "concrete_crate"
+        self.trackName = trackName
 
-        # Get wall dimensions through a temporary wall
-        tempWall = Wall(self.gameObj, self.wallType)
-        self.wallDim = tempWall.getDimensions()
-        self.wallOffset = tempWall.getOffset()
-        tempWall.destroy()
+        if wallBatching not in Racetrack.wallBatchingModes:
+            raise Exception(f"Invalid wall batching mode {wallBatching}")
 
-        # Get racecar dimensions through a temporary car
-        tempCar = Racecar(self.gameObj, "groundroamer")
-        tempCarDim = tempCar.getDimensions()
-        tempCar.destroy()
-        Racecar.nRacecars -= 1
+        self.wallBatching = wallBatching
+
+        if wallCollisions not in Racetrack.wallCollisionModes:
+            raise Exception(f"Invalid wall collision mode {wallCollisions}")
+
+        self.wallCollisions = wallCollisions
+
+        if paging not in Racetrack.pagingModes:
+            raise Exception(f"Invalid paging mode {paging}")
+
+        if paging != None and wallBatching == "track":
+            raise Exception("Racetrack sections cannot be paged with the walls of the whole track batched")
+
+        self.paging = paging
+        self.pagingDistance = Racetrack.pagingDistance if pagingDistance == None else pagingDistance
+
+        # Camera to page the sections around, as well as the cars (see updatePaging)
+        self.pagingCamera = None
+
+        # Everything static is kept under the track root,
+        # with one node per segment (from point i to point i+1), grouped into sections
+        self.trackRoot = Obj3D.worldRenderer.attachNewNode("racetrack")
+        self.sections = []
+        self.segments = []
+
+        # Get wall and racecar dimensions from their (shared) model prototypes
+        self.wallDim = Wall.getWallDimensions(self.wallType)
+        tempCarDim = Obj3D.getPrototype("car_groundroamer").getDimensions()
 
         # Set wall spacing
         self.defaultWallSpacing = max(self.wallDim) + tempCarDim[0] * 6
 
+        # Size of the places on the starting grid, with some room around the cars
+        self.gridSlotWidth = (self.defaultWallSpacing - self.wallDim[0]) / Racetrack.gridColumns
+        self.gridSlotLength = tempCarDim[1] * 1.25
+
         # Generate racetrack
         self.points = []
 
@@ -77,48 +193,286 @@ class Racetrack(Obj3D):
             "y": [None, None],
             "z": [None, None]
         }
-        self.generateRacetrackFromFile(trackName)
-        self.getRacetrackBounds()
 
-        # Generate checkpoints
         self.showCheckpoints = False
         self.checkpoints = []
-        self.generateCheckpoints()
+
+        # Where the racing line is across the track, if it was cached with the track (see RacingLine)
+        self.racingLineAcross = None
+
+        # Load the finished static scene from the cache if possible,
+        # otherwise generate walls, floor, checkpoints and start line (and cache them)
+        # NOTE: Unloaded sections are built from the track points, so the cache is not needed then
+        useCache = useCache and self.paging != "unload"
+        loadedFromCache = useCache and self.loadFromCache()
+
+        if not loadedFromCache:
+            self.generateRacetrackFromFile(trackName)
+            self.generateCheckpoints()
+            self.generateStartLine()
+
+        self.getRacetrackBounds()
+
+        # Line for the AI to follow around the track
+        # It only has to be solved when the track is not cached, as it is cached with the track
+        self.racingLine = RacingLine(self, tempCarDim, self.racingLineAcross)
+
+        # NOTE: Before any section is paged out
+        if not loadedFromCache and useCache:
+            self.saveToCache()
+
+        # Only the sections around the start line to begin with
+        self.getSectionBounds()
+        self.updatePaging([ self.points[0] ])
 
         # Generate powerups
         self.powerupSpawnChance = 0.5
         self.powerups = []
         self.generatePowerups()
     
-    # Generate checkpoints
-    # Basically collision boxes from left to right side point
+    # Generate checkpoints (of the segments that have been built)
     def generateCheckpoints(self):
-        leftTrackPoints = self.leftTrackPoints
-        rightTrackPoints = self.rightTrackPoints
+        for i in range(len(self.segments)):
+            if self.segments[i] != None:
+                self.genCheckpoint(i)
+
+        return
+
+    # Checkpoint of segment i
+    # Basically a collision box from left to right side point
+    def genCheckpoint(self, i):
+        leftPos, _ = self.leftTrackPoints[i]
+        rightPos, _ = self.rightTrackPoints[i]
+
+        x0, y0, z0 = leftPos
+        x1, y1, z1 = rightPos
 
         checkPointRad = self.wallDim[1]
 
-        for i in range(len(leftTrackPoints)):
-            leftPos, _ = leftTrackPoints[i]
-            rightPos, _ = rightTrackPoints[i]
+        colBox = CollisionCapsule(
+            (x0, y0, z0),
+            (x1, y1, z1),
+            checkPointRad
+        )
 
-            x0, y0, z0 = leftPos
-            x1, y1, z1 = rightPos
+        colNode = Obj3D.createIsolatedCollisionObj(
+            "checkpoint", colBox, parentNode=self.segments[i],
+            intoBitmask=self.gameObj.colBitMask["checkpoint"],
+            show=self.showCheckpoints
+        )
 
-            colBox = CollisionCapsule(
-                (x0, y0, z0),
-                (x1, y1, z1),
-                checkPointRad
-            )
+        # NOTE: Not a python tag, so that it is kept in the track cache
+        colNode.setTag("checkpointID", str(i))
 
-            colNode = Obj3D.createIsolatedCollisionObj(
-                "checkpoint", colBox, intoBitmask=self.gameObj.colBitMask["checkpoint"],
-                show=self.showCheckpoints
-            )
+        self.checkpoints[i] = colNode
 
-            colNode.setPythonTag("checkpointID", i)
+        return colNode
 
-        return
+    # Lines across the track where the checkpoints are, from the left to the right side point
+    # Stretched by the radius of the checkpoint capsules on both ends
+    # Returns a list of (startPoint, endPoint), one per checkpoint
+    def getCheckpointLines(self):
+        checkPointRad = self.wallDim[1]
+
+        checkpointLines = []
+        for i in range(len(self.leftTrackPoints)):
+            leftPos, _ = self.leftTrackPoints[i]
+            rightPos, _ = self.rightTrackPoints[i]
+
+            directionVector = LVector3f(sub2Tuples(rightPos, leftPos))
+            directionVector.normalize()
+
+            startPoint = LPoint3f(leftPos) - directionVector * checkPointRad
+            endPoint = LPoint3f(rightPos) + directionVector * checkPointRad
+
+            checkpointLines.append((tuple(startPoint), tuple(endPoint)))
+
+        return checkpointLines
+
+    # Position and heading of a place on the starting grid
+    # The first row is on the start line, the next ones follow the track backwards
+    # from there (around the corners too), so any number of cars fit
+    # Returns (pos, yaw, segment)
+    def getGridPosition(self, order):
+        row, column = divmod(order, Racetrack.gridColumns)
+        dist = row * self.gridSlotLength
+
+        N = len(self.points)
+
+        # Segment i goes from points[i] to end, along (dx, dy, dz)
+        # The first row faces the first segment, like the start line
+        i = 0
+        end = self.points[0]
+        dx, dy, dz = sub2Tuples(self.points[1 % N], end)
+        length = 0
+
+        # Find the segment the row is on, going back from the start line
+        if dist > 0:
+            i = N - 1
+            while True:
+                start = self.points[i]
+                dx, dy, dz = sub2Tuples(end, start)
+                length = math.sqrt(dx*dx + dy*dy + dz*dz)
+
+                if dist <= length:
+                    break
+
+                dist -= length
+                end = start
+                i = (i - 1) % N
+
+        fraction = dist / length if length > 0 else 0
+        x, y, z = end[0] - dx * fraction, end[1] - dy * fraction, end[2] - dz * fraction
+
+        # Columns from left to right, across the track
+        flatLength = math.sqrt(dx*dx + dy*dy)
+        if flatLength > 0:
+            offset = ((Racetrack.gridColumns - 1) / 2 - column) * self.gridSlotWidth
+            x -= dy / flatLength * offset
+            y += dx / flatLength * offset
+
+        yaw = self.leftTrackPoints[i][1][0]
+
+        return (x, y, z), yaw, i
+
+    # Start line at the first point, facing the first segment
+    def generateStartLine(self):
+        _, angles = self.leftTrackPoints[0]
+        pos = self.points[0]
+
+        startLine = Ground(self.gameObj, self.startLineType, renderParent=self.trackRoot, pos=pos)
+        startLine.rotate(dh=angles[0], dp=angles[1])
+
+        self.startLine = startLine.model
+        self.startLine.setName("startLine")
+
+        return self.startLine
+
+    # Compiled track cache
+    # The key is a hash of the track file, the models used to build it
+    # and the settings that change the static scene
+    # NOTE: Static, so that the cache file of a track can be found before building the track (see Preloader)
+    @staticmethod
+    def getCacheKey(trackName, wallBatching="segment", wallCollisions="strip"):
+        sha = hashlib.sha1()
+
+        sha.update(f"{Racetrack.cacheVersion} {wallBatching} {wallCollisions}".encode())
+
+        # The racing line is cached with the track
+        sha.update(RacingLine.getSettings().encode())
+
+        trackFile = Racetrack.getTrackFile(trackName)
+        modelFiles = [
+            ModelPrototype.findModelFile(model) for model in 
+            [ Racetrack.wallType, Racetrack.groundType, Racetrack.startLineType, "car_groundroamer" ]
+        ]
+
+        for fileName in [ trackFile ] + modelFiles:
+            with open(fileName, "rb") as f:
+                sha.update(f.read())
+
+        return sha.hexdigest()
+
+    @staticmethod
+    def getCacheFile(trackName, wallBatching="segment", wallCollisions="strip"):
+        cacheKey = Racetrack.getCacheKey(trackName, wallBatching, wallCollisions)
+        trackName = os.path.basename(trackName).replace(".track", "")
+        return f"{Racetrack.cacheDir}/{trackName}-{cacheKey}.bam"
+
+    # Write the static scene to a bam file
+    # The track points are kept (as json) in a tag on the track root
+    def saveToCache(self):
+        metadata = {
+            "points": self.points,
+            "leftTrackPoints": self.leftTrackPoints,
+            "rightTrackPoints": self.rightTrackPoints,
+            "racingLine": self.racingLine.across
+        }
+        self.trackRoot.setTag("metadata", json.dumps(metadata))
+
+        cacheFile = Racetrack.getCacheFile(self.trackName, self.wallBatching, self.wallCollisions)
+
+        try:
+            os.makedirs(Racetrack.cacheDir, exist_ok=True)
+
+            # NOTE: Several processes can build the same track at once (see Tournament),
+            #       so the file is written under another name first and then moved in place,
+            #       and the others never load a half written file
+            tempFile = f"{cacheFile}.{os.getpid()}.tmp"
+            if not self.trackRoot.writeBamFile(tempFile):
+                raise Exception(f"Failed to write {tempFile}")
+
+            os.replace(tempFile, cacheFile)
+
+            # Older versions of this track are no longer needed
+            trackName = os.path.basename(self.trackName).replace(".track", "")
+            for f in os.listdir(Racetrack.cacheDir):
+                if re.fullmatch(rf"{re.escape(trackName)}-[0-9a-f]+\.bam", f) \
+                   and f"{Racetrack.cacheDir}/{f}" != cacheFile:
+                    try:
+                        os.remove(f"{Racetrack.cacheDir}/{f}")
+                    except FileNotFoundError:
+                        # Already removed by another process
+                        pass
+        except Exception as e:
+            print(f"Racetrack {self.trackName} could not be cached: {e}")
+            return False
+
+        return True
+
+    # Load the static scene from a bam file, if it exists
+    # Returns whether the racetrack was loaded
+    def loadFromCache(self):
+        try:
+            cacheFile = Racetrack.getCacheFile(self.trackName, self.wallBatching, self.wallCollisions)
+        except:
+            return False
+
+        if not os.path.exists(cacheFile):
+            return False
+
+        # Already loaded (in the background) or loaded now
+        trackRoot = Racetrack.preloaded.pop(cacheFile, None)
+
+        if trackRoot == None:
+            try:
+                trackRoot = loader.loadModel(cacheFile, noCache=True)
+            except:
+                print(f"Cached racetrack {cacheFile} cannot be loaded, regenerating it")
+                return False
+
+        metadata = json.loads(trackRoot.getTag("metadata"))
+
+        # Lists of lists from json back to the tuples used everywhere else
+        self.points = [ tuple(point) for point in metadata["points"] ]
+        self.leftTrackPoints = [ 
+            (tuple(point), tuple(angles)) for point, angles in metadata["leftTrackPoints"]
+        ]
+        self.rightTrackPoints = [ 
+            (tuple(point), tuple(angles)) for point, angles in metadata["rightTrackPoints"]
+        ]
+        self.racingLineAcross = metadata.get("racingLine")
+
+        # The textures saved in the cache can be of another quality
+        Obj3D.useCompiledTextures(trackRoot)
+
+        # Replace the (empty) track root
+        self.trackRoot.removeNode()
+        self.trackRoot = trackRoot
+        self.trackRoot.reparentTo(Obj3D.worldRenderer)
+
+        self.sections = [
+            self.trackRoot.find(f"section-{k}") for k in range(self.getNumSections())
+        ]
+        self.segments = [ 
+            self.trackRoot.find(f"*/segment-{i}") for i in range(len(self.points)) 
+        ]
+        self.checkpoints = [
+            segment.find("checkpoint") for segment in self.segments
+        ]
+        self.startLine = self.trackRoot.find("startLine")
+
+        return True
 
     def generatePowerups(self):
         N = len(self.points)
@@ -136,6 +490,7 @@ class Racetrack(Obj3D):
             pos = tuple(point1 + dirVec * r)
 
             powerup = ActivePowerup(self.gameObj, pos=pos)
+            powerup.segment = i
 
             self.powerups.append(powerup)
 
@@ -149,11 +504,7 @@ class Racetrack(Obj3D):
     def parseTrackFile(fileName):
         points = []
 
-        try:
-            f = open(f"racetracks/{fileName}", "r")
-        except:
-            print(f"Racetrack {fileName} not found, defaulting to test.track")
-            f = open(f"racetracks/test.track", "r")
+        f = open(Racetrack.getTrackFile(fileName), "r")
 
         lineNo = 0
         for line in f:
@@ -205,8 +556,36 @@ class Racetrack(Obj3D):
         f.close()
         return points
 
+    # Path of the track file, defaulting to test.track if it does not exist
+    # NOTE: Tracks outside of racetracks/ (such as the ones kept by replays) are given by their path
+    @staticmethod
+    def getTrackFile(fileName):
+        trackFile = fileName if os.path.dirname(fileName) != "" else f"racetracks/{fileName}"
+
+        if not os.path.exists(trackFile):
+            print(f"Racetrack {fileName} not found, defaulting to test.track")
+            trackFile = f"racetracks/test.track"
+
+        return trackFile
+
     # Generate racetrack given fileName of track
+    # When the sections are unloaded while they are out of range, they are only built when needed
     def generateRacetrackFromFile(self, fileName):
+        self.generateTrackPoints(fileName)
+
+        if self.paging != "unload":
+            for i in range(len(self.points)):
+                self.generateSegment(i)
+
+            if self.wallBatching == "track":
+                self.batchWalls(self.getWallsNode())
+
+        self.genSurroundings()
+
+        return
+
+    # Points of the track file, and the left and right side points around them
+    def generateTrackPoints(self, fileName):
         points = Racetrack.parseTrackFile(fileName)
 
         # line: (startPoint, dirVector)
@@ -240,26 +619,59 @@ class Racetrack(Obj3D):
             pos = intersectionOfLines(sideLine1, sideLine2)
 
             rightTrackPoints.append((pos, angles))
-        
-        # Now actually generate the tracks!
-        for i in range(N):
-            # Left Track
-            p0, angles = leftTrackPoints[i]
-            p1, _ = leftTrackPoints[(i+1) % N]
-
-            self.genWallsFromPointToPoint(p0, p1, angles)
-
-            # Right Track
-            p0, angles = rightTrackPoints[i]
-            p1, _ = rightTrackPoints[(i+1) % N]
-
-            self.genWallsFromPointToPoint(p0, p1, angles)
 
         self.points = points
         self.leftTrackPoints = leftTrackPoints
         self.rightTrackPoints = rightTrackPoints
 
+        # Nothing is built yet
+        self.sections = [ None ] * self.getNumSections()
+        self.segments = [ None ] * N
+        self.checkpoints = [ None ] * N
+
+        # Distance along the center line from the first point to every point (for the texture of the road)
+        self.roadDistances = [ 0 ]
+        for i in range(N - 1):
+            left0, _ = leftTrackPoints[i]
+            right0, _ = rightTrackPoints[i]
+            left1, _ = leftTrackPoints[i+1]
+            right1, _ = rightTrackPoints[i+1]
+
+            self.roadDistances.append(self.roadDistances[-1] + getVectorMagnitude(
+                sub2Tuples(add2Tuples(left1, right1), add2Tuples(left0, right0))
+            ) / 2)
+
         return
+
+    # Now actually generate the track of segment i!
+    def generateSegment(self, i):
+        N = len(self.points)
+        leftTrackPoints = self.leftTrackPoints
+        rightTrackPoints = self.rightTrackPoints
+
+        segment = self.genSegmentNode(i)
+
+        # Left Track
+        p0, angles = leftTrackPoints[i]
+        p1, _ = leftTrackPoints[(i+1) % N]
+
+        self.genWallsFromPointToPoint(p0, p1, angles, segment)
+
+        # Right Track
+        p0, angles = rightTrackPoints[i]
+        p1, _ = rightTrackPoints[(i+1) % N]
+
+        self.genWallsFromPointToPoint(p0, p1, angles, segment)
+
+        self.genRoadSurface(i, leftTrackPoints, rightTrackPoints, self.roadDistances[i])
+
+        if self.wallCollisions == "strip":
+            self.genWallCollisionStrips(i, leftTrackPoints, rightTrackPoints)
+
+        if self.wallBatching == "segment":
+            self.batchWalls(self.getWallsNode(segment))
+
+        return segment
         
     def getRacetrackBounds(self):
         p0, _ = self.leftTrackPoints[0]
@@ -291,9 +703,383 @@ class Racetrack(Obj3D):
 
         return self.trackBounds
 
-    def genWallsFromPointToPoint(self, startPoint, endPoint, angles=None):
+    # Node holding everything static of segment i, under the node of its section
+    def genSegmentNode(self, i):
+        k = self.getSection(i)
+        if self.sections[k] == None:
+            self.sections[k] = self.trackRoot.attachNewNode(f"section-{k}")
+
+        segment = self.sections[k].attachNewNode(f"segment-{i}")
+        segment.attachNewNode("walls")
+        segment.attachNewNode("wallCollisions")
+        segment.attachNewNode("ground")
+
+        self.segments[i] = segment
+
+        return segment
+
+    # Section segment i is in
+    def getSection(self, i):
+        return i // Racetrack.sectionSize
+
+    def getNumSections(self):
+        return math.ceil(len(self.points) / Racetrack.sectionSize)
+
+    # Segments of section k
+    def getSectionSegments(self, k):
+        return range(k * Racetrack.sectionSize, min((k+1) * Racetrack.sectionSize, len(self.points)))
+
+    # Bounding sphere (center, radius) of every section, around the side points
+    # of its segments and the walls standing on them
+    def getSectionBounds(self):
+        N = len(self.points)
+        wallHeight = self.wallDim[2] * 2
+
+        self.sectionBounds = []
+        for k in range(self.getNumSections()):
+            segments = self.getSectionSegments(k)
+
+            # Segments end at the first point of the next one
+            points = []
+            for i in list(segments) + [ segments[-1] + 1 ]:
+                points.append(LPoint3f(self.leftTrackPoints[i % N][0]))
+                points.append(LPoint3f(self.rightTrackPoints[i % N][0]))
+
+            center = LPoint3f(0, 0, 0)
+            for point in points:
+                center += point
+            center /= len(points)
+
+            radius = max([ (point - center).length() for point in points ]) + wallHeight
+
+            self.sectionBounds.append((center, radius))
+
+        return self.sectionBounds
+
+    # Page the sections in and out around the given points (the cars) and the paging camera
+    # Sections within pagingDistance of any of them are put in the scene (and built if needed),
+    # and the sections further than pagingDistance + pagingMargin from all of them are taken out
+    # Returns the number of sections paged in or out
+    def updatePaging(self, points):
+        if self.paging == None:
+            return 0
+
+        points = [ LPoint3f(point) for point in points ]
+        if self.pagingCamera != None:
+            points.append(self.pagingCamera.getPos(self.trackRoot))
+
+        nChanged = 0
+        for k, (center, radius) in enumerate(self.sectionBounds):
+            section = self.sections[k]
+            isPagedIn = section != None and section.hasParent()
+
+            # Distance of the closest point from the section
+            distance = min([ (point - center).length() for point in points ]) - radius
+
+            if distance <= self.pagingDistance and not (isPagedIn and self.isSectionBuilt(k)):
+                # Sections with a car (or the camera) in them are needed right away
+                self.pageInSection(k, None if distance <= 0 else 1)
+                nChanged += 1
+            elif isPagedIn and distance > self.pagingDistance + Racetrack.pagingMargin:
+                self.pageOutSection(k)
+                nChanged += 1
+
+        return nChanged
+
+    # Whether all the segments of section k have been built
+    def isSectionBuilt(self, k):
+        for i in self.getSectionSegments(k):
+            if self.segments[i] == None:
+                return False
+
+        return True
+
+    # Put section k in the scene, building at most maxSegments of its segments
+    # that have not been built yet (all of them if None)
+    def pageInSection(self, k, maxSegments=None):
+        segments = [ i for i in self.getSectionSegments(k) if self.segments[i] == None ]
+
+        for i in segments[:maxSegments]:
+            self.generateSegment(i)
+            self.genCheckpoint(i)
+
+        self.sections[k].reparentTo(self.trackRoot)
+
+        return self.sections[k]
+
+    def pageOutSection(self, k):
+        if self.paging == "unload":
+            self.sections[k].removeNode()
+            self.sections[k] = None
+
+            for i in self.getSectionSegments(k):
+                self.segments[i] = None
+                self.checkpoints[i] = None
+
+            return
+
+        self.sections[k].detachNode()
+
+    # Road surface of segment i: one triangle strip from the left and right track points
+    # of point i to those of the next point, with the floor collisions on the same triangles
+    # The texture is mapped by distance: across from the left edge, and along the center line
+    # from the first point (distance), so that it carries on seamlessly from segment to segment
+    # Returns the distance at the end of the segment
+    def genRoadSurface(self, i, leftTrackPoints, rightTrackPoints, distance=0):
+        N = len(leftTrackPoints)
+        ground = self.segments[i].find("ground")
+
+        left0, _ = leftTrackPoints[i]
+        right0, _ = rightTrackPoints[i]
+        left1, _ = leftTrackPoints[(i+1) % N]
+        right1, _ = rightTrackPoints[(i+1) % N]
+
+        # Center line: halfway between the left and right track points
+        center0 = multiplyVectorByScalar(add2Tuples(left0, right0), 0.5)
+        center1 = multiplyVectorByScalar(add2Tuples(left1, right1), 0.5)
+        nextDistance = distance + getVectorMagnitude(sub2Tuples(center1, center0))
+
+        size = Racetrack.groundTextureSize
+        vertices = [
+            (left0, (0, distance / size)),
+            (right0, (getVectorMagnitude(sub2Tuples(right0, left0)) / size, distance / size)),
+            (left1, (0, nextDistance / size)),
+            (right1, (getVectorMagnitude(sub2Tuples(right1, left1)) / size, nextDistance / size))
+        ]
+
+        self.genGroundGeom("road", vertices, ground)
+
+        # Same triangles as the strip, facing up
+        triangles = [ (left0, right0, left1), (left1, right0, right1) ]
+        colNode = None
+        for a, b, c in triangles:
+            if LVector3f(sub2Tuples(b, a)).cross(LVector3f(sub2Tuples(c, a)))[2] < 0:
+                a, c = c, a
+
+            polygon = CollisionPolygon(LPoint3f(a), LPoint3f(b), LPoint3f(c))
+
+            if colNode == None:
+                colNode = Obj3D.createIsolatedCollisionObj(
+                    "floor", polygon, parentNode=ground,
+                    fromBitmask=self.gameObj.colBitMask["off"], 
+                    intoBitmask=self.gameObj.colBitMask["floor"]
+                )
+            else:
+                colNode.node().addSolid(polygon)
+
+        return nextDistance
+
+    # Flat ground all around the track, just below its lowest point
+    # (a single quad, so that the road does not float in the void)
+    def genSurroundings(self):
+        bounds = self.getRacetrackBounds()
+        margin = Racetrack.groundMargin
+        size = Racetrack.groundTextureSize
+
+        x0, x1 = bounds["x"][0] - margin, bounds["x"][1] + margin
+        y0, y1 = bounds["y"][0] - margin, bounds["y"][1] + margin
+        z = bounds["z"][0] - Racetrack.groundDepth
+
+        vertices = [
+            ((x0, y0, z), (x0 / size, y0 / size)),
+            ((x1, y0, z), (x1 / size, y0 / size)),
+            ((x0, y1, z), (x0 / size, y1 / size)),
+            ((x1, y1, z), (x1 / size, y1 / size))
+        ]
+
+        return self.genGroundGeom("surroundings", vertices, self.trackRoot)
+
+    # A triangle strip with the ground texture, from a list of (pos, uv)
+    def genGroundGeom(self, name, vertices, parentNode):
+        vertexData = GeomVertexData(name, GeomVertexFormat.getV3n3t2(), Geom.UHStatic)
+        vertexData.setNumRows(len(vertices))
+
+        vertexWriter = GeomVertexWriter(vertexData, "vertex")
+        normalWriter = GeomVertexWriter(vertexData, "normal")
+        texcoordWriter = GeomVertexWriter(vertexData, "texcoord")
+
+        # The strip is flat, so all vertices share the normal of the first triangle (facing up)
+        p0, p1, p2 = [ LVector3f(pos) for pos, _ in vertices[:3] ]
+        normal = (p1 - p0).cross(p2 - p0)
+        normal.normalize()
+
+        # Triangles of a strip face the same way as the first one, which has to face up
+        if normal[2] < 0:
+            normal = -normal
+            vertices = [ vertices[j ^ 1] for j in range(len(vertices)) ]
+
+        for pos, uv in vertices:
+            vertexWriter.addData3f(*pos)
+            normalWriter.addData3f(normal)
+            texcoordWriter.addData2f(*uv)
+
+        strip = GeomTristrips(Geom.UHStatic)
+        strip.addConsecutiveVertices(0, len(vertices))
+        strip.closePrimitive()
+
+        geom = Geom(vertexData)
+        geom.addPrimitive(strip)
+
+        geomNode = GeomNode(name)
+        geomNode.addGeom(geom)
+
+        groundNode = parentNode.attachNewNode(geomNode)
+
+        texture = Obj3D.getPrototype(self.groundType).model.findTexture("*")
+        if texture != None:
+            groundNode.setTexture(texture, 1)
+
+        return groundNode
+
+    # Node the walls of a segment are placed under
+    # When the whole track is batched, all walls share a single node
+    def getWallsNode(self, segment=None):
+        if self.wallBatching == "track" or segment == None:
+            walls = self.trackRoot.find("walls")
+            if walls.isEmpty():
+                walls = self.trackRoot.attachNewNode("walls")
+            return walls
+
+        return segment.find("walls")
+
+    # Merge all crates under a walls node into as few GeomNodes as possible
+    # Collision nodes are kept as they are (next to the walls node), 
+    # so that the collision solids are not changed by the flattening
+    def batchWalls(self, wallsNode):
+        wallCollisions = wallsNode.getParent().find("wallCollisions")
+        if wallCollisions.isEmpty():
+            wallCollisions = wallsNode.getParent().attachNewNode("wallCollisions")
+
+        for colNode in wallsNode.findAllMatches("**/+CollisionNode"):
+            colNode.wrtReparentTo(wallCollisions)
+
+        # Model nodes are never flattened away, so get rid of them first
+        wallsNode.clearModelNodes()
+        wallsNode.flattenStrong()
+
+        return wallsNode
+
+    # Generate the wall collisions of segment i as continuous strips along the left and right edges
+    # Each strip is a thin box (without end caps) made of collision polygons,
+    # covering exactly the crates placed by genWallsFromPointToPoint
+    # Every chunk of crates is its own collision node, so that the traverser 
+    # can discard distant segments and chunks by their bounding volumes
+    def genWallCollisionStrips(self, i, leftTrackPoints, rightTrackPoints):
+        N = len(leftTrackPoints)
+        wallCollisions = self.segments[i].find("wallCollisions")
+
+        for side, sideTrackPoints in [ ("left", leftTrackPoints), ("right", rightTrackPoints) ]:
+            startPoint, angles = sideTrackPoints[i]
+            endPoint, _ = sideTrackPoints[(i+1) % N]
+
+            for chunk, polygons in enumerate(self.genWallStripPolygons(startPoint, endPoint, angles)):
+                colNode = Obj3D.createIsolatedCollisionObj(
+                    "wall", polygons[0], parentNode=wallCollisions,
+                    intoBitmask=self.gameObj.colBitMask["wall"]
+                )
+                colNode.setTag("side", side)
+                colNode.setTag("chunk", str(chunk))
+
+                for polygon in polygons[1:]:
+                    colNode.node().addSolid(polygon)
+
+        return wallCollisions
+
+    # Returns a list of chunks, each a list of collision polygons
+    def genWallStripPolygons(self, startPoint, endPoint, angles=None):
+        if angles == None: angles = (0, 0)
+        theta, _ = angles
+
+        directionVector = LVector3f(sub2Tuples(endPoint, startPoint))
+        distance = directionVector.length()
+
+        if distance == 0: return []
+
+        # Same spacing as genWallsFromPointToPoint
+        wallSize = self.wallDim[1]
+        nWallsNeeded = math.ceil(distance / wallSize)
+        wallHeight = self.wallDim[2] * 2
+        halfThickness = self.wallDim[0] / 2
+
+        directionVector /= distance
+        normal = LVector3f(directionVector[1], -directionVector[0], 0)
+        normal.normalize()
+
+        shift = self.getWallShift(theta)
+
+        chunks = []
+        chunkSize = Racetrack.wallCollisionChunk
+        for i in range(0, nWallsNeeded, chunkSize):
+            nWalls = min(chunkSize, nWallsNeeded - i)
+
+            # Each crate is centered on its position along the line
+            p0 = LPoint3f(startPoint) + directionVector * (i - 0.5) * wallSize + shift
+            p1 = p0 + directionVector * nWalls * wallSize
+
+            polygons = []
+            for facing in [ normal, -normal ]:
+                a = p0 + facing * halfThickness
+                b = p1 + facing * halfThickness
+                up = LVector3f(0, 0, wallHeight)
+
+                polygon = CollisionPolygon(a, b, b + up, a + up)
+
+                # Polygons only collide from the front
+                if polygon.getNormal().dot(facing) < 0:
+                    polygon = CollisionPolygon(a + up, b + up, b, a)
+
+                polygons.append(polygon)
+
+            chunks.append(polygons)
+
+        return chunks
+
+    # Walls are rotated around their origin and not their center,
+    # so a line of walls with yaw theta is shifted by the rotated offset
+    def getWallShift(self, theta):
+        offX, offY, _ = Wall.getWallOffset(self.wallType)
+        rad = degToRad(theta)
+
+        return LVector3f(
+            offX * math.cos(rad) - offY * math.sin(rad) - offX,
+            offX * math.sin(rad) + offY * math.cos(rad) - offY,
+            0
+        )
+
+    # Center lines of the walls along the left and right edges, one per side of each segment
+    # Same placement as genWallsFromPointToPoint, from the start of the first crate to the end of the last
+    # Returns a list of (side, i, startPoint, endPoint)
+    def getWallLines(self):
+        N = len(self.leftTrackPoints)
+        wallSize = self.wallDim[1]
+
+        wallLines = []
+        for i in range(N):
+            for side, sideTrackPoints in [ ("left", self.leftTrackPoints), ("right", self.rightTrackPoints) ]:
+                startPoint, angles = sideTrackPoints[i]
+                endPoint, _ = sideTrackPoints[(i+1) % N]
+
+                directionVector = LVector3f(sub2Tuples(endPoint, startPoint))
+                distance = directionVector.length()
+
+                if distance == 0: continue
+
+                nWalls = math.ceil(distance / wallSize)
+                directionVector /= distance
+
+                shift = self.getWallShift(angles[0])
+                p0 = LPoint3f(startPoint) - directionVector * 0.5 * wallSize + shift
+                p1 = p0 + directionVector * nWalls * wallSize
+
+                # Walls follow the slope of the segment
+                p1[2] = endPoint[2]
+
+                wallLines.append((side, i, tuple(p0), tuple(p1)))
+
+        return wallLines
+
+    def genWallsFromPointToPoint(self, startPoint, endPoint, angles=None, segment=None):
         if angles == None: angles = (0, 0)
-        theta, phi = angles
 
         directionVector = sub2Tuples(endPoint, startPoint)
         distance = getVectorMagnitude(directionVector)
@@ -309,12 +1095,10 @@ class Racetrack(Obj3D):
                 startPoint, 
                 multiplyVectorByScalar(directionVector, i * wallSize/distance)
             )
-            wall = HighWall(self, nWalls=2, wallType=self.wallType, pos=pos, angles=angles)
-
-            # Generate floor from point to point as well
-            ground = Ground(self.gameObj, "ground", pos=pos)
-            ground.rotate(dh=theta, dp=phi)
-
+            wall = HighWall(
+                self, nWalls=2, wallType=self.wallType, pos=pos, angles=angles,
+                renderParent=self.getWallsNode(segment)
+            )
 
     # Given a start pos, calculate positions of side track points with defined spacing from the center position
     # and with the correct facing (yaw) 
@@ -0,0 +1,258 @@
+'''
+Racing line
+
+A smooth line around the track, computed once when the track is loaded,
+that the AI follows instead of steering straight at the track points.
+
+The track is sampled every sampleSpacing units along each segment. At every
+sample, the line can be anywhere across the track, between the left and the
+right side (keeping clear of the walls). Starting from the center line, every
+sample is moved again and again to where it bends the line the least, given
+the samples around it, and then back inside the track. This converges to the
+line with the least curvature (the smallest sum of the squared second
+differences of the samples) that the walls allow.
+
+The curvature of the line then gives the fastest a car can take every sample
+at, given how fast it turns. The target speeds are also lowered ahead of
+the corners, so that the cars brake in time (see getTargetSpeeds).
+
+Samples are indexed along the track, so a car following the line only has to
+remember its index and check the next few samples (see getClosestIndex). The
+heading of the line at every sample is kept too, so that the cars steer along
+it without working out the angle to a point every tick (see getHeading).
+'''
+
+from Obj3D import *
+
+class RacingLine(object):
+    # Distance between the samples along the track
+    sampleSpacing = 10
+
+    # Passes of moving the samples
+    smoothingIterations = 500
+    overRelaxation = 1.8
+
+    # Room kept between the line and the walls, on top of half a car
+    wallMargin = 2
+
+    # carDim: size of the cars (x, y, z), to keep them clear of the walls
+    # across: where the line is across the track at every sample, if it has been solved before
+    #         (it is cached with the track, see Racetrack.saveToCache)
+    def __init__(self, racetrack, carDim, across=None):
+        self.racetrack = racetrack
+
+        N = len(racetrack.points)
+
+        # Left and right side of the track at every sample,
+        # interpolated from the side points of the segments
+        self.lefts = []
+        self.rights = []
+
+        for i in range(N):
+            p0, p1 = racetrack.points[i], racetrack.points[(i+1) % N]
+            length = math.sqrt((p1[0] - p0[0]) ** 2 + (p1[1] - p0[1]) ** 2)
+            nSamples = max(1, int(round(length / RacingLine.sampleSpacing)))
+
+            left0, _ = racetrack.leftTrackPoints[i]
+            left1, _ = racetrack.leftTrackPoints[(i+1) % N]
+            right0, _ = racetrack.rightTrackPoints[i]
+            right1, _ = racetrack.rightTrackPoints[(i+1) % N]
+
+            for j in range(nSamples):
+                t = j / nSamples
+                self.lefts.append(tuple(left0[k] + (left1[k] - left0[k]) * t for k in range(3)))
+                self.rights.append(tuple(right0[k] + (right1[k] - right0[k]) * t for k in range(3)))
+
+        self.nSamples = len(self.lefts)
+
+        # Where the line is across the track at every sample, from 0 (left) to 1 (right)
+        if across != None and len(across) == self.nSamples:
+            self.across = list(across)
+        else:
+            self.across = [ 0.5 for i in range(self.nSamples) ]
+
+            # Cars turning at the corners reach as far as half their diagonal
+            self.smooth(math.sqrt(carDim[0] ** 2 + carDim[1] ** 2))
+
+        self.points = [ self.getPoint(i, self.across[i]) for i in range(self.nSamples) ]
+        self.curvatures = self.getCurvatures()
+
+        # Distance from every sample to the next one, and the heading (yaw, in degrees)
+        # and the unit vector from every sample to the next one
+        self.spacings = []
+        self.headings = []
+        self.directions = []
+        for i in range(self.nSamples):
+            x0, y0, _ = self.points[i]
+            x1, y1, _ = self.points[(i+1) % self.nSamples]
+            spacing = math.sqrt((x1 - x0) ** 2 + (y1 - y0) ** 2)
+
+            self.spacings.append(spacing)
+            # NOTE: Euler system, the same as Racecar.angleToPoint
+            self.headings.append(rad2Deg(math.atan2(x0 - x1, y1 - y0)))
+            self.directions.append(((x1 - x0) / spacing, (y1 - y0) / spacing) if spacing > 0 else (0, 0))
+
+        # Target speeds, by the parameters of the cars (see getTargetSpeeds)
+        self.targetSpeeds = {}
+
+    # Settings the line depends on, so that a cached line is only used with the same settings
+    @staticmethod
+    def getSettings():
+        return f"{RacingLine.sampleSpacing} {RacingLine.smoothingIterations} " \
+               f"{RacingLine.overRelaxation} {RacingLine.wallMargin}"
+
+    # Point at the given fraction of the way across the track, at sample i
+    def getPoint(self, i, across):
+        left, right = self.lefts[i], self.rights[i]
+        return tuple(left[k] + (right[k] - left[k]) * across for k in range(3))
+
+    # Move every sample to where it bends the line the least, keeping it on the track
+    def smooth(self, carSize):
+        n = self.nSamples
+        lefts, rights, across = self.lefts, self.rights, self.across
+
+        # Limits across the track at every sample, and the left to right vectors
+        limits = []
+        sides = []
+        for i in range(n):
+            dx, dy = rights[i][0] - lefts[i][0], rights[i][1] - lefts[i][1]
+            width = math.sqrt(dx*dx + dy*dy)
+
+            # The walls are centered on the sides
+            margin = (self.racetrack.wallDim[0] + carSize) / 2 + RacingLine.wallMargin
+            margin = min(margin / width, 0.5) if width > 0 else 0.5
+
+            limits.append((margin, 1 - margin))
+            sides.append((dx, dy, dx*dx + dy*dy))
+
+        xs = [ lefts[i][0] + sides[i][0] * across[i] for i in range(n) ]
+        ys = [ lefts[i][1] + sides[i][1] * across[i] for i in range(n) ]
+
+        # NOTE: Samples are updated in place (Gauss-Seidel), which converges faster
+        for _ in range(RacingLine.smoothingIterations):
+            for i in range(n):
+                dx, dy, widthSquared = sides[i]
+                if widthSquared == 0:
+                    continue
+
+                # Where the sample bends the line the least (the sum of the squared
+                # second differences of the samples around it is the smallest)
+                midX = (4 * (xs[i-1] + xs[(i+1) % n]) - xs[i-2] - xs[(i+2) % n]) / 6
+                midY = (4 * (ys[i-1] + ys[(i+1) % n]) - ys[i-2] - ys[(i+2) % n]) / 6
+
+                # Closest point to that, across the track
+                t = ((midX - lefts[i][0]) * dx + (midY - lefts[i][1]) * dy) / widthSquared
+
+                # Over-relaxation: moving further than that converges a lot faster
+                t = across[i] + (t - across[i]) * RacingLine.overRelaxation
+
+                low, high = limits[i]
+                t = min(max(t, low), high)
+
+                across[i] = t
+                xs[i] = lefts[i][0] + dx * t
+                ys[i] = lefts[i][1] + dy * t
+
+    # Curvature (1 / radius) of the line at every sample, from the circle through it and its neighbours
+    def getCurvatures(self):
+        n = self.nSamples
+        points = self.points
+
+        curvatures = []
+        for i in range(n):
+            ax, ay, _ = points[i-1]
+            bx, by, _ = points[i]
+            cx, cy, _ = points[(i+1) % n]
+
+            cross = (bx - ax) * (cy - ay) - (by - ay) * (cx - ax)
+            a = math.sqrt((bx - ax) ** 2 + (by - ay) ** 2)
+            b = math.sqrt((cx - bx) ** 2 + (cy - by) ** 2)
+            c = math.sqrt((cx - ax) ** 2 + (cy - ay) ** 2)
+
+            curvatures.append(2 * abs(cross) / (a * b * c) if a * b * c > 0 else 0)
+
+        return curvatures
+
+    # Fastest speed (per tick) a car can take every sample at
+    #   maxSpeed: top speed of the car
+    #   turnRate: how much the car turns in a tick (in degrees)
+    #   braking: how much the car can slow down in a tick
+    def getTargetSpeeds(self, maxSpeed, turnRate, braking):
+        key = (maxSpeed, turnRate, braking)
+        if key in self.targetSpeeds:
+            return self.targetSpeeds[key]
+
+        n = self.nSamples
+        turnRate = degToRad(turnRate)
+
+        # Turning at turnRate, a car at speed v drives around a circle of radius v / turnRate
+        speeds = []
+        for curvature in self.curvatures:
+            speeds.append(min(maxSpeed, turnRate / curvature) if curvature > 0 else maxSpeed)
+
+        # Slow down before the corners: v0^2 <= v1^2 + 2 * braking * distance
+        # Twice around, as the track is a loop
+        for _ in range(2):
+            for i in range(n - 1, -1, -1):
+                nextSpeed = speeds[(i+1) % n]
+                speeds[i] = min(speeds[i], math.sqrt(nextSpeed ** 2 + 2 * braking * self.spacings[i]))
+
+        self.targetSpeeds[key] = speeds
+        return speeds
+
+    # Index of the sample closest to (x, y), looking ahead from the previous index
+    # (or at every sample if there is none)
+    def getClosestIndex(self, x, y, prevIndex=None):
+        n = self.nSamples
+        points = self.points
+
+        def distSquared(i):
+            px, py, _ = points[i % n]
+            return (px - x) ** 2 + (py - y) ** 2
+
+        if prevIndex == None:
+            return min(range(n), key=distSquared)
+
+        # Move forwards while the next sample is closer
+        i = prevIndex
+        dist = distSquared(i)
+        for _ in range(n):
+            nextDist = distSquared(i + 1)
+            if nextDist > dist:
+                break
+
+            i += 1
+            dist = nextDist
+
+        # Far from the line (after a reset, or driving the wrong way)
+        if dist > self.racetrack.defaultWallSpacing ** 2:
+            return min(range(n), key=distSquared)
+
+        return i % n
+
+    # Heading (yaw, in degrees) to steer at from (x, y), near sample i, to reach the line the given distance ahead
+    # It is the heading of the line halfway there, turned towards the line by how far (x, y) is off it
+    # (the small angle approximation of the angle to the point ahead)
+    def getHeading(self, i, x, y, distance):
+        px, py, _ = self.points[i]
+        dx, dy = self.directions[i]
+
+        # How far (x, y) is to the left of the line, for the distance ahead
+        t = (dx * (y - py) - dy * (x - px)) / distance if distance > 0 else 0
+
+        # Angle back to the line, atan(t) to within a third of a degree
+        if abs(t) <= 1:
+            angle = t / (1 + 0.28 * t * t)
+        else:
+            angle = math.copysign(math.pi / 2, t) - t / (t * t + 0.28)
+
+        return self.headings[self.getIndexAhead(i, distance / 2)] - rad2Deg(angle)
+
+    # Sample ahead of index i, by the given distance along the line
+    def getIndexAhead(self, i, distance):
+        n = self.nSamples
+        while distance > 0:
+            distance -= self.spacings[i]
+            i = (i+1) % n
+
+        return i
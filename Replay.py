@@ -0,0 +1,377 @@
+'''
+Race replays
+
+A replay keeps everything needed to run a race again exactly:
+the random seed, the racetrack (the track file itself, as random
+tracks are overwritten), the cars and the controls of the player
+cars on every tick. The AI and the powerups draw from the seeded
+random module, so the same inputs give the same race, bit for bit.
+
+A checksum of the cars' state is kept every second of the race,
+so that playback can tell if (and when) it stopped matching.
+
+Playing back a replay, without a window (as fast as possible):
+    python Replay.py replays/<replay file>
+Or in the game window (use [ and ] to slow down or fast forward):
+    python Replay.py replays/<replay file> --window
+'''
+
+from Obj3D import *
+from Racecar import *
+from RaceSimulation import *
+
+import argparse
+import datetime
+import hashlib
+import json
+import struct
+import sys
+import zlib
+
+class Replay(object):
+    magic = b"ARRP"
+    version = 3
+
+    replayDir = "replays"
+    trackDir = "cache/replays"
+
+    # Controls are packed in a byte per car per tick, one bit each
+    controlBits = [ "forward", "backward", "turnLeft", "turnRight", "drifting" ]
+
+    # Cars whose controls are recorded (the others decide for themselves)
+    recordedCarTypes = [ "Racecar" ]
+
+    def __init__(self, trackName=None, trackData="", seed=0, tickRate=60, totalLaps=3, checksumInterval=60):
+        self.trackName = trackName
+        self.trackData = trackData
+
+        self.seed = seed
+        self.tickRate = tickRate
+        self.totalLaps = totalLaps
+
+        # Every car in the race: (car type, model, passenger)
+        self.cars = []
+
+        # Driving parameters of every car (see Racecar.getDrivingParameters), or None for the defaults
+        # NOTE: Kept since version 2, as the opponents can be tuned (see RaceConfig.loadPresets)
+        self.driving = []
+
+        self.nTicks = 0
+        self.controls = bytearray()
+
+        # State checksum after every checksumInterval ticks
+        self.checksumInterval = checksumInterval
+        self.checksums = []
+
+    def addCar(self, carType, model, passenger, driving=None):
+        self.cars.append((carType, model, passenger))
+        self.driving.append(driving)
+
+    def getRecordedCars(self):
+        return [
+            i for i, (carType, _, _) in enumerate(self.cars)
+            if carType in Replay.recordedCarTypes
+        ]
+
+    @staticmethod
+    def encodeControls(controls):
+        bits = 0
+        for i, control in enumerate(Replay.controlBits):
+            if controls[control]:
+                bits |= 1 << i
+
+        return bits
+
+    @staticmethod
+    def decodeControls(bits, controls):
+        for i, control in enumerate(Replay.controlBits):
+            controls[control] = bits & (1 << i) != 0
+
+    # Checksum of the state of every car after a tick
+    @staticmethod
+    def getStateChecksum(cars):
+        checksum = 0
+
+        for car in cars:
+            x, y, z = car.model.getPos()
+            h, p, r = car.model.getHpr()
+            state = struct.pack("<6fd", x, y, z, h, p, r, car.speed)
+
+            checksum = zlib.crc32(state, checksum)
+
+        return checksum
+
+    # Name of the track to race on
+    # Uses the track in racetracks/ if it has not changed,
+    # otherwise the track kept in the replay is written to its own file
+    def getTrackName(self):
+        trackFile = f"racetracks/{self.trackName}"
+
+        if os.path.exists(trackFile):
+            with open(trackFile, "r") as f:
+                if f.read() == self.trackData:
+                    return self.trackName
+
+        trackHash = hashlib.sha1(self.trackData.encode()).hexdigest()[:12]
+        trackName = self.trackName.replace(".track", "")
+        trackFile = f"{Replay.trackDir}/{trackName}-{trackHash}.track"
+
+        if not os.path.exists(trackFile):
+            os.makedirs(Replay.trackDir, exist_ok=True)
+
+            with open(trackFile, "w") as f:
+                f.write(self.trackData)
+
+        return trackFile
+
+    @staticmethod
+    def packString(string):
+        data = string.encode()
+        return struct.pack("<I", len(data)) + data
+
+    @staticmethod
+    def unpackString(data, offset):
+        length, = struct.unpack_from("<I", data, offset)
+        offset += 4
+
+        return data[offset:offset+length].decode(), offset + length
+
+    def save(self, fileName):
+        data = bytearray()
+
+        data += struct.pack(
+            "<4sHHHQIH", Replay.magic, Replay.version,
+            self.tickRate, self.totalLaps, self.seed, self.nTicks, self.checksumInterval
+        )
+
+        data += Replay.packString(self.trackName)
+        data += Replay.packString(self.trackData)
+
+        # NOTE: 2 bytes since version 3, as there can be more than 255 cars (see RaceConfig)
+        data += struct.pack("<H", len(self.cars))
+        for i, car in enumerate(self.cars):
+            for string in car:
+                data += Replay.packString(string)
+
+            driving = self.driving[i]
+            data += Replay.packString(json.dumps(driving) if driving != None else "")
+
+        # Controls barely change from tick to tick, so they compress very well
+        controls = zlib.compress(bytes(self.controls), 9)
+        data += struct.pack("<I", len(controls))
+        data += controls
+
+        data += struct.pack("<I", len(self.checksums))
+        data += struct.pack(f"<{len(self.checksums)}I", *self.checksums)
+
+        directory = os.path.dirname(fileName)
+        if directory != "":
+            os.makedirs(directory, exist_ok=True)
+
+        with open(fileName, "wb") as f:
+            f.write(data)
+
+    @staticmethod
+    def load(fileName):
+        with open(fileName, "rb") as f:
+            data = f.read()
+
+        headerFormat = "<4sHHHQIH"
+        magic, version, tickRate, totalLaps, seed, nTicks, checksumInterval = \
+            struct.unpack_from(headerFormat, data, 0)
+        offset = struct.calcsize(headerFormat)
+
+        if magic != Replay.magic:
+            raise Exception(f"{fileName} is not a replay")
+
+        if version > Replay.version:
+            raise Exception(f"Replay {fileName} has version {version}, expected at most {Replay.version}")
+
+        trackName, offset = Replay.unpackString(data, offset)
+        trackData, offset = Replay.unpackString(data, offset)
+
+        replay = Replay(trackName, trackData, seed, tickRate, totalLaps, checksumInterval)
+        replay.nTicks = nTicks
+
+        carCountFormat = "<H" if version >= 3 else "<B"
+        nCars, = struct.unpack_from(carCountFormat, data, offset)
+        offset += struct.calcsize(carCountFormat)
+
+        for i in range(nCars):
+            car = []
+            for j in range(3):
+                string, offset = Replay.unpackString(data, offset)
+                car.append(string)
+
+            driving = None
+            if version >= 2:
+                string, offset = Replay.unpackString(data, offset)
+                driving = json.loads(string) if string != "" else None
+
+            replay.addCar(*car, driving)
+
+        length, = struct.unpack_from("<I", data, offset)
+        offset += 4
+        replay.controls = bytearray(zlib.decompress(data[offset:offset+length]))
+        offset += length
+
+        nChecksums, = struct.unpack_from("<I", data, offset)
+        offset += 4
+        replay.checksums = list(struct.unpack_from(f"<{nChecksums}I", data, offset))
+
+        return replay
+
+# Records a race, as it is being simulated
+class ReplayRecorder(object):
+    def __init__(self, simulation, trackName, seed, totalLaps):
+        self.simulation = simulation
+        self.cars = simulation.cars
+
+        with open(Racetrack.getTrackFile(trackName), "r") as f:
+            trackData = f.read()
+
+        self.replay = Replay(trackName, trackData, seed, simulation.tickRate, totalLaps)
+
+        for car in self.cars:
+            self.replay.addCar(
+                type(car).__name__,
+                car.modelName.replace("car_", "", 1),
+                car.personName,
+                car.getDrivingParameters()
+            )
+
+        self.recordedCars = [ self.cars[i] for i in self.replay.getRecordedCars() ]
+        self.saved = False
+
+        simulation.replay = self
+
+    def beforeTick(self, tick):
+        for car in self.recordedCars:
+            self.replay.controls.append(Replay.encodeControls(car.controls))
+
+        self.replay.nTicks = tick + 1
+
+    def afterTick(self, tick):
+        if tick % self.replay.checksumInterval == 0:
+            self.replay.checksums.append(Replay.getStateChecksum(self.cars))
+
+    def getDefaultFileName(self):
+        timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        trackName = self.replay.trackName.replace(".track", "")
+
+        return f"{Replay.replayDir}/{timestamp}-{trackName}.replay"
+
+    # Save the replay (only once)
+    # Returns the name of the file
+    def save(self, fileName=None):
+        if self.saved:
+            return None
+
+        if fileName == None:
+            fileName = self.getDefaultFileName()
+
+        self.replay.save(fileName)
+        self.saved = True
+
+        return fileName
+
+# Plays back the recorded controls into a race, and checks that it matches the recording
+class ReplayPlayer(object):
+    def __init__(self, replay, simulation):
+        self.replay = replay
+        self.simulation = simulation
+        self.cars = simulation.cars
+
+        if len(self.cars) != len(replay.cars):
+            raise Exception(f"Replay has {len(replay.cars)} cars, race has {len(self.cars)}")
+
+        self.recordedCars = [ self.cars[i] for i in replay.getRecordedCars() ]
+
+        # First tick where the race no longer matched the recording
+        self.mismatchTick = None
+
+        simulation.replay = self
+
+    def isFinished(self, tick):
+        return tick >= self.replay.nTicks
+
+    def beforeTick(self, tick):
+        nRecorded = len(self.recordedCars)
+
+        for i, car in enumerate(self.recordedCars):
+            # Let go of everything once the recording is over
+            bits = self.replay.controls[tick * nRecorded + i] \
+                if not self.isFinished(tick) else 0
+
+            Replay.decodeControls(bits, car.controls)
+
+    def afterTick(self, tick):
+        interval = self.replay.checksumInterval
+        if tick % interval != 0 or self.mismatchTick != None:
+            return
+
+        i = tick // interval - 1
+        if i >= len(self.replay.checksums):
+            return
+
+        if Replay.getStateChecksum(self.cars) != self.replay.checksums[i]:
+            self.mismatchTick = tick
+            print(f"Replay no longer matches the recording after {tick/self.replay.tickRate:.2f}s (tick {tick})")
+
+    # Whether every checksum (so far) matched
+    def isVerified(self):
+        return self.mismatchTick == None
+
+# Play back a replay without a window, as fast as possible
+# Stops at the end of the recording (or at untilTime, in seconds of race time)
+# Returns the results of the race
+def playHeadless(replay, untilTime=None):
+    carTypes, carModels, passengers = zip(*replay.cars)
+
+    race = HeadlessRace(
+        replay.getTrackName(), list(carTypes), replay.totalLaps, replay.tickRate,
+        seed=replay.seed, carModels=list(carModels), passengers=list(passengers),
+        driving=replay.driving
+    )
+
+    simulation = race.simulation
+    player = ReplayPlayer(replay, simulation)
+
+    nTicks = replay.nTicks
+    if untilTime != None:
+        nTicks = min(nTicks, int(untilTime * replay.tickRate))
+
+    while simulation.nTicks < nTicks:
+        simulation.tick()
+
+    results = race.getResults()
+    results["verified"] = player.isVerified()
+    results["mismatchTick"] = player.mismatchTick
+
+    race.destroy()
+
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play back a race replay")
+    parser.add_argument("replay")
+    parser.add_argument("--window", action="store_true", help="Play back in the game window")
+    parser.add_argument("--speed", type=float, default=1, help="Playback speed in the game window")
+    parser.add_argument("--until", type=float, default=None, help="Stop after this many seconds of race time")
+    args = parser.parse_args()
+
+    replay = Replay.load(args.replay)
+
+    if args.window:
+        from Game import Game
+
+        Game.replay = replay
+        Game.replaySpeed = args.speed
+
+        game = Game("game")
+        game.run()
+    else:
+        results = playHeadless(replay, args.until)
+
+        json.dump(results, sys.stdout, indent=2)
+        print()
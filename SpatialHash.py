@@ -0,0 +1,138 @@
+'''
+Spatial hash
+
+A uniform grid over the track bounds (seen from the top). Every object
+is kept in the cell its center is in, so finding the objects around
+a point only looks at the few cells nearby instead of every object.
+
+Objects are anything hashable, with a position (x, y) and a radius.
+Objects outside the bounds are kept in the cells along the edges, so
+the grid is made one cell larger than the bounds on every side.
+'''
+
+from Obj3D import *
+
+class SpatialHash(object):
+    def __init__(self, bounds, cellSize):
+        self.cellSize = cellSize
+
+        # One more cell on every side
+        self.minX = bounds["x"][0] - cellSize
+        self.minY = bounds["y"][0] - cellSize
+
+        self.nCellsX = int((bounds["x"][1] - bounds["x"][0]) / cellSize) + 3
+        self.nCellsY = int((bounds["y"][1] - bounds["y"][0]) / cellSize) + 3
+
+        # Objects in each cell, in the order they were added
+        self.cells = {}
+
+        # Position, radius and cell of every object
+        self.objects = {}
+
+        # Largest radius of all the objects, queries look this much further
+        self.maxRadius = 0
+
+    def getCell(self, x, y):
+        i = int((x - self.minX) // self.cellSize)
+        j = int((y - self.minY) // self.cellSize)
+
+        return (
+            max(0, min(i, self.nCellsX - 1)),
+            max(0, min(j, self.nCellsY - 1))
+        )
+
+    def insert(self, obj, x, y, radius=0):
+        cell = self.getCell(x, y)
+
+        self.objects[obj] = (x, y, radius, cell)
+        self.cells.setdefault(cell, []).append(obj)
+
+        self.maxRadius = max(self.maxRadius, radius)
+
+    def remove(self, obj):
+        _, _, _, cell = self.objects.pop(obj)
+        self.cells[cell].remove(obj)
+
+    # Move an object that is already in the grid
+    def move(self, obj, x, y):
+        _, _, radius, cell = self.objects[obj]
+        newCell = self.getCell(x, y)
+
+        if newCell != cell:
+            self.cells[cell].remove(obj)
+            self.cells.setdefault(newCell, []).append(obj)
+
+        self.objects[obj] = (x, y, radius, newCell)
+
+    def getPos(self, obj):
+        x, y, _, _ = self.objects[obj]
+        return x, y
+
+    def __contains__(self, obj):
+        return obj in self.objects
+
+    # Objects touching the circle of the given radius around (x, y)
+    # (so their own radius counts as well)
+    def queryRadius(self, x, y, radius):
+        reach = radius + self.maxRadius
+        i0, j0 = self.getCell(x - reach, y - reach)
+        i1, j1 = self.getCell(x + reach, y + reach)
+
+        found = []
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                for obj in self.cells.get((i, j), []):
+                    ox, oy, oRadius, _ = self.objects[obj]
+                    dx, dy = ox - x, oy - y
+                    dist = radius + oRadius
+
+                    if dx*dx + dy*dy <= dist*dist:
+                        found.append(obj)
+
+        return found
+
+    # Object with its center closest to (x, y), within maxDist
+    # Only objects for which condition(obj) is True count, if given
+    # Returns None if there is none
+    def nearest(self, x, y, maxDist=math.inf, condition=None):
+        ci, cj = self.getCell(x, y)
+        cellSize = self.cellSize
+
+        best = None
+        bestDistSquared = maxDist * maxDist if maxDist != math.inf else math.inf
+
+        # Look through rings of cells further and further away,
+        # until no cell in the ring can be closer than the best so far
+        maxRing = max(ci, cj, self.nCellsX - 1 - ci, self.nCellsY - 1 - cj)
+        for ring in range(maxRing + 1):
+            closest = (ring - 1) * cellSize
+            if ring > 0 and closest * closest > bestDistSquared:
+                break
+
+            for cell in self.getRing(ci, cj, ring):
+                for obj in self.cells.get(cell, []):
+                    ox, oy, _, _ = self.objects[obj]
+                    dx, dy = ox - x, oy - y
+                    distSquared = dx*dx + dy*dy
+
+                    if distSquared < bestDistSquared and (condition == None or condition(obj)):
+                        best = obj
+                        bestDistSquared = distSquared
+
+        return best
+
+    # Cells on the edge of the square of cells ring cells away from (ci, cj)
+    def getRing(self, ci, cj, ring):
+        if ring == 0:
+            return [ (ci, cj) ]
+
+        cells = []
+        for i in range(ci - ring, ci + ring + 1):
+            cells.append((i, cj - ring))
+            cells.append((i, cj + ring))
+
+        for j in range(cj - ring + 1, cj + ring):
+            cells.append((ci - ring, j))
+            cells.append((ci + ring, j))
+
+        return cells
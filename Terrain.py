@@ -61,12 +61,8 @@ class Terrain():
         #self.ground = Ground(self.gameObj, "ground")
         #self.ground.setScale(scaleX=1.5, scaleY=1.5)
 
-        _, angles = racetrack.leftTrackPoints[0]
-        pos = racetrack.points[0]
-
-        self.startLine = Ground(self.gameObj, "cornfield", pos=pos)
-        self.startLine.rotate(
-            dh=angles[0], dp=angles[1])
+        # Start line is part of the racetrack's static scene (so that it is cached)
+        self.startLine = racetrack.startLine
 
         # Sky
         #self.sky = Obj3D("FarmSky")
@@ -0,0 +1,253 @@
+'''
+AI tournament
+
+Races the AI car types against each other on every track in racetracks/,
+once for every random seed, and reports how often each type wins, its lap
+times and how often it crashes (into the walls and into the other cars).
+
+The races are headless (see HeadlessRace) and farmed out to a pool of worker
+processes, one per CPU core by default, each running one race at a time.
+Workers keep their engine from race to race, and only send back a short
+summary of every race, which is added to the totals as soon as it comes in,
+so the memory used stays the same however many races are run. For example:
+    python Tournament.py --seeds 25000 --output report.json
+
+The grid order is shuffled for every race (by its seed), so that no car type
+always starts at the front.
+'''
+
+from RaceSimulation import *
+
+from collections import Counter
+import multiprocessing
+import os
+
+# Totals of the races, overall and by track
+class TournamentStats(object):
+    # Percentiles of the lap times in the report
+    percentiles = [ 10, 50, 90 ]
+
+    def __init__(self):
+        self.nRaces = 0
+        self.failedRaces = []
+        self.raceTime = 0
+
+        # Time spent by the workers, in total
+        self.cpuTime = 0
+
+        # Stats of every car type, overall (track None) and on every track
+        self.carStats = {}
+
+    def getCarStats(self, track, carType):
+        key = (track, carType)
+
+        if key not in self.carStats:
+            self.carStats[key] = {
+                "entries": 0,
+                "wins": 0,
+                "finished": 0,
+                "positions": 0,
+                "wallHits": 0,
+                "carHits": 0,
+                "groundResets": 0,
+                # Lap times (rounded to the hundredth of a second) and how many laps took that long
+                "lapTimes": Counter()
+            }
+
+        return self.carStats[key]
+
+    # Add the summary of a race (see runRace)
+    def add(self, summary):
+        if "error" in summary:
+            self.failedRaces.append(summary)
+            return
+
+        self.nRaces += 1
+        self.raceTime += summary["raceTime"]
+        self.cpuTime += summary["wallTime"]
+
+        for car in summary["cars"]:
+            for track in [ None, summary["track"] ]:
+                stats = self.getCarStats(track, car["type"])
+
+                stats["entries"] += 1
+                stats["wins"] += 1 if car["won"] else 0
+                stats["finished"] += 1 if car["finished"] else 0
+                stats["positions"] += car["position"]
+                stats["wallHits"] += car["wallHits"]
+                stats["carHits"] += car["carHits"]
+                stats["groundResets"] += car["groundResets"]
+                stats["lapTimes"].update(round(lapTime, 2) for lapTime in car["lapTimes"])
+
+    @staticmethod
+    def getDistribution(lapTimes):
+        count = sum(lapTimes.values())
+        if count == 0:
+            return { "laps": 0 }
+
+        times = sorted(lapTimes.keys())
+
+        distribution = {
+            "laps": count,
+            "mean": sum(time * n for time, n in lapTimes.items()) / count,
+            "min": times[0],
+            "max": times[-1]
+        }
+
+        # Walk through the sorted times until each percentile is reached
+        percentiles = list(TournamentStats.percentiles)
+        seen = 0
+        for time in times:
+            seen += lapTimes[time]
+
+            while len(percentiles) > 0 and seen >= count * percentiles[0] / 100:
+                distribution[f"p{percentiles.pop(0)}"] = time
+
+        return distribution
+
+    def getReport(self):
+        def summarize(stats):
+            entries = stats["entries"]
+            return {
+                "entries": entries,
+                "winRate": stats["wins"] / entries,
+                "finishRate": stats["finished"] / entries,
+                "meanPosition": stats["positions"] / entries,
+                "wallHitsPerRace": stats["wallHits"] / entries,
+                "carHitsPerRace": stats["carHits"] / entries,
+                "groundResetsPerRace": stats["groundResets"] / entries,
+                "lapTimes": TournamentStats.getDistribution(stats["lapTimes"])
+            }
+
+        report = {
+            "races": self.nRaces,
+            "failedRaces": self.failedRaces,
+            "raceTime": self.raceTime,
+            "cpuTime": self.cpuTime,
+            "cars": {},
+            "tracks": {}
+        }
+
+        for (track, carType), stats in sorted(self.carStats.items(), key=lambda item: (item[0][0] or "", item[0][1])):
+            if track == None:
+                report["cars"][carType] = summarize(stats)
+            else:
+                report["tracks"].setdefault(track, {})[carType] = summarize(stats)
+
+        return report
+
+# Runs in the worker processes
+# task: (track, carTypes, seed, laps, maxRaceTime, maxTimeBehind)
+# Returns a summary of the race (or of the error, so that one bad race does not stop the tournament)
+def runRace(task):
+    track, carTypes, seed, laps, maxRaceTime, maxTimeBehind = task
+
+    # Same grid for the same seed
+    carTypes = list(carTypes)
+    random.Random(seed).shuffle(carTypes)
+
+    startTime = time.time()
+
+    try:
+        race = HeadlessRace(track, carTypes, laps, maxRaceTime=maxRaceTime, seed=seed, maxTimeBehind=maxTimeBehind)
+        results = race.run()
+        race.destroy()
+    except Exception as e:
+        return { "track": track, "seed": seed, "error": f"{type(e).__name__}: {e}" }
+
+    cars = []
+    for car in results["cars"]:
+        cars.append({
+            "type": car["type"],
+            "won": car["id"] == results["winner"],
+            "finished": car["finishTime"] != None,
+            "position": car["position"],
+            # Finished cars keep driving until the race is over
+            "lapTimes": car["lapTimes"][:laps],
+            "wallHits": car["wallHits"],
+            "carHits": car["carHits"],
+            "groundResets": car["groundResets"]
+        })
+
+    return {
+        "track": track,
+        "seed": seed,
+        "raceTime": results["raceTime"],
+        "wallTime": time.time() - startTime,
+        "cars": cars
+    }
+
+def findTracks(path="racetracks"):
+    return sorted(f for f in os.listdir(path) if f.endswith(".track"))
+
+def printReport(report):
+    print(f"{report['races']} races, {len(report['failedRaces'])} failed")
+
+    columns = "{:<16}{:>8}{:>8}{:>8}{:>10}{:>10}{:>10}{:>10}{:>10}"
+    print(columns.format("", "win %", "done %", "pos", "walls", "cars", "lap p10", "lap p50", "lap p90"))
+
+    for carType, stats in report["cars"].items():
+        lapTimes = stats["lapTimes"]
+        print(columns.format(
+            carType,
+            f"{stats['winRate'] * 100:.1f}",
+            f"{stats['finishRate'] * 100:.1f}",
+            f"{stats['meanPosition']:.2f}",
+            f"{stats['wallHitsPerRace']:.2f}",
+            f"{stats['carHitsPerRace']:.2f}",
+            *[ f"{lapTimes[p]:.2f}" if p in lapTimes else "-" for p in [ "p10", "p50", "p90" ] ]
+        ))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Race the AI car types against each other on every track")
+    parser.add_argument(
+        "--cars", nargs="+", default=list(HeadlessRace.aiCarTypes.keys()),
+        choices=list(HeadlessRace.aiCarTypes.keys())
+    )
+    parser.add_argument("--tracks", nargs="+", default=None, help="Defaults to every track in racetracks/")
+    parser.add_argument("--seeds", type=int, default=10, help="Races on every track")
+    parser.add_argument("--firstSeed", type=int, default=0)
+    parser.add_argument("--laps", type=int, default=3)
+    parser.add_argument("--maxTime", type=float, default=300, help="Max race time in seconds")
+    parser.add_argument(
+        "--maxTimeBehind", type=float, default=30,
+        help="Cars that have not finished this many seconds after the winner do not finish"
+    )
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    parser.add_argument("--output", default=None, help="Write the full report (as json) to this file")
+    args = parser.parse_args()
+
+    tracks = findTracks() if args.tracks == None else args.tracks
+
+    # Seeds first, so that every track gets raced early on
+    tasks = (
+        (track, args.cars, seed, args.laps, args.maxTime, args.maxTimeBehind)
+        for seed in range(args.firstSeed, args.firstSeed + args.seeds)
+        for track in tracks
+    )
+    nTasks = args.seeds * len(tracks)
+
+    stats = TournamentStats()
+    startTime = time.time()
+
+    # NOTE: Workers are replaced now and then, in case anything builds up from race to race
+    with multiprocessing.Pool(args.processes, maxtasksperchild=1000) as pool:
+        for i, summary in enumerate(pool.imap_unordered(runRace, tasks, chunksize=4)):
+            stats.add(summary)
+
+            if "error" in summary:
+                print(f"Race on {summary['track']} (seed {summary['seed']}) failed: {summary['error']}", file=sys.stderr)
+
+            if (i + 1) % 100 == 0 or i + 1 == nTasks:
+                elapsed = time.time() - startTime
+                remaining = elapsed / (i + 1) * (nTasks - i - 1)
+                print(f"{i + 1}/{nTasks} races, {elapsed:.0f}s elapsed, {remaining:.0f}s left", file=sys.stderr)
+
+    report = stats.getReport()
+    report["wallTime"] = time.time() - startTime
+
+    printReport(report)
+
+    if args.output != None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
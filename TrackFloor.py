@@ -0,0 +1,119 @@
+'''
+Track floor heights
+
+The floor of the racetrack follows the track points: along each segment
+(from point i to point i+1) it rises or falls linearly. So instead of
+casting a ray at the road for every car, the height of the floor is
+found by projecting the car onto the center line of its segment.
+
+Every car remembers the segment it is on, and only that segment and
+its neighbours are checked, so finding the floor is O(1) per car.
+Cars that are no longer near any of them (after being reset to the
+start line for example) look through every segment once.
+'''
+
+from Obj3D import *
+
+class TrackFloor(object):
+    # Cars fall at most this fast (in units per second) onto the floor below them,
+    # same as the CollisionHandlerFloor this replaces
+    maxFallSpeed = 10
+
+    # Height of the cars above the road, which is level with the track points (see
+    # Racetrack.genRoadSurface), so that the bottom of the cars does not flicker through it
+    floorOffset = 0.01
+
+    def __init__(self, racetrack, cars, tickRate=60):
+        self.racetrack = racetrack
+        self.cars = list(cars)
+
+        self.maxFall = TrackFloor.maxFallSpeed / tickRate
+
+        # Center line of every segment: (startPoint, direction, squared length)
+        points = racetrack.points
+        N = len(points)
+
+        self.segments = []
+
+        # Distance along the center line (seen from the top) to the start of every segment
+        self.segmentStarts = []
+        self.trackLength = 0
+
+        for i in range(N):
+            x0, y0, z0 = points[i]
+            x1, y1, z1 = points[(i+1) % N]
+
+            dx, dy, dz = x1 - x0, y1 - y0, z1 - z0
+            self.segments.append(((x0, y0, z0), (dx, dy, dz), dx*dx + dy*dy))
+
+            self.segmentStarts.append(self.trackLength)
+            self.trackLength += math.sqrt(dx*dx + dy*dy)
+
+        # Cars further than this from the center line have left their segment
+        self.maxDistSquared = racetrack.defaultWallSpacing ** 2
+
+        # Segment each car is on
+        self.carSegments = [ None for car in self.cars ]
+
+    # Squared (horizontal) distance from the center line of segment i, and the height of the floor there
+    def getSegmentHeight(self, i, x, y):
+        (x0, y0, z0), (dx, dy, dz), lengthSquared = self.segments[i]
+
+        t = ((x - x0) * dx + (y - y0) * dy) / lengthSquared if lengthSquared > 0 else 0
+        t = max(0, min(t, 1))
+
+        px = x - (x0 + dx * t)
+        py = y - (y0 + dy * t)
+
+        return px*px + py*py, z0 + dz * t + TrackFloor.floorOffset
+
+    # Height of the floor at (x, y), and the segment it was found on
+    # Only the segments around the given one are checked (all of them if there is none)
+    def getHeight(self, x, y, segment=None):
+        N = len(self.segments)
+
+        if segment == None:
+            candidates = range(N)
+        else:
+            candidates = [ (segment-1) % N, segment, (segment+1) % N ]
+
+        best = None
+        for i in candidates:
+            distSquared, z = self.getSegmentHeight(i, x, y)
+
+            if best == None or distSquared < best[0]:
+                best = (distSquared, z, i)
+
+        distSquared, z, i = best
+
+        if distSquared > self.maxDistSquared and segment != None:
+            return self.getHeight(x, y)
+
+        return z, i
+
+    # Distance along the center line from the start line to (x, y) on the given segment
+    def getTrackDistance(self, x, y, segment):
+        (x0, y0, _), (dx, dy, _), lengthSquared = self.segments[segment]
+
+        t = ((x - x0) * dx + (y - y0) * dy) / lengthSquared if lengthSquared > 0 else 0
+        t = max(0, min(t, 1))
+
+        return self.segmentStarts[segment] + t * math.sqrt(lengthSquared)
+
+    # Put every car onto the floor
+    # Cars below the floor are lifted onto it at once; cars above it fall onto it
+    def update(self):
+        maxFall = self.maxFall
+
+        for i, car in enumerate(self.cars):
+            x, y, z = car.model.getPos()
+
+            floorZ, self.carSegments[i] = self.getHeight(x, y, self.carSegments[i])
+
+            if z > floorZ:
+                newZ = max(floorZ, z - maxFall)
+            else:
+                newZ = floorZ
+
+            if newZ != z:
+                car.model.setZ(newZ)
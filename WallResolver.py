@@ -0,0 +1,208 @@
+'''
+Analytic wall collisions
+
+Instead of testing every car against collision solids with the traverser,
+the walls are taken as thick lines along the left and right edges of the track
+(see Racetrack.getWallLines), and each car's footprint (its wall collision capsule,
+seen from the top) is tested against the walls of the segments around the one
+it is on (see TrackFloor), so the cost does not grow with the length of the track.
+
+Cars are pushed out of the walls horizontally, like the CollisionHandlerPusher did,
+and wall contact is reported to the cars directly (see Racecar.hitWall and leaveWall),
+without going through the messenger.
+
+Used when the racetrack is built with wallCollisions="analytic".
+'''
+
+from Obj3D import *
+
+# Parameters (between 0 and 1) of the closest points of 2D segments p0-p1 and q0-q1
+# Reference: Real-Time Collision Detection (Ericson), 5.1.9
+def closestPointsOfSegments(p0, p1, q0, q1):
+    d1x, d1y = p1[0] - p0[0], p1[1] - p0[1]
+    d2x, d2y = q1[0] - q0[0], q1[1] - q0[1]
+    rx, ry = p0[0] - q0[0], p0[1] - q0[1]
+
+    a = d1x*d1x + d1y*d1y
+    e = d2x*d2x + d2y*d2y
+    f = d2x*rx + d2y*ry
+
+    # Segments are points
+    if a == 0 and e == 0:
+        return 0, 0
+
+    if a == 0:
+        return 0, clamp(f / e, 0, 1)
+
+    c = d1x*rx + d1y*ry
+
+    if e == 0:
+        return clamp(-c / a, 0, 1), 0
+
+    b = d1x*d2x + d1y*d2y
+    denom = a*e - b*b
+
+    # Not parallel
+    s = clamp((b*f - c*e) / denom, 0, 1) if denom != 0 else 0
+
+    t = (b*s + f) / e
+    if t < 0:
+        t = 0
+        s = clamp(-c / a, 0, 1)
+    elif t > 1:
+        t = 1
+        s = clamp((b - c) / a, 0, 1)
+
+    return s, t
+
+def clamp(value, low, high):
+    return max(low, min(value, high))
+
+class WallResolver(object):
+    def __init__(self, racetrack, cars, trackFloor):
+        self.racetrack = racetrack
+        self.cars = list(cars)
+        self.trackFloor = trackFloor
+
+        # Walls are 2 crates high
+        self.wallHeight = racetrack.wallDim[2] * 2
+        self.halfThickness = racetrack.wallDim[0] / 2
+
+        # (startPoint, endPoint, (minX, maxX, minY, maxY))
+        self.walls = []
+
+        # Walls (indices) along each segment
+        N = len(racetrack.points)
+        segmentWalls = [ [] for i in range(N) ]
+
+        for side, i, startPoint, endPoint in racetrack.getWallLines():
+            x0, y0, _ = startPoint
+            x1, y1, _ = endPoint
+            h = self.halfThickness
+
+            bounds = (min(x0, x1) - h, max(x0, x1) + h, min(y0, y1) - h, max(y0, y1) + h)
+
+            segmentWalls[i].append(len(self.walls))
+            self.walls.append((startPoint, endPoint, bounds))
+
+        # Walls a car on each segment can touch: those of the segment and the segments on either side
+        # NOTE: In order, so that the cars are pushed out of them in the same order every time
+        self.nearbyWalls = [
+            sorted(set(segmentWalls[(i-1) % N] + segmentWalls[i] + segmentWalls[(i+1) % N]))
+            for i in range(N)
+        ]
+
+        self.footprints = [ self.getFootprint(car) for car in self.cars ]
+
+        # Walls each car touched in the last tick
+        self.contacts = [ set() for car in self.cars ]
+
+    # Ends and radius of the car's wall collision capsule, relative to the car
+    @staticmethod
+    def getFootprint(car):
+        colNode = car.getCollisionNode(car.getColNodeName("wall"))
+        capsule = colNode.node().getSolid(0)
+
+        mat = colNode.getMat(car.model)
+        pointA = mat.xformPoint(capsule.getPointA())
+        pointB = mat.xformPoint(capsule.getPointB())
+
+        # The car's own scale is applied with its transform every tick
+        radius = capsule.getRadius() * car.model.getSx()
+
+        return pointA, pointB, radius
+
+    # Push every car out of the walls it went into
+    def resolve(self):
+        for i, car in enumerate(self.cars):
+            contacts = self.resolveCar(car, self.footprints[i], self.trackFloor.carSegments[i])
+
+            # Like the "in" events of the pusher, a wall is only hit once
+            # (the car can then scrape along it)
+            for wall in sorted(contacts - self.contacts[i]):
+                car.hitWall(wall)
+
+            for wall in sorted(self.contacts[i] - contacts):
+                car.leaveWall(wall)
+
+            self.contacts[i] = contacts
+
+    # Returns the set of walls (indices) the car was pushed out of
+    # Only the walls around the segment the car is on are tested (all of them if there is none yet)
+    def resolveCar(self, car, footprint, segment=None):
+        pointA, pointB, radius = footprint
+
+        mat = car.model.getMat()
+        ax, ay, az = mat.xformPoint(pointA)
+        bx, by, bz = mat.xformPoint(pointB)
+
+        bottom = min(az, bz) - radius
+        top = max(az, bz) + radius
+
+        minDist = radius + self.halfThickness
+
+        shoveX = 0
+        shoveY = 0
+        contacts = set()
+
+        walls = self.nearbyWalls[segment] if segment != None else range(len(self.walls))
+
+        for j in walls:
+            startPoint, endPoint, bounds = self.walls[j]
+
+            # Far away
+            minX, maxX, minY, maxY = bounds
+            if max(ax, bx) + radius < minX or min(ax, bx) - radius > maxX or \
+               max(ay, by) + radius < minY or min(ay, by) - radius > maxY:
+                continue
+
+            s, t = closestPointsOfSegments((ax, ay), (bx, by), startPoint, endPoint)
+
+            x0, y0, z0 = startPoint
+            x1, y1, z1 = endPoint
+
+            carX = ax + (bx - ax) * s
+            carY = ay + (by - ay) * s
+            wallX = x0 + (x1 - x0) * t
+            wallY = y0 + (y1 - y0) * t
+
+            dx = carX - wallX
+            dy = carY - wallY
+            dist = math.sqrt(dx*dx + dy*dy)
+
+            if dist >= minDist:
+                continue
+
+            # Over (or under) the wall
+            wallZ = z0 + (z1 - z0) * t
+            if bottom > wallZ + self.wallHeight or top < wallZ:
+                continue
+
+            # Push away from the wall, or out to the side the car's center is on
+            # if the footprint is right on the center line of the wall
+            if dist > 1e-6:
+                nx, ny = dx / dist, dy / dist
+            else:
+                nx, ny = y1 - y0, x0 - x1
+                length = math.sqrt(nx*nx + ny*ny)
+                nx, ny = nx / length, ny / length
+
+                if ((ax + bx)/2 - x0) * nx + ((ay + by)/2 - y0) * ny < 0:
+                    nx, ny = -nx, -ny
+
+            depth = minDist - dist
+            ax += nx * depth
+            bx += nx * depth
+            ay += ny * depth
+            by += ny * depth
+
+            shoveX += nx * depth
+            shoveY += ny * depth
+
+            contacts.add(j)
+
+        if len(contacts) > 0:
+            x, y, z = car.model.getPos()
+            car.model.setPos(x + shoveX, y + shoveY, z)
+
+        return contacts
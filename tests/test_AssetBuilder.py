@@ -0,0 +1,122 @@
+'''
+Asset build tests
+
+Builds a small model directory from scratch, as on a fresh checkout (no
+manifest, nothing compiled yet), and then again, when nothing changed:
+    python -m unittest discover tests
+'''
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from panda3d.core import *
+
+assetBuilderFile = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "AssetBuilder.py")
+
+# A textured square, with enough vertices for the less detailed versions to have something to merge
+def writeModel(fileName, textureFile, size=4):
+    vertices = []
+    polygons = []
+
+    for y in range(size + 1):
+        for x in range(size + 1):
+            vertices.append(f"  <Vertex> {len(vertices)} {{ {x} {y} 0 <UV> {{ {x / size} {y / size} }} }}")
+
+    for y in range(size):
+        for x in range(size):
+            corners = [ y * (size + 1) + x, y * (size + 1) + x + 1, (y + 1) * (size + 1) + x + 1, (y + 1) * (size + 1) + x ]
+            polygons.append(
+                f"  <Polygon> {{ <TRef> {{ map }} <VertexRef> {{ {' '.join(str(i) for i in corners)} <Ref> {{ vertices }} }} }}"
+            )
+
+    with open(fileName, "w") as f:
+        f.write("<CoordinateSystem> { Z-Up }\n")
+        f.write(f"<Texture> map {{ \"{textureFile}\" }}\n")
+        f.write("<VertexPool> vertices {\n" + "\n".join(vertices) + "\n}\n")
+        f.write("<Group> square {\n" + "\n".join(polygons) + "\n}\n")
+
+class TestAssetBuilder(unittest.TestCase):
+    # NOTE: The builder runs in its own process, in the temporary directory, as Panda3D
+    # keeps the working directory it started in for the files it reads and writes
+    def setUp(self):
+        self.tempDir = tempfile.TemporaryDirectory()
+        self.modelDir = self.writeAssets("models")
+
+    def tearDown(self):
+        self.tempDir.cleanup()
+
+    # A model directory (in the temporary directory) with a car model and its texture
+    def writeAssets(self, modelDir):
+        modelDir = os.path.join(self.tempDir.name, modelDir)
+        os.makedirs(modelDir)
+
+        image = PNMImage(8, 8, 3)
+        image.fill(1, 0, 0)
+        self.assertTrue(image.write(Filename.fromOsSpecific(os.path.join(modelDir, "car_test.png"))))
+
+        writeModel(os.path.join(modelDir, "car_test.egg"), "car_test.png")
+
+        return modelDir
+
+    def build(self, modelDir="models"):
+        result = subprocess.run(
+            [ sys.executable, assetBuilderFile, "--models", modelDir, "--qualities", "low" ],
+            cwd=self.tempDir.name, capture_output=True, text=True
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+
+        return result.stdout.strip().splitlines()[-1]
+
+    def loadManifest(self, modelDir=None):
+        modelDir = self.modelDir if modelDir == None else modelDir
+
+        with open(os.path.join(modelDir, "manifest.json"), "r") as f:
+            return json.load(f)
+
+    # Everything compiled is in the model directory, where the game looks for it
+    def assertBuilt(self, modelDir):
+        self.assertTrue(os.path.exists(os.path.join(modelDir, "car_test.bam")))
+        self.assertTrue(os.path.exists(os.path.join(modelDir, "txo", "low", "car_test.png.txo")))
+        self.assertTrue(os.path.exists(os.path.join(modelDir, "lod", "car_test-1.bam")))
+
+    def testFreshBuild(self):
+        self.assertEqual(self.build(), "1 models, 1 textures and 1 sets of less detailed models compiled")
+        self.assertBuilt(self.modelDir)
+
+        manifest = self.loadManifest()
+        for kind in [ "models", "textures", "lods" ]:
+            self.assertEqual(len(manifest[kind]), 1)
+
+    def testNothingChanged(self):
+        self.build()
+
+        self.assertEqual(self.build(), "0 models, 0 textures and 0 sets of less detailed models compiled")
+
+    def testBrokenManifest(self):
+        with open(os.path.join(self.modelDir, "manifest.json"), "w") as f:
+            f.write("{")
+
+        self.assertEqual(self.build(), "1 models, 1 textures and 1 sets of less detailed models compiled")
+
+        self.assertIn("lods", self.loadManifest())
+
+    def testOtherModelDir(self):
+        shutil.rmtree(self.modelDir)
+        modelDir = self.writeAssets("assets")
+
+        self.assertEqual(self.build("assets"), "1 models, 1 textures and 1 sets of less detailed models compiled")
+        self.assertBuilt(modelDir)
+
+        self.assertFalse(os.path.exists(self.modelDir))
+        for kind in [ "textures", "lods" ]:
+            for entry in self.loadManifest(modelDir)[kind].values():
+                outputs = entry["outputs"] if kind == "lods" else [ entry["output"] ]
+                self.assertTrue(all(output.startswith("assets/") for output in outputs))
+
+if __name__ == "__main__":
+    unittest.main()
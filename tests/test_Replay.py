@@ -0,0 +1,161 @@
+'''
+Replay tests
+
+Records a seeded race without a window, saves it, loads it and plays it
+back, which has to give the same race (every checksum and lap time), so
+that a change to the physics or the AI cannot break the replays unnoticed:
+    python -m unittest discover tests
+'''
+
+import os
+import random
+import struct
+import sys
+import tempfile
+import unittest
+
+repoDir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The racetracks and models are found relative to the repository
+os.chdir(repoDir)
+sys.path.insert(0, repoDir)
+
+from Replay import *
+
+getModelPath().prependDirectory(Filename.fromOsSpecific(repoDir))
+
+class TestReplay(unittest.TestCase):
+    trackName = "test.track"
+    seed = 123
+    totalLaps = 1
+    carTypes = [ "Racecar", "SmartCar", "SmartGreedyCar", "NotSoStupidCar" ]
+
+    # At most, in case the player car does not finish
+    maxTicks = 60 * 30
+
+    def setUp(self):
+        self.tempDir = tempfile.TemporaryDirectory()
+        self.replayFile = os.path.join(self.tempDir.name, "test.replay")
+
+    def tearDown(self):
+        self.tempDir.cleanup()
+
+    # Race with the player car driven by seeded random controls, recorded to the replay file
+    # Returns the results of the race
+    def record(self):
+        race = HeadlessRace(self.trackName, self.carTypes, self.totalLaps, seed=self.seed)
+        simulation = race.simulation
+        recorder = ReplayRecorder(simulation, self.trackName, self.seed, self.totalLaps)
+
+        rng = random.Random(5)
+        player = race.cars[0]
+
+        while simulation.nTicks < self.maxTicks and not simulation.allCarsFinished():
+            if simulation.nTicks % 20 == 0:
+                player.controls["forward"] = rng.random() < 0.9
+                player.controls["turnLeft"] = rng.random() < 0.2
+                player.controls["turnRight"] = rng.random() < 0.2
+                player.controls["drifting"] = rng.random() < 0.1
+
+            simulation.tick()
+
+        results = race.getResults()
+        recorder.save(self.replayFile)
+        race.destroy()
+
+        return results
+
+    def testRoundTrip(self):
+        recorded = self.record()
+        replay = Replay.load(self.replayFile)
+
+        self.assertEqual(replay.nTicks, recorded["ticks"])
+        self.assertEqual(len(replay.checksums), recorded["ticks"] // replay.checksumInterval)
+        self.assertEqual([ carType for carType, _, _ in replay.cars ], self.carTypes)
+
+        played = playHeadless(replay)
+
+        self.assertTrue(played["verified"])
+        self.assertEqual(played["mismatchTick"], None)
+        self.assertEqual(played["ticks"], recorded["ticks"])
+        self.assertEqual(played["finishingOrder"], recorded["finishingOrder"])
+
+        for recordedCar, playedCar in zip(recorded["cars"], played["cars"]):
+            self.assertEqual(playedCar["finishTime"], recordedCar["finishTime"])
+            self.assertEqual(playedCar["lapTimes"], recordedCar["lapTimes"])
+            self.assertEqual(playedCar["checkpoints"], recordedCar["checkpoints"])
+
+        # Some car finished within the recording, so that there were finish times to compare
+        self.assertNotEqual(recorded["winner"], None)
+
+    # Playback notices when it no longer matches the recording
+    def testMismatch(self):
+        self.record()
+        replay = Replay.load(self.replayFile)
+
+        # The player car drives backwards for the first seconds instead
+        for tick in range(3 * replay.tickRate):
+            replay.controls[tick * len(replay.getRecordedCars())] = Replay.encodeControls({
+                "forward": False, "backward": True, "turnLeft": False, "turnRight": False, "drifting": False
+            })
+
+        played = playHeadless(replay)
+
+        self.assertFalse(played["verified"])
+        self.assertTrue(played["mismatchTick"] <= 3 * replay.tickRate)
+
+    # Offset of the number of cars in a replay file
+    @staticmethod
+    def getCarCountOffset(data):
+        offset = struct.calcsize("<4sHHHQIH")
+
+        # Track name and track file
+        for i in range(2):
+            length, = struct.unpack_from("<I", data, offset)
+            offset += 4 + length
+
+        return offset
+
+    # NOTE: The number of cars takes 2 bytes since version 3, as there can be more than 255
+    def testCarCount(self):
+        replay = Replay(self.trackName, "", self.seed)
+        for i in range(300):
+            replay.addCar("SmartCar", "sport", "chicken")
+
+        replay.save(self.replayFile)
+
+        with open(self.replayFile, "rb") as f:
+            data = f.read()
+
+        _, version = struct.unpack_from("<4sH", data, 0)
+        nCars, = struct.unpack_from("<H", data, TestReplay.getCarCountOffset(data))
+
+        self.assertEqual(version, 3)
+        self.assertEqual(nCars, 300)
+        self.assertEqual(len(Replay.load(self.replayFile).cars), 300)
+
+    # Replays from before version 3 keep the number of cars in a single byte
+    def testVersion2(self):
+        replay = Replay(self.trackName, "", self.seed)
+        for i in range(3):
+            replay.addCar("SmartCar", "sport", "chicken", { "maxSpeed": 1 } if i == 0 else None)
+
+        replay.save(self.replayFile)
+
+        with open(self.replayFile, "rb") as f:
+            data = bytearray(f.read())
+
+        offset = TestReplay.getCarCountOffset(data)
+        data[4:6] = struct.pack("<H", 2)
+        data[offset:offset+2] = struct.pack("<B", 3)
+
+        with open(self.replayFile, "wb") as f:
+            f.write(data)
+
+        loaded = Replay.load(self.replayFile)
+
+        self.assertEqual(loaded.cars, replay.cars)
+        self.assertEqual(loaded.driving, replay.driving)
+
+if __name__ == "__main__":
+    unittest.main()